@@ -0,0 +1,77 @@
+import json
+import tempfile
+
+import click
+
+from .harness import find_regressions, measure
+from .language import HashEmbeddings, get_benchmarks
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="1000,10000",
+    help="Comma-separated numbers of dictionary entries, e.g. 1000,10000,100000. Defaults to 1000,10000.",
+)
+@click.option(
+    "--only",
+    help="Comma-separated names of the benchmarks to run. Runs all of them by default.",
+)
+@click.option("--repeat", default=3, help="Times to run each benchmark. Defaults to 3.")
+@click.option(
+    "--dimensions",
+    default=384,
+    help="Size of the fake embeddings. Defaults to 384, like BAAI/bge-small-en.",
+)
+@click.option("--output", help="File to save the results to, as JSON.")
+@click.option(
+    "--compare",
+    "baseline_path",
+    help="Results saved with --output to compare against. Exits with an error if anything regressed.",
+)
+@click.option(
+    "--max-regression",
+    default=0.2,
+    help="Fraction by which time or memory may grow before it counts as a regression. Defaults to 0.2.",
+)
+def main(sizes, only, repeat, dimensions, output, baseline_path, max_regression):
+    """Benchmark the local parts of conlang-gpt, without the OpenAI API."""
+
+    embeddings_model = HashEmbeddings(dimensions)
+    names = None if only is None else only.split(",")
+
+    results = {}
+    click.echo(
+        f"{'Benchmark':<32} {'Min (s)':>10} {'Median (s)':>10} {'Peak (MB)':>10}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [int(size) for size in sizes.split(",")]:
+            benchmarks = get_benchmarks(size, embeddings_model, directory)
+            for name, (setup, run) in benchmarks.items():
+                if names is not None and name not in names:
+                    continue
+
+                result = measure(setup, run, repeat)
+                key = f"{name}[{size}]"
+                results[key] = result
+                click.echo(
+                    f"{key:<32} {result['min']:>10.4f} {result['median']:>10.4f} {result['peak_memory_mb']:>10.1f}"
+                )
+
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline_path is not None:
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+
+        regressions = find_regressions(results, baseline, max_regression)
+        for regression in regressions:
+            click.echo(click.style(regression, fg="red"), err=True)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import contextlib
+import io
+import statistics
+import time
+import tracemalloc
+
+
+def measure(setup, run, repeat=3):
+    """
+    Measure the time and peak memory of a benchmark.
+
+    The benchmark is timed repeat times, and then run once more while
+    tracing memory allocations, since tracing slows it down. Output is
+    discarded.
+    """
+
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            args = setup()
+            start = time.perf_counter()
+            run(*args)
+            times.append(time.perf_counter() - start)
+
+        args = setup()
+        tracemalloc.start()
+        try:
+            run(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "peak_memory_mb": peak / 1_000_000,
+    }
+
+
+def find_regressions(results, baseline, max_regression):
+    """
+    Compare results against a baseline.
+
+    Returns a message for each benchmark whose fastest time or peak memory
+    grew by more than the max_regression fraction.
+    """
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ["min", "peak_memory_mb"]:
+            before = baseline[name][metric]
+            after = result[metric]
+            if before > 0 and after > before * (1 + max_regression):
+                regressions.append(
+                    f"{name}: {metric} went from {before:.4g} to {after:.4g}"
+                )
+    return regressions
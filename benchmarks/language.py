@@ -0,0 +1,187 @@
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+from conlang_gpt.index import VectorStore
+from conlang_gpt.language import (
+    Dictionary,
+    _get_related_words,
+    _parse_dictionary,
+    load_dictionary,
+    merge_dictionaries,
+    reduce_dictionary,
+    save_dictionary,
+)
+
+SYLLABLES = ["ka", "lo", "mi", "te", "su", "ra", "ne", "vi", "po", "xu"]
+
+# Number of words in the generated text and in the new words to merge
+TEXT_SIZE = 50
+NEW_WORDS = 100
+
+# Number of words in the generated document, and of distinct words in it that
+# are not in the dictionary
+DOCUMENT_SIZE = 5000
+UNKNOWN_WORDS = 50
+
+# Similarity threshold used to reduce and merge words
+SIMILARITY_THRESHOLD = 0.98
+
+
+class HashEmbeddings:
+    """
+    Deterministic, offline stand-in for the embeddings model.
+
+    Each text gets a random vector seeded by its hash, so equal texts have
+    equal vectors and embedding costs almost nothing next to the code being
+    measured.
+    """
+
+    model_name = "hash"
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+        return rng.standard_normal(self.dimensions, dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(f"query: {text}")
+
+
+def make_word(i):
+    """Return a distinct conlang word for each number."""
+
+    word = ""
+    while True:
+        i, digit = divmod(i, len(SYLLABLES))
+        word += SYLLABLES[digit]
+        if i == 0:
+            return word
+
+
+def make_dictionary(size, offset=0):
+    """Return a synthetic dictionary with the given number of entries."""
+
+    return {make_word(i): f"meaning{i}" for i in range(offset, offset + size)}
+
+
+def embed_dictionary(dictionary, embeddings_model):
+    """Return the dictionary with all its embeddings already in its store."""
+
+    store = VectorStore()
+    words = list(dictionary.keys())
+    translations = list(dictionary.values())
+    store.get(words + translations, embeddings_model)
+    store.get(translations, embeddings_model, query=True)
+    return Dictionary(dictionary, embeddings=store)
+
+
+def get_benchmarks(size, embeddings_model, directory):
+    """
+    Return the benchmarks for a dictionary of the given size, by name.
+
+    Each benchmark is a (setup, run) pair. setup returns the arguments for
+    run, and is not measured.
+    """
+
+    dictionary = embed_dictionary(make_dictionary(size), embeddings_model)
+    translations = list(dictionary.values())
+    rng = np.random.default_rng(0)
+
+    # Text made of words that are in the dictionary
+    text = " ".join(rng.choice(translations, TEXT_SIZE))
+
+    # A long document that repeats a few hundred words, some of which are not
+    # in the dictionary, with punctuation and capitals
+    vocabulary = list(rng.choice(translations, 300)) + [
+        f"unknown{i}" for i in range(UNKNOWN_WORDS)
+    ]
+    document = " ".join(
+        f"{word.capitalize()}," if i % 7 == 0 else word
+        for i, word in enumerate(rng.choice(vocabulary, DOCUMENT_SIZE))
+    )
+
+    # New words, as generated for a text
+    new_words = make_dictionary(NEW_WORDS, offset=size)
+
+    # A response listing every word in the dictionary
+    response = "Conlang,English\n" + "\n".join(
+        f"{word},{translation}" for word, translation in dictionary.items()
+    )
+
+    # The dictionary saved to disk, to load
+    saved_path = os.path.join(directory, f"saved-{size}.csv")
+    save_dictionary(dictionary, saved_path)
+    saved_database_path = os.path.join(directory, f"saved-{size}.db")
+    save_dictionary(dictionary, saved_database_path)
+
+    # A copy of the saved database, loaded with one word changed
+    def changed_database():
+        path = os.path.join(directory, f"changed-{size}.db")
+        shutil.copyfile(saved_database_path, path)
+        changed = load_dictionary(path)
+        changed[next(iter(changed))] = "changed"
+        return path, changed
+
+    def fresh_path(extension=".csv"):
+        fresh_path.count += 1
+        return (
+            os.path.join(directory, f"dictionary-{size}-{fresh_path.count}{extension}"),
+        )
+
+    fresh_path.count = 0
+
+    return {
+        "related_words": (
+            lambda: (),
+            lambda: _get_related_words(text, dictionary, embeddings_model),
+        ),
+        "related_words_document": (
+            lambda: (),
+            lambda: _get_related_words(document, dictionary, embeddings_model),
+        ),
+        "reduce_dictionary": (
+            # Reduce a copy, since words are removed in place
+            lambda: (Dictionary(dictionary, embeddings=dictionary.embeddings),),
+            lambda words: reduce_dictionary(
+                words, SIMILARITY_THRESHOLD, embeddings_model
+            ),
+        ),
+        "merge_dictionaries": (
+            lambda: (),
+            lambda: merge_dictionaries(
+                dictionary, new_words, SIMILARITY_THRESHOLD, embeddings_model
+            ),
+        ),
+        "parse_dictionary": (
+            lambda: (),
+            lambda: _parse_dictionary(response, SIMILARITY_THRESHOLD, embeddings_model),
+        ),
+        "save_dictionary": (
+            fresh_path,
+            lambda path: save_dictionary(dictionary, path),
+        ),
+        "load_dictionary": (
+            lambda: (),
+            lambda: load_dictionary(saved_path),
+        ),
+        "save_dictionary_sqlite": (
+            lambda: fresh_path(".db"),
+            lambda path: save_dictionary(dictionary, path),
+        ),
+        "update_dictionary_sqlite": (
+            changed_database,
+            lambda path, changed: save_dictionary(changed, path),
+        ),
+        "load_dictionary_sqlite": (
+            lambda: (),
+            lambda: load_dictionary(saved_database_path),
+        ),
+    }
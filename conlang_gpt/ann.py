@@ -0,0 +1,360 @@
+import json
+import os
+import time
+import weakref
+
+import numpy as np
+
+from .index import DictionaryIndex, VectorStore, normalize
+from .quantize import Codec
+
+# Dictionaries with at least this many entries use an approximate index by
+# default
+MIN_ENTRIES = 100_000
+
+# The lists are trained again when their number is this many times more or
+# less than the target for the number of entries, or when more than this
+# share of the indexed entries were removed
+MAX_LIST_RATIO = 2
+MAX_DEAD_SHARE = 0.5
+
+
+def _kmeans(vectors, n_clusters, n_iterations=10, seed=0):
+    """Cluster normalized vectors by cosine similarity (spherical k-means)."""
+
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(n_iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # Keep the previous centroid for clusters that lost all their vectors
+        empty = ~np.bincount(assignments, minlength=n_clusters).astype(bool)
+        sums[empty] = centroids[empty]
+        centroids = normalize(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index over a dictionary (inverted file).
+
+    The word and translation vectors are clustered into n_lists lists. A query
+    is only compared against the vectors in the n_probe lists whose centroids
+    are closest to it. Raising n_probe improves recall at the cost of latency;
+    probing every list is equivalent to an exact search.
+
+    Entries can be added and removed after the index is built. The lists are
+    trained the first time entries are added, and trained again when the
+    dictionary outgrows them or most entries were removed. The vectors in the
+    lists are kept with the precision of the codec, and decoded when they are
+    probed.
+
+    An index can be saved next to its dictionary and loaded again, so that
+    the lists are not trained on every run.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, sample_size=50_000, seed=0, codec=None):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.sample_size = sample_size
+        self.seed = seed
+        self.codec = Codec() if codec is None else codec
+
+        # The dictionary entries that are indexed, by id
+        self.words = []
+        self.entries = {}
+        self._ids = {}
+        self._alive = np.zeros(0, dtype=bool)
+
+        self.centroids = None
+        self._list_ids = []
+        self._list_vectors = []
+
+        # Whether the index changed since it was loaded or saved
+        self.changed = False
+        # The dictionary the index was last updated with
+        self._source = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _reset(self):
+        self.__init__(
+            self.n_lists, self.n_probe, self.sample_size, self.seed, self.codec
+        )
+
+    def _target_lists(self, n_entries):
+        if self.n_lists is not None:
+            return self.n_lists
+        # Each entry has a word and a translation vector
+        return max(1, int(4 * np.sqrt(n_entries)))
+
+    def _needs_training(self, n_entries):
+        """Whether the lists no longer suit a dictionary of n_entries entries."""
+
+        if self.centroids is None:
+            return False
+        if len(self._alive) and 1 - len(self.entries) / len(self._alive) > (
+            MAX_DEAD_SHARE
+        ):
+            return True
+
+        # Small dictionaries cannot have as many lists as the target
+        target = min(self._target_lists(n_entries), 2 * n_entries)
+        n_lists = len(self.centroids)
+        if self.n_lists is not None:
+            return n_lists != target
+        return n_lists * MAX_LIST_RATIO < target or n_lists > target * MAX_LIST_RATIO
+
+    def save(self, path, store):
+        """Save the index, with the model and codec of its embeddings store."""
+
+        list_ids = self._list_ids or [np.zeros(0, dtype=np.int64)]
+        metadata = {
+            "model": store.model_name,
+            "codec": store.codec.to_json(),
+            "words": self.words,
+            "entries": self.entries,
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(
+                file,
+                metadata=np.frombuffer(json.dumps(metadata).encode("utf-8"), np.uint8),
+                centroids=self.centroids,
+                alive=self._alive,
+                list_sizes=np.array([len(ids) for ids in self._list_ids]),
+                list_ids=np.concatenate(list_ids),
+                list_vectors=np.concatenate(self._list_vectors),
+            )
+        os.replace(temp_path, path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path, store, **options):
+        """
+        Load an index saved with save.
+
+        Returns None if there is no saved index, or if it was built from the
+        embeddings of another model or codec than those in the store.
+        """
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                metadata = json.loads(bytes(data["metadata"]).decode("utf-8"))
+                arrays = {key: data[key] for key in data.files if key != "metadata"}
+        except (OSError, ValueError, KeyError):
+            # The index is damaged, so it is built again
+            return None
+
+        if metadata["model"] != store.model_name or (
+            Codec.from_json(metadata["codec"]) != store.codec
+        ):
+            return None
+
+        index = cls(**options)
+        index.codec = Codec(store.codec.precision)
+        index.words = metadata["words"]
+        index.entries = metadata["entries"]
+        index._alive = arrays["alive"]
+        index._ids = {word: i for i, word in enumerate(index.words) if index._alive[i]}
+        index.centroids = arrays["centroids"]
+        bounds = np.cumsum(arrays["list_sizes"])[:-1]
+        index._list_ids = np.split(arrays["list_ids"], bounds)
+        index._list_vectors = np.split(arrays["list_vectors"], bounds)
+        return index
+
+    def _train(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.sample_size:
+            sample = vectors[rng.choice(len(vectors), self.sample_size, replace=False)]
+        else:
+            sample = vectors
+
+        n_lists = max(1, min(self._target_lists(len(vectors) // 2), len(sample)))
+        self.centroids = _kmeans(sample, n_lists, seed=self.seed)
+        dimensions = vectors.shape[1]
+        self._list_ids = [np.zeros(0, dtype=np.int64) for _ in range(n_lists)]
+        self._list_vectors = [
+            np.zeros((0, dimensions), dtype=self.codec.dtype) for _ in range(n_lists)
+        ]
+
+    def add(self, entries, word_vectors, translation_vectors):
+        """Add dictionary entries (a mapping of word to translation)."""
+
+        words = list(entries)
+        if not words:
+            return
+
+        self.changed = True
+        self.remove([word for word in words if word in self.entries])
+        ids = np.arange(len(self.words), len(self.words) + len(words))
+        for word, entry_id in zip(words, ids):
+            self._ids[word] = entry_id
+            self.entries[word] = entries[word]
+        self.words.extend(words)
+        self._alive = np.concatenate([self._alive, np.ones(len(words), dtype=bool)])
+
+        vectors = np.vstack([normalize(word_vectors), normalize(translation_vectors)])
+        ids = np.concatenate([ids, ids])
+        if self.centroids is None:
+            self._train(vectors)
+
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+        for i in np.unique(assignments):
+            in_list = assignments == i
+            self._list_ids[i] = np.concatenate([self._list_ids[i], ids[in_list]])
+            self._list_vectors[i] = np.vstack(
+                [self._list_vectors[i], self.codec.quantize(vectors[in_list])]
+            )
+
+    def remove(self, words):
+        """Remove dictionary entries by word."""
+
+        for word in words:
+            self._alive[self._ids.pop(word)] = False
+            del self.entries[word]
+            self.changed = True
+
+    def update(self, dictionary, embeddings_model, store=None, words=None):
+        """
+        Add, change and remove entries so that the index matches a dictionary.
+
+        If words are given, they are the only words that changed since the
+        index was last updated with the same dictionary, so only those are
+        compared. Otherwise, every entry is compared.
+        """
+
+        if store is None:
+            store = VectorStore()
+        if self.centroids is None:
+            # Keep the list vectors as precise as the stored embeddings
+            self.codec = Codec(store.codec.precision)
+
+        # Only trust the changed words if they are relative to this dictionary
+        if self._source is None or self._source() is not dictionary:
+            words = None
+
+        if words is None:
+            removed = [
+                word
+                for word, translation in self.entries.items()
+                if dictionary.get(word) != translation
+            ]
+        else:
+            removed = [
+                word
+                for word in words
+                if word in self.entries and dictionary.get(word) != self.entries[word]
+            ]
+        self.remove(removed)
+        if self._needs_training(len(dictionary)):
+            # Train new lists on the whole dictionary
+            self._reset()
+            self.changed = True
+            words = None
+        if words is None:
+            words = dictionary
+        added = {
+            word: dictionary[word]
+            for word in words
+            if word in dictionary and word not in self.entries
+        }
+        if added:
+            added_words = list(added.keys())
+            vectors = store.get(added_words + list(added.values()), embeddings_model)
+            self.add(added, vectors[: len(added_words)], vectors[len(added_words) :])
+
+        try:
+            self._source = weakref.ref(dictionary)
+        except TypeError:
+            # Plain dicts cannot be referenced weakly, so they are always
+            # compared in full
+            self._source = None
+
+    def search(self, queries, k=1, min_similarity=None):
+        """
+        Find approximately the k most similar entries for each query.
+
+        Returns one list of (word, similarity) pairs per query, best first.
+        Entries less similar than min_similarity are left out.
+        """
+
+        if not self.entries:
+            return [[] for _ in range(len(queries))]
+
+        queries = normalize(queries)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)
+
+        results = []
+        for query, lists in zip(queries, probes[:, :n_probe]):
+            ids = np.concatenate([self._list_ids[i] for i in lists])
+            similarities = np.concatenate(
+                [self.codec.decode(self._list_vectors[i]) @ query for i in lists]
+            )
+            alive = self._alive[ids]
+            ids = ids[alive]
+            similarities = similarities[alive]
+
+            # Keep the best row of each entry, breaking ties by entry order
+            order = np.lexsort((ids, -similarities))
+            _, first = np.unique(ids[order], return_index=True)
+            best = order[np.sort(first)][:k]
+
+            matches = [(self.words[ids[i]], float(similarities[i])) for i in best]
+            if min_similarity is not None:
+                matches = [
+                    (word, similarity)
+                    for word, similarity in matches
+                    if similarity >= min_similarity
+                ]
+            results.append(matches)
+
+        return results
+
+
+def measure_recall(dictionary, queries, embeddings_model, n_probes, k=10, **options):
+    """
+    Compare approximate searches against an exact search of a dictionary.
+
+    Returns a list of (n_probe, recall, seconds per query) tuples, where
+    recall is the fraction of the exact top-k entries that were found.
+    """
+
+    if not queries or not dictionary:
+        raise ValueError("Recall needs at least one query and one entry.")
+
+    store = getattr(dictionary, "embeddings", None)
+    if store is None:
+        store = VectorStore()
+
+    query_vectors = store.get(queries, embeddings_model)
+    exact = DictionaryIndex.from_dictionary(dictionary, embeddings_model, store)
+    expected = [
+        set(word for word, _ in matches) for matches in exact.search(query_vectors, k=k)
+    ]
+
+    approximate = IVFIndex(**options)
+    approximate.update(dictionary, embeddings_model, store)
+
+    results = []
+    for n_probe in n_probes:
+        approximate.n_probe = n_probe
+        start = time.perf_counter()
+        matches = approximate.search(query_vectors, k=k)
+        elapsed = time.perf_counter() - start
+
+        found = sum(
+            len(expected_words & set(word for word, _ in query_matches))
+            for expected_words, query_matches in zip(expected, matches)
+        )
+        total = sum(len(expected_words) for expected_words in expected)
+        results.append((n_probe, found / total, elapsed / len(queries)))
+
+    return results
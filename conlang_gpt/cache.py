@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Cache of chat completions, keyed by a hash of the request.
+
+    Completions are memoized in memory and stored in a SQLite database on
+    disk. When the database grows beyond max_size bytes, the least recently
+    used completions are evicted.
+
+    Requests with a non-zero temperature are random, so they are only cached
+    if cache_random is set.
+    """
+
+    def __init__(self, path, max_size=100_000_000, cache_random=False):
+        self.path = path
+        self.max_size = max_size
+        self.cache_random = cache_random
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)"
+            )
+        return self._connection
+
+    def is_cacheable(self, request):
+        """Return whether the completion of a request may be cached."""
+
+        if request.get("stream"):
+            return False
+
+        # OpenAI defaults to a temperature of 1
+        return self.cache_random or request.get("temperature", 1) == 0
+
+    @staticmethod
+    def key(request):
+        """Hash the model, messages and sampling parameters of a request."""
+
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, request):
+        """Return the cached completion of a request, or None."""
+
+        if not self.is_cacheable(request):
+            return None
+
+        key = self.key(request)
+        with self._lock:
+            if key in self._memo:
+                self.hits += 1
+                return self._memo[key]
+
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            # Mark the completion as recently used
+            with connection:
+                connection.execute(
+                    "UPDATE completions SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+
+            self.hits += 1
+            completion = json.loads(row[0])
+            self._memo[key] = completion
+            return completion
+
+    def put(self, request, completion):
+        """Cache the completion of a request."""
+
+        if not self.is_cacheable(request):
+            return
+
+        key = self.key(request)
+        value = json.dumps(completion)
+        with self._lock:
+            self._memo[key] = completion
+
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time()),
+                )
+                self._evict(connection)
+
+    def _evict(self, connection):
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+
+        # Delete the least recently used completions until the cache fits
+        rows = connection.execute(
+            "SELECT key, size FROM completions ORDER BY last_used"
+        )
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM completions WHERE key = ?", evicted)
+
+    def clear(self):
+        """Remove all cached completions."""
+
+        with self._lock:
+            self._memo.clear()
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM completions")
+
+
+class EmbeddingCache:
+    """
+    Cache of embeddings, keyed by a hash of the model and text.
+
+    Embeddings are packed as raw bytes in a single SQLite database on disk,
+    with the max_entries most recently used ones also kept in memory. Gets
+    and puts work on many keys at once, so each batch of texts costs one
+    query. When the database grows beyond max_size bytes, the least recently
+    used embeddings are evicted.
+    """
+
+    # Max number of keys in one query, below SQLite's limit on parameters
+    BATCH_SIZE = 500
+
+    # Seconds during which an embedding counts as recently used
+    RECENT = 3600
+
+    def __init__(self, path, max_entries=20_000, max_size=1_000_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+        return self._connection
+
+    @staticmethod
+    def key(namespace, text, query=False):
+        """Hash the model, text and kind of an embedding."""
+
+        kind = "query" if query else "document"
+        return hashlib.sha1(f"{namespace}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value):
+        self._memo[key] = value
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+
+    def get_many(self, keys):
+        """Return the cached embeddings of the keys that are cached, by key."""
+
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    found[key] = self._memo[key]
+                else:
+                    missing.append(key)
+
+            if missing:
+                connection = self._connect()
+                with connection:
+                    for start in range(0, len(missing), self.BATCH_SIZE):
+                        batch = missing[start : start + self.BATCH_SIZE]
+                        placeholders = ", ".join("?" * len(batch))
+                        rows = connection.execute(
+                            f"SELECT key, value, last_used FROM embeddings WHERE key IN ({placeholders})",
+                            batch,
+                        ).fetchall()
+
+                        # Mark the embeddings as recently used. Recency only
+                        # matters for eviction, so embeddings used in the last
+                        # hour are not written again.
+                        now = time.time()
+                        stale = [
+                            (now, key)
+                            for key, _, last_used in rows
+                            if last_used < now - self.RECENT
+                        ]
+                        connection.executemany(
+                            "UPDATE embeddings SET last_used = ? WHERE key = ?", stale
+                        )
+
+                        for key, value, _ in rows:
+                            found[key] = value
+                            self._remember(key, value)
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, values):
+        """Cache embeddings, given as bytes by key."""
+
+        with self._lock:
+            for key, value in values.items():
+                self._remember(key, value)
+
+            connection = self._connect()
+            with connection:
+                now = time.time()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(key, value, now) for key, value in values.items()],
+                )
+                self._evict(connection)
+
+    def _get_size(self, connection):
+        """Return the bytes used by the database, without scanning it."""
+
+        (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+        (free_pages,) = connection.execute("PRAGMA freelist_count").fetchone()
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, connection):
+        excess = self._get_size(connection) - self.max_size
+        if excess <= 0:
+            return
+
+        # Delete the least recently used embeddings until the cache fits
+        rows = connection.execute(
+            "SELECT key, length(key) + length(value) FROM embeddings ORDER BY last_used"
+        )
+        evicted = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        for (key,) in evicted:
+            self._memo.pop(key, None)
+
+    def compact(self):
+        """Evict embeddings beyond max_size and give the freed space back."""
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._evict(connection)
+            connection.execute("VACUUM")
+
+    def clear(self):
+        """Remove all cached embeddings."""
+
+        with self._lock:
+            self._memo.clear()
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM embeddings")
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from collections import deque
+
+import click
+
+from . import openai
+
+
+def get_checkpoint_path(command, dictionary_path):
+    """Return the journal of a command, which is kept next to its dictionary."""
+
+    return f"{dictionary_path}.{command}.journal.jsonl"
+
+
+def get_state(guide, dictionary, model):
+    """
+    Return a fingerprint of a guide and dictionary, and of the models that
+    change them (model and the routes of each stage).
+    """
+
+    routes = sorted((stage, list(route)) for stage, route in openai.routes.items())
+    state = hashlib.sha1(json.dumps([model, routes]).encode("utf-8"))
+    state.update(guide.encode("utf-8"))
+    for word, translation in sorted(dictionary.items()):
+        state.update(f"\0{word}\0{translation}".encode("utf-8"))
+    return state.hexdigest()
+
+
+def _read_records(path):
+    """Read a journal, ignoring a last record that was only partly written."""
+
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+class Checkpoint:
+    """
+    Journal of the steps of a command that have finished.
+
+    Each step's result is appended to the journal as soon as it is known, so
+    that when a command is interrupted and run again with resume set, the
+    steps that already finished return their journaled results instead of
+    calling the OpenAI API again. Steps must be run in the same order as
+    before.
+
+    Resuming starts from the last "start" or "saved" record whose state
+    matches the state the command starts from now, so a journal does not
+    replay over a guide or dictionary that changed since, or results of other
+    models. Without a path, nothing is journaled.
+    """
+
+    def __init__(self, path, state, resume=False):
+        self.path = path
+        self.resumed_from = None
+
+        # Records that are kept, and records that are waiting to be replayed
+        self._records = []
+        self._replay = deque()
+
+        records = _read_records(path) if resume and path is not None else []
+        for i in reversed(range(len(records))):
+            record = records[i]
+            if (
+                record["step"] in ("start", "saved")
+                and record["result"]["state"] == state
+            ):
+                self._records = records[: i + 1]
+                self._replay = deque(records[i + 1 :])
+                self.resumed_from = record["result"]
+                break
+
+        if resume and path is not None:
+            if self.resumed_from is None:
+                click.echo(
+                    click.style(
+                        "No checkpoint matches the current guide, dictionary and models. Starting over.",
+                        fg="yellow",
+                    )
+                )
+            else:
+                click.echo(
+                    click.style(
+                        f"Resuming from checkpoint ({len(self._replay)} step(s) to replay).",
+                        dim=True,
+                    )
+                )
+
+        if self.resumed_from is None:
+            self._records = [{"step": "start", "result": {"state": state}}]
+        self._rewrite()
+
+    def _rewrite(self):
+        """Replace the journal with the kept records and those left to replay."""
+
+        if self.path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            for record in self._records + list(self._replay):
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _append(self, record):
+        if self._replay:
+            # A step ran instead of being replayed, so the rest of the journal
+            # does not apply
+            self._replay.clear()
+            self._rewrite()
+
+        self._records.append(record)
+        if self.path is None:
+            return
+
+        # Write each record with one call and sync it, so that a crash leaves
+        # at most one partly written record, which is ignored
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _pop(self, step, key=None):
+        """Return the next record to replay if it is for this step, or None."""
+
+        if not self._replay:
+            return None
+
+        record = self._replay[0]
+        if record["step"] != step or record.get("key") != key:
+            # The command took another path than before, so the rest of the
+            # journal does not apply
+            self._replay.clear()
+            self._rewrite()
+            return None
+
+        self._replay.popleft()
+        self._records.append(record)
+        return record
+
+    def step(self, step, function, key=None):
+        """
+        Run a step, or return its journaled result if it already finished.
+
+        The result must be serializable as JSON. key identifies what the
+        step was run on, if the same step is run on several inputs.
+        """
+
+        record = self._pop(step, key)
+        if record is not None:
+            return record["result"]
+
+        result = function()
+        record = {"step": step, "result": result}
+        if key is not None:
+            record["key"] = key
+        self._append(record)
+        return result
+
+    def parts(self, step):
+        """
+        Return the journaled results of the parts of a step, by part.
+
+        Parts are finished independently of each other, in any order, such as
+        the batches of words improved concurrently.
+        """
+
+        parts = {}
+        while self._replay and self._replay[0]["step"] == step:
+            record = self._pop(step, self._replay[0].get("key"))
+            parts[record["key"]] = record["result"]
+        return parts
+
+    def record_part(self, step, part, result):
+        """Journal the result of one part of a step."""
+
+        self._append({"step": step, "key": part, "result": result})
+
+    def saved(self, state, **details):
+        """
+        Record that the guide and dictionary were saved.
+
+        Resuming from a state saved later starts from this record, with
+        details in resumed_from.
+        """
+
+        self._records = [{"step": "saved", "result": dict(details, state=state)}]
+        self._rewrite()
+
+    def finish(self):
+        """Delete the journal once the command has finished."""
+
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,14 +1,162 @@
+import os
+
 import click
 
-from .command.create import create as create_
-from .command.improve import improve as improve_
-from .command.modify import modify as modify_
-from .command.translate import translate as translate_
+from .cache import ResponseCache
+from .embeddings import RUNTIMES, set_embeddings_runtime
+from .guide import DEFAULT_TOKEN_BUDGET, set_token_budget
+from .openai import (
+    STAGES,
+    parse_route,
+    set_rate_limiter,
+    set_response_cache,
+    set_routes,
+)
+from .ratelimit import RateLimiter
+from .trace import Tracer, set_tracer, span
+
+# Commands import their implementations when they run, so that the CLI starts
+# without loading numpy, OpenAI or the embeddings model.
+
+
+def _parse_routes(ctx, param, value):
+    try:
+        return dict(parse_route(route) for route in value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
 
 
 @click.group()
-def cli():
-    pass
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Cache OpenAI responses to repeated requests. Defaults to --cache.",
+)
+@click.option(
+    "--cache-size",
+    default=100,
+    help="Max size of the response cache in megabytes. Defaults to 100.",
+)
+@click.option(
+    "--cache-random/--no-cache-random",
+    default=False,
+    help="Also cache responses to requests with a non-zero temperature. Defaults to --no-cache-random.",
+)
+@click.option(
+    "--requests-per-minute",
+    type=int,
+    default=None,
+    help="Max number of OpenAI requests per minute. Unlimited by default.",
+)
+@click.option(
+    "--tokens-per-minute",
+    type=int,
+    default=None,
+    help="Max number of OpenAI tokens per minute. Unlimited by default.",
+)
+@click.option(
+    "--rate-limit-state",
+    default=os.path.join(".conlang", "rate-limit.json"),
+    help="File that tracks the rate limits, shared by every command that uses it. Defaults to .conlang/rate-limit.json, next to the caches.",
+)
+@click.option(
+    "--guide-budget",
+    default=DEFAULT_TOKEN_BUDGET,
+    help=f"Max number of tokens of the language guide to include in translation and vocabulary prompts. Longer guides are trimmed to their most relevant sections. 0 always includes the whole guide. Defaults to {DEFAULT_TOKEN_BUDGET}.",
+)
+@click.option(
+    "--route",
+    "routes",
+    multiple=True,
+    callback=_parse_routes,
+    metavar="STAGE=MODEL[@BASE_URL]",
+    help="Use another model, and optionally another OpenAI-compatible server, for one stage of the commands instead of --model. Can be repeated. Stages: "
+    + "; ".join(f"{stage} ({description})" for stage, description in STAGES.items())
+    + ".",
+)
+@click.option(
+    "--embeddings-runtime",
+    type=click.Choice(RUNTIMES),
+    default="torch",
+    help="How to run the embeddings model on the CPU: full precision, or with int8 weights, which is faster and close to full precision (see conlang embeddings check). Defaults to torch.",
+)
+@click.option(
+    "--embeddings-threads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of CPU threads to run the embeddings model on. Defaults to one per core.",
+)
+@click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Record how long each phase takes, save it as a Chrome trace (e.g. out.json) and print a summary.",
+)
+@click.option(
+    "--trace-memory/--no-trace-memory",
+    default=False,
+    help="Also record the peak memory of each phase when tracing. Slows commands down. Defaults to --no-trace-memory.",
+)
+@click.pass_context
+def cli(
+    ctx,
+    cache,
+    cache_size,
+    cache_random,
+    requests_per_minute,
+    tokens_per_minute,
+    rate_limit_state,
+    guide_budget,
+    routes,
+    embeddings_runtime,
+    embeddings_threads,
+    trace_path,
+    trace_memory,
+):
+    set_token_budget(guide_budget or None)
+    set_routes(routes)
+    set_embeddings_runtime(embeddings_runtime, embeddings_threads)
+
+    if trace_path is not None:
+        tracer = Tracer(memory=trace_memory)
+        set_tracer(tracer)
+
+        def save_trace():
+            tracer.save(trace_path)
+            click.echo(tracer.summary(), err=True)
+            click.echo(click.style(f"Trace saved to {trace_path}.", dim=True), err=True)
+
+        ctx.call_on_close(save_trace)
+        # Record the whole command too. This is closed before the trace is saved.
+        ctx.with_resource(span(ctx.invoked_subcommand or "conlang"))
+
+    if requests_per_minute or tokens_per_minute:
+        set_rate_limiter(
+            RateLimiter(requests_per_minute, tokens_per_minute, rate_limit_state)
+        )
+
+    if not cache:
+        set_response_cache(None)
+        return
+
+    response_cache = ResponseCache(
+        os.path.join(".conlang", "cache", "completions.db"),
+        max_size=cache_size * 1_000_000,
+        cache_random=cache_random,
+    )
+    set_response_cache(response_cache)
+
+    def report_cache_usage():
+        if response_cache.hits or response_cache.misses:
+            click.echo(
+                click.style(
+                    f"Response cache: {response_cache.hits} hit(s), {response_cache.misses} miss(es).",
+                    dim=True,
+                ),
+                err=True,
+            )
+
+    ctx.call_on_close(report_cache_usage)
 
 
 @cli.command()
@@ -24,6 +172,8 @@ def cli():
 def create(design_goals, guide_path, model):
     """Create a constructed language."""
 
+    from .command.create import create as create_
+
     create_(design_goals, guide_path, model)
 
 
@@ -48,15 +198,56 @@ def create(design_goals, guide_path, model):
     default="chatgpt-4o-latest",
     help="OpenAI model to use. Defaults to chatgpt-4o-latest.",
 )
-def modify(guide_path, dictionary_path, changes, similarity_threshold, model):
+@click.option(
+    "--max-concurrency",
+    default=4,
+    help="Max number of requests to send to OpenAI at once. Defaults to 4.",
+)
+@click.option(
+    "--server",
+    help="URL of a server started with 'conlang serve' to run the command on, e.g. http://127.0.0.1:8765.",
+)
+@click.option(
+    "--server-token",
+    envvar="CONLANG_SERVER_TOKEN",
+    help="Token of the server given with --server. Defaults to the CONLANG_SERVER_TOKEN environment variable.",
+)
+def modify(
+    guide_path,
+    dictionary_path,
+    changes,
+    similarity_threshold,
+    model,
+    max_concurrency,
+    server,
+    server_token,
+):
     """Make specific changes to the language."""
 
+    from .command.modify import modify as modify_
+    from .command.serve import forward as forward_
+
+    if server is not None:
+        forward_(
+            server,
+            server_token,
+            "modify",
+            guide_path=guide_path,
+            dictionary_path=dictionary_path,
+            changes=changes,
+            similarity_threshold=similarity_threshold,
+            model=model,
+            max_concurrency=max_concurrency,
+        )
+        return
+
     modify_(
         guide_path,
         dictionary_path,
         changes,
         similarity_threshold,
         model,
+        max_concurrency,
     )
 
 
@@ -85,24 +276,85 @@ def modify(guide_path, dictionary_path, changes, similarity_threshold, model):
     default="chatgpt-4o-latest",
     help="OpenAI model to use. Defaults to chatgpt-4o-latest.",
 )
+@click.option(
+    "--max-concurrency",
+    default=4,
+    help="Max number of requests to send to OpenAI at once. Defaults to 4.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Pick up where an interrupted run on the same guide and dictionary stopped, instead of calling OpenAI again for the steps that already finished.",
+)
+@click.option(
+    "--server",
+    help="URL of a server started with 'conlang serve' to run the command on, e.g. http://127.0.0.1:8765.",
+)
+@click.option(
+    "--server-token",
+    envvar="CONLANG_SERVER_TOKEN",
+    help="Token of the server given with --server. Defaults to the CONLANG_SERVER_TOKEN environment variable.",
+)
 def improve(
     guide_path,
     dictionary_path,
     max_iterations,
     similarity_threshold,
     model,
+    max_concurrency,
+    resume,
+    server,
+    server_token,
 ):
     """Automatically improve the language."""
 
+    from .command.improve import improve as improve_
+    from .command.serve import forward as forward_
+
+    if server is not None:
+        if resume:
+            raise click.UsageError("--resume cannot be used with --server.")
+        forward_(
+            server,
+            server_token,
+            "improve",
+            guide_path=guide_path,
+            dictionary_path=dictionary_path,
+            max_iterations=max_iterations,
+            similarity_threshold=similarity_threshold,
+            model=model,
+            max_concurrency=max_concurrency,
+        )
+        return
+
     improve_(
         guide_path,
         dictionary_path,
         max_iterations,
         similarity_threshold,
         model,
+        max_concurrency,
+        resume,
     )
 
 
+@cli.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--similarity-threshold",
+    default=0.98,
+    help="Maximum similarity between two words to be considered the same. Defaults to 0.98.",
+)
+def reduce(dictionary_path, similarity_threshold):
+    """Remove words with similar translations from a dictionary."""
+
+    from .command.reduce import reduce as reduce_
+
+    reduce_(dictionary_path, similarity_threshold)
+
+
 @cli.command()
 @click.option(
     "--guide", "guide_path", prompt="Enter the filename of the language guide"
@@ -110,7 +362,19 @@ def improve(
 @click.option(
     "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
 )
-@click.option("--text", prompt="Enter the text to translate")
+@click.option("--text", help="Text to translate. Prompted for if --input is not given.")
+@click.option(
+    "--input",
+    "input_file",
+    type=click.File("r"),
+    help="File with one text to translate per line, or '-' for stdin. Lines can also be JSON objects with a 'text' key and an optional 'id' key. Writes one JSON result per line to stdout.",
+)
+@click.option(
+    "--save-every",
+    type=int,
+    default=None,
+    help="With --input, also save the guide and dictionary after every N texts.",
+)
 @click.option(
     "--max-improvements",
     default=5,
@@ -122,16 +386,108 @@ def improve(
     help="Maximum similarity between two words to be considered the same. Defaults to 0.98.",
 )
 @click.option("--model", default="chatgpt-4o-latest", help="OpenAI model to use")
+@click.option(
+    "--index",
+    type=click.Choice(["auto", "exact", "ivf"]),
+    default="auto",
+    help="How to search the dictionary for related words. 'auto' uses the approximate (ivf) index for dictionaries with at least 100,000 words. Defaults to auto.",
+)
+@click.option(
+    "--index-probes",
+    default=8,
+    help="Number of lists the approximate index searches. Higher is slower but more accurate. Defaults to 8.",
+)
+@click.option(
+    "--max-concurrency",
+    default=4,
+    help="Max number of requests to send to OpenAI at once. Defaults to 4.",
+)
+@click.option(
+    "--explain/--no-explain",
+    default=True,
+    help="Also get an explanation of the translation. With --no-explain, the response is cut off as soon as the translation arrives. Defaults to --explain.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Pick up where an interrupted run on the same guide and dictionary stopped, instead of calling OpenAI again for the steps that already finished.",
+)
+@click.option(
+    "--server",
+    help="URL of a server started with 'conlang serve' to run the command on, e.g. http://127.0.0.1:8765.",
+)
+@click.option(
+    "--server-token",
+    envvar="CONLANG_SERVER_TOKEN",
+    help="Token of the server given with --server. Defaults to the CONLANG_SERVER_TOKEN environment variable.",
+)
 def translate(
     guide_path,
     dictionary_path,
     text,
+    input_file,
+    save_every,
     max_improvements,
     similarity_threshold,
     model,
+    index,
+    index_probes,
+    max_concurrency,
+    explain,
+    resume,
+    server,
+    server_token,
 ):
     """Translate text to or from a constructed language."""
 
+    from .command.serve import forward as forward_
+    from .command.serve import forward_batch as forward_batch_
+    from .command.translate import translate as translate_
+    from .command.translate import translate_batch as translate_batch_
+
+    if server is not None:
+        if resume:
+            raise click.UsageError("--resume cannot be used with --server.")
+
+        payload = dict(
+            guide_path=guide_path,
+            dictionary_path=dictionary_path,
+            max_improvements=max_improvements,
+            similarity_threshold=similarity_threshold,
+            model=model,
+            index=index,
+            index_probes=index_probes,
+            max_concurrency=max_concurrency,
+            explain=explain,
+        )
+        if input_file is not None:
+            forward_batch_(server, server_token, input_file, **payload)
+        else:
+            if text is None:
+                text = click.prompt("Enter the text to translate")
+            forward_(server, server_token, "translate", text=text, **payload)
+        return
+
+    if input_file is not None:
+        translate_batch_(
+            guide_path,
+            dictionary_path,
+            input_file,
+            max_improvements,
+            similarity_threshold,
+            model,
+            index,
+            index_probes,
+            max_concurrency,
+            save_every,
+            explain,
+            resume,
+        )
+        return
+
+    if text is None:
+        text = click.prompt("Enter the text to translate")
+
     translate_(
         guide_path,
         dictionary_path,
@@ -139,4 +495,232 @@ def translate(
         max_improvements,
         similarity_threshold,
         model,
+        index,
+        index_probes,
+        max_concurrency,
+        explain,
+        resume,
+    )
+
+
+@cli.command()
+@click.option("--host", default="127.0.0.1", help="Defaults to 127.0.0.1.")
+@click.option("--port", default=8765, help="Defaults to 8765.")
+@click.option(
+    "--flush-interval",
+    default=30.0,
+    help="Seconds between writing changed guides and dictionaries to disk. Defaults to 30.",
+)
+@click.option(
+    "--root",
+    type=click.Path(exists=True, file_okay=False),
+    default=".",
+    help="Directory of the guides and dictionaries that can be used. Requests for files outside of it are rejected. Defaults to the current directory.",
+)
+@click.option(
+    "--token",
+    envvar="CONLANG_SERVER_TOKEN",
+    help="Token that requests must send. Defaults to the CONLANG_SERVER_TOKEN environment variable, or to a random token that is printed on startup.",
+)
+def serve(host, port, flush_interval, root, token):
+    """Keep the embeddings model and languages loaded between commands."""
+
+    from .command.serve import serve as serve_
+
+    serve_(host, port, flush_interval, root, token)
+
+
+@cli.group()
+def index():
+    """Manage the search index of a dictionary."""
+
+    pass
+
+
+@index.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--probes",
+    "n_probes",
+    default="1,2,4,8,16,32",
+    help="Comma-separated numbers of lists to search. Defaults to 1,2,4,8,16,32.",
+)
+@click.option(
+    "--lists",
+    "n_lists",
+    type=int,
+    default=None,
+    help="Number of lists to cluster the dictionary into. Defaults to 4 times the square root of the number of words.",
+)
+@click.option(
+    "--queries",
+    "n_queries",
+    default=1000,
+    help="Number of translations to sample as queries. Defaults to 1000.",
+)
+@click.option("-k", default=10, help="Number of neighbours to compare. Defaults to 10.")
+def recall(dictionary_path, n_probes, n_lists, n_queries, k):
+    """Measure the recall of the approximate index."""
+
+    from .command.index import recall as recall_
+
+    recall_(
+        dictionary_path,
+        [int(n_probe) for n_probe in n_probes.split(",")],
+        n_lists,
+        n_queries,
+        k,
     )
+
+
+@index.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--precision",
+    type=click.Choice(["float32", "float16", "int8"]),
+    default="float16",
+    help="How to store each number of the embeddings. Defaults to float16.",
+)
+@click.option(
+    "--dimensions",
+    type=int,
+    default=None,
+    help="Number of dimensions to project the embeddings onto. Defaults to keeping every dimension.",
+)
+def compress(dictionary_path, precision, dimensions):
+    """Store the embeddings of a dictionary in less space."""
+
+    from .command.index import compress as compress_
+
+    compress_(dictionary_path, precision, dimensions)
+
+
+@index.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--precisions",
+    default="float16,int8",
+    help="Comma-separated precisions to compare. Defaults to float16,int8.",
+)
+@click.option(
+    "--dimensions",
+    default="",
+    help="Comma-separated numbers of dimensions to project onto, in addition to keeping every dimension.",
+)
+@click.option(
+    "--thresholds",
+    default="0.9,0.95,0.98",
+    help="Comma-separated similarity thresholds to compare pairs at. Defaults to 0.9,0.95,0.98.",
+)
+@click.option(
+    "--queries",
+    "n_queries",
+    default=1000,
+    help="Number of translations to sample as queries. Defaults to 1000.",
+)
+def drift(dictionary_path, precisions, dimensions, thresholds, n_queries):
+    """Measure how much compression changes similarities."""
+
+    from .command.index import drift as drift_
+
+    drift_(
+        dictionary_path,
+        precisions.split(","),
+        [int(dimension) for dimension in dimensions.split(",") if dimension],
+        [float(threshold) for threshold in thresholds.split(",")],
+        n_queries,
+    )
+
+
+@index.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    help="Number of processes to embed with, each loading the embeddings model. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=512,
+    help="Number of texts each process embeds at once. Defaults to 512.",
+)
+def rebuild(dictionary_path, workers, batch_size):
+    """Embed every word of a dictionary in parallel."""
+
+    from .command.index import rebuild as rebuild_
+
+    rebuild_(dictionary_path, workers, batch_size)
+
+
+@cli.group()
+def embeddings():
+    """Manage the embeddings model."""
+
+    pass
+
+
+@embeddings.command()
+@click.option(
+    "--dictionary", "dictionary_path", prompt="Enter the filename of the dictionary"
+)
+@click.option(
+    "--runtime",
+    type=click.Choice(RUNTIMES),
+    default="int8",
+    help="Runtime to compare to the full precision model. Defaults to int8.",
+)
+@click.option(
+    "--samples",
+    "n_samples",
+    default=1000,
+    help="Number of words and translations to embed. Defaults to 1000.",
+)
+@click.option(
+    "--tolerance",
+    default=0.99,
+    help="Min cosine similarity of each embedding to the full precision one. Defaults to 0.99.",
+)
+def check(dictionary_path, runtime, n_samples, tolerance):
+    """Compare the speed and embeddings of a runtime to full precision."""
+
+    from .command.embeddings import check as check_
+
+    check_(dictionary_path, runtime, n_samples, tolerance)
+
+
+@cli.group()
+def dictionary():
+    """Manage dictionary files."""
+
+    pass
+
+
+@dictionary.command()
+@click.option(
+    "--input",
+    "input_path",
+    prompt="Enter the filename of the dictionary to convert",
+    help="Dictionary to read.",
+)
+@click.option(
+    "--output",
+    "output_path",
+    prompt="Enter the filename to save the dictionary to",
+    help="File to write. Dictionaries ending in .db, .sqlite or .sqlite3 are saved as SQLite databases, and any other file as CSV.",
+)
+def convert(input_path, output_path):
+    """Convert a dictionary between CSV and SQLite."""
+
+    from .command.dictionary import convert as convert_
+
+    convert_(input_path, output_path)
@@ -0,0 +1,20 @@
+import click
+
+from ..language import load_dictionary, save_dictionary
+
+
+def convert(input_path, output_path):
+    """Copy a dictionary to another file, converting between CSV and SQLite."""
+
+    # Load the dictionary with the embeddings saved with it
+    dictionary = load_dictionary(input_path, index="exact")
+
+    # Save it in the format of the output file
+    save_dictionary(dictionary, output_path)
+
+    click.echo(
+        click.style(
+            f"Saved {len(dictionary)} words from {input_path} to {output_path}.",
+            dim=True,
+        )
+    )
@@ -0,0 +1,44 @@
+import random
+
+import click
+
+from ..embeddings import compare_runtimes
+from ..language import load_dictionary
+
+
+def check(dictionary_path, runtime, n_samples, tolerance):
+    """Compare the embeddings of a runtime to those of the full precision model."""
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index="exact")
+    texts = list(dictionary.keys()) + list(dictionary.values())
+    if len(texts) < 2:
+        raise click.ClickException("The dictionary needs at least one word.")
+
+    # Embed a sample of the words and translations with both runtimes
+    texts = random.Random(0).sample(texts, min(n_samples, len(texts)))
+    click.echo(
+        click.style(
+            f"Embedding {len(texts)} words and translations with the torch and {runtime} runtimes...",
+            dim=True,
+        )
+    )
+    results = compare_runtimes(texts, runtime)
+
+    click.echo(f"{'Runtime':>8} {'Texts/s':>10} {'Speedup':>8}")
+    texts_per_second = results["texts_per_second"]
+    for name, speed in texts_per_second.items():
+        click.echo(
+            f"{name:>8} {speed:>10.1f} {speed / texts_per_second['torch']:>7.2f}x"
+        )
+
+    similarities = results["similarities"]
+    click.echo(
+        f"Cosine similarity to torch: mean {similarities.mean():.4f}, min {similarities.min():.4f}."
+    )
+    click.echo(f"Same most similar text: {results['agreement']:.1%}.")
+
+    if similarities.min() < tolerance:
+        raise click.ClickException(
+            f"Some {runtime} embeddings are less similar to the full precision ones than {tolerance}."
+        )
@@ -2,12 +2,10 @@ import click
 
 from conlang_gpt.embeddings import get_embeddings_model
 
+from ..checkpoint import Checkpoint, get_checkpoint_path, get_state
 from ..language import (
-    ImproveDictionaryError,
-    improve_dictionary,
-    improve_language,
+    improve_language_and_dictionary,
     load_dictionary,
-    modify_language,
     save_dictionary,
 )
 
@@ -18,8 +16,15 @@ def improve(
     max_iterations,
     similarity_threshold,
     model,
+    max_concurrency=4,
+    resume=False,
 ):
-    """Automatically improve the language."""
+    """
+    Automatically improve the language.
+
+    Every step is journaled as soon as it finishes, so that if resume is set,
+    an interrupted run picks up where it stopped.
+    """
 
     # Load the beginner's guide
     with open(guide_path, "r") as file:
@@ -31,53 +36,32 @@ def improve(
     # Create the embeddings model
     embeddings_model = get_embeddings_model()
 
-    # Revise the language guide
-    for i in range(max_iterations):
-        # Try to improve the language guide
-        improved_guide = improve_language(guide, dictionary, model, embeddings_model)
-
-        # Stop if no problems were found
-        if improved_guide is None:
-            break
-
-        # Update the language guide
-        guide = improved_guide
+    # Open the journal of this run, or of the interrupted run to resume
+    checkpoint = Checkpoint(
+        get_checkpoint_path("improve", dictionary_path),
+        get_state(guide, dictionary, model),
+        resume,
+    )
 
-        # Update the dictionary with the new guide
-        while True:
-            try:
-                dictionary = improve_dictionary(
-                    dictionary, guide, similarity_threshold, model, embeddings_model
-                )
-                break
-            except ImproveDictionaryError as e:
-                # If the dictionary can't be updated, it is most likely because
-                # the guide is invalid. Try to fix the guide and then try
-                # again.
-                changes = f"The following problem(s) with the guide were encountered while updating the dictionary:\n\n{e}"
-                click.echo(click.style(changes, fg="yellow"))
-                modified_guide = modify_language(guide, changes, model)
-                if modified_guide == guide:
-                    click.echo(
-                        click.style(
-                            "The guide could not be modified to fix the problem(s).",
-                            fg="yellow",
-                        )
-                    )
-                else:
-                    click.echo(
-                        click.style(
-                            "The guide was modified to fix the problem(s).", dim=True
-                        )
-                    )
-                    guide = modified_guide
+    # Revise the language guide
+    guide, dictionary = improve_language_and_dictionary(
+        guide,
+        dictionary,
+        max_iterations,
+        similarity_threshold,
+        model,
+        embeddings_model,
+        max_concurrency,
+        checkpoint=checkpoint,
+    )
 
     # Save the improved guide to a file
     with open(guide_path, "w") as file:
         file.write(guide)
 
     # Save the new dictionary to a file
-    save_dictionary(dictionary, dictionary_path)
+    save_dictionary(dictionary, dictionary_path, embeddings_model)
+    checkpoint.finish()
 
     click.echo(
         click.style(
@@ -0,0 +1,238 @@
+import random
+import time
+
+import click
+
+from ..ann import measure_recall
+from ..embeddings import (
+    get_bulk_embeddings_model,
+    get_embeddings_model,
+    get_model_name,
+)
+from ..index import VectorStore
+from ..language import load_dictionary, save_dictionary
+from ..quantize import PCA_SAMPLE_SIZE, PRECISIONS, Codec, measure_drift
+from ..storage import get_backend
+
+# Number of entries rebuild embeds before saving their embeddings
+REBUILD_SHARD_SIZE = 10_000
+
+
+def recall(dictionary_path, n_probes, n_lists, n_queries, k):
+    """Measure the recall of the approximate index against an exact search."""
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index="exact")
+    if len(dictionary) < k + 1:
+        raise click.ClickException(f"The dictionary needs at least {k + 1} words.")
+
+    # Create the embeddings model
+    embeddings_model = get_embeddings_model()
+
+    # Use a sample of the translations in the dictionary as queries
+    translations = list(dictionary.values())
+    queries = random.Random(0).sample(translations, min(n_queries, len(translations)))
+
+    click.echo(
+        click.style(
+            f"Comparing approximate and exact searches for {len(queries)} queries...",
+            dim=True,
+        )
+    )
+    results = measure_recall(
+        dictionary, queries, embeddings_model, n_probes, k=k, n_lists=n_lists
+    )
+
+    click.echo(f"{'Probes':>8} {f'Recall@{k}':>10} {'ms/query':>10}")
+    for n_probe, query_recall, seconds in results:
+        click.echo(f"{n_probe:>8} {query_recall:>10.3f} {seconds * 1000:>10.3f}")
+
+
+def _get_full_embeddings(dictionary, embeddings_model):
+    """
+    Return a store with full precision embeddings of every entry.
+
+    The dictionary's own store is used if it is not compressed. Otherwise the
+    entries are embedded again, which reuses the embeddings cache.
+    """
+
+    store = dictionary.embeddings
+    if store.codec != Codec():
+        click.echo(
+            click.style(
+                f"The embeddings are stored as {store.codec}. Embedding the dictionary again at full precision...",
+                dim=True,
+            )
+        )
+        store = VectorStore()
+
+    words = list(dictionary.keys())
+    translations = list(dictionary.values())
+    store.get(words + translations, embeddings_model)
+    store.get(translations, embeddings_model, query=True)
+    return store
+
+
+def compress(dictionary_path, precision, dimensions):
+    """Store the embeddings of a dictionary with less precision or dimensions."""
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index="exact")
+    if not dictionary:
+        raise click.ClickException("The dictionary is empty.")
+    before = dictionary.embeddings
+
+    # Create the embeddings model
+    embeddings_model = get_embeddings_model()
+
+    # Fit the projection to the embeddings of the dictionary
+    store = _get_full_embeddings(dictionary, embeddings_model)
+    if dimensions is not None and dimensions >= store.dimensions:
+        raise click.BadParameter(
+            f"The embeddings only have {store.dimensions} dimensions.",
+            param_hint="'--dimensions'",
+        )
+    click.echo(click.style(f"Compressing {len(store)} embeddings...", dim=True))
+    keys = dictionary.embedding_keys()
+    sample = random.Random(0).sample(keys, min(PCA_SAMPLE_SIZE, len(keys)))
+    codec = Codec.fit(store.vectors(sample), precision, dimensions)
+    dictionary.embeddings = store.compressed(codec)
+
+    # Save the dictionary with the compressed embeddings
+    save_dictionary(dictionary, dictionary_path)
+
+    size_before = len(before) * before.dimensions * before.codec.dtype.itemsize
+    size_after = (
+        len(dictionary.embeddings)
+        * dictionary.embeddings.dimensions
+        * codec.dtype.itemsize
+    )
+    click.echo(
+        f"Stored the embeddings as {codec}: {size_after / 1e6:.1f} MB, down from {size_before / 1e6:.1f} MB."
+    )
+
+
+def drift(dictionary_path, precisions, dimensions, thresholds, n_queries):
+    """Measure how much compressing embeddings changes their similarities."""
+
+    for precision in precisions:
+        if precision not in PRECISIONS:
+            raise click.BadParameter(
+                f"Expected one of: {', '.join(PRECISIONS)}.",
+                param_hint="'--precisions'",
+            )
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index="exact")
+    if len(dictionary) < 2:
+        raise click.ClickException("The dictionary needs at least two words.")
+
+    # Create the embeddings model
+    embeddings_model = get_embeddings_model()
+
+    # Compare the translations like reduce and merge do
+    store = _get_full_embeddings(dictionary, embeddings_model)
+    translations = list(dictionary.values())
+    vectors = store.vectors(store.keys(translations, query=True))
+
+    codecs = [
+        Codec.fit(vectors, precision, dimension)
+        for precision in precisions
+        for dimension in [None] + dimensions
+        if precision != "float32" or dimension is not None
+    ]
+    click.echo(
+        click.style(
+            f"Comparing {min(n_queries, len(vectors))} translations to {len(vectors)} translations...",
+            dim=True,
+        )
+    )
+    results = measure_drift(vectors, codecs, thresholds, n_queries=n_queries)
+
+    header = f"{'Codec':>20} {'MB':>8} {'Mean err':>9} {'Max err':>9}"
+    for threshold in thresholds:
+        header += f" {f'R@{threshold}':>8} {f'P@{threshold}':>8}"
+    click.echo(header)
+    for result in results:
+        line = (
+            f"{repr(result['codec']):>20} {result['bytes'] / 1e6:>8.2f}"
+            f" {result['mean_error']:>9.4f} {result['max_error']:>9.4f}"
+        )
+        for threshold in thresholds:
+            pairs = result["thresholds"][threshold]
+            line += f" {pairs['recall']:>8.3f} {pairs['precision']:>8.3f}"
+        click.echo(line)
+
+
+def rebuild(dictionary_path, workers, batch_size, shard_size=REBUILD_SHARD_SIZE):
+    """
+    Embed every entry of a dictionary that has no stored embeddings.
+
+    Entries are embedded shard_size at a time, and the embeddings of each
+    shard are saved with the dictionary as soon as it is done, so that
+    running this again after an interruption only embeds the shards that
+    did not finish.
+    """
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index="exact")
+    backend = get_backend(dictionary_path)
+    store = dictionary.embeddings
+
+    # Report progress at most every few seconds
+    last_report = 0
+
+    def report_progress(embedded, total):
+        nonlocal last_report
+        if embedded < total and time.monotonic() - last_report < 5:
+            return
+        last_report = time.monotonic()
+        click.echo(click.style(f"Embedded {embedded}/{total} texts...", dim=True))
+
+    # Embed the texts of each shard in batches shared by the workers, which
+    # are kept between shards
+    with get_bulk_embeddings_model(
+        workers, batch_size, on_progress=report_progress
+    ) as embeddings_model:
+        # Find the entries that have no stored embeddings. Embeddings from
+        # another model are all replaced.
+        if store.model_name != get_model_name(embeddings_model):
+            stored = 0
+            entries = list(dictionary.items())
+        else:
+            stored = len(store)
+            entries = [
+                (word, translation)
+                for word, translation in dictionary.items()
+                if not all(
+                    key in store
+                    for key in store.keys([word, translation])
+                    + store.keys([translation], query=True)
+                )
+            ]
+
+        click.echo(
+            click.style(
+                f"Embedding the words and translations of {len(entries)} entries...",
+                dim=True,
+            )
+        )
+        for start in range(0, len(entries), shard_size):
+            shard = entries[start : start + shard_size]
+            words = [word for word, _ in shard]
+            translations = [translation for _, translation in shard]
+            store.get(words + translations, embeddings_model, decoded=False)
+            store.get(translations, embeddings_model, query=True, decoded=False)
+
+            # Save the embeddings of the shard, so they are not embedded again
+            backend.save_embeddings(dictionary)
+            click.echo(
+                click.style(
+                    f"Saved the embeddings of {start + len(shard)}/{len(entries)} entries.",
+                    dim=True,
+                )
+            )
+
+    click.echo(
+        f"Embedded {len(store) - stored} new text(s) for {len(dictionary)} entries."
+    )
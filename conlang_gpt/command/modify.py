@@ -4,13 +4,19 @@ from conlang_gpt.embeddings import get_embeddings_model
 
 from ..language import (
     load_dictionary,
-    improve_dictionary,
-    modify_language,
+    modify_language_and_dictionary,
     save_dictionary,
 )
 
 
-def modify(guide_path, dictionary_path, changes, similarity_threshold, model):
+def modify(
+    guide_path,
+    dictionary_path,
+    changes,
+    similarity_threshold,
+    model,
+    max_concurrency=4,
+):
     """Make specific changes to the language."""
 
     # Load the beginner's guide
@@ -26,12 +32,15 @@ def modify(guide_path, dictionary_path, changes, similarity_threshold, model):
     # Create the embedding model
     embeddings_model = get_embeddings_model()
 
-    # Update the language guide
-    guide = modify_language(guide, changes, model)
-
-    # Update the dictionary with the new guide
-    dictionary = improve_dictionary(
-        dictionary, guide, similarity_threshold, model, embeddings_model
+    # Update the language guide and dictionary
+    guide, dictionary = modify_language_and_dictionary(
+        guide,
+        dictionary,
+        changes,
+        similarity_threshold,
+        model,
+        embeddings_model,
+        max_concurrency,
     )
 
     # Save the new guide to a file
@@ -46,7 +55,7 @@ def modify(guide_path, dictionary_path, changes, similarity_threshold, model):
 
     # Save the new dictionary to a file
     if dictionary_path is not None:
-        save_dictionary(dictionary, dictionary_path)
+        save_dictionary(dictionary, dictionary_path, embeddings_model)
 
     click.echo(
         click.style(f"Dictionary saved to {dictionary_path} successfully.", dim=True)
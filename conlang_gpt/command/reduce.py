@@ -0,0 +1,28 @@
+import click
+
+from ..embeddings import get_embeddings_model
+from ..language import load_dictionary, reduce_dictionary, save_dictionary
+
+
+def reduce(dictionary_path, similarity_threshold):
+    """Remove words with similar translations from a dictionary."""
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path)
+    original_size = len(dictionary)
+
+    # Create the embeddings model
+    embeddings_model = get_embeddings_model()
+
+    # Remove similar words
+    dictionary = reduce_dictionary(dictionary, similarity_threshold, embeddings_model)
+
+    # Save the reduced dictionary
+    save_dictionary(dictionary, dictionary_path, embeddings_model)
+
+    click.echo(
+        click.style(
+            f"Removed {original_size - len(dictionary)} word(s) and saved the dictionary to {dictionary_path} successfully.",
+            dim=True,
+        )
+    )
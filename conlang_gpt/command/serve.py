@@ -0,0 +1,59 @@
+import json
+import os
+import secrets
+
+import click
+
+from ..server import ServerError, Workspace, send_request, serve as serve_workspace
+from .translate import _read_inputs
+
+
+def serve(host, port, flush_interval, root=None, token=None):
+    """Keep the embeddings model and languages loaded between requests."""
+
+    # Generate a token if none was given, and show it so clients can use it
+    if token is None:
+        token = secrets.token_urlsafe(32)
+        click.echo(f"Server token: {token}")
+
+    serve_workspace(host, port, flush_interval, token, Workspace(root=root))
+
+
+def _absolute_paths(payload):
+    # The server may run in a different directory
+    for key in ("guide_path", "dictionary_path"):
+        if payload.get(key) is not None:
+            payload[key] = os.path.abspath(payload[key])
+    return payload
+
+
+def forward(server_url, token, operation, **payload):
+    """Run an operation on a server and print its result."""
+
+    try:
+        result = send_request(server_url, operation, _absolute_paths(payload), token)
+    except ServerError as e:
+        raise click.ClickException(str(e))
+
+    if result.get("explanation") is not None:
+        click.echo(result["explanation"])
+    elif "translation" in result:
+        click.echo(result["translation"])
+    if "message" in result:
+        click.echo(click.style(result["message"], dim=True))
+
+
+def forward_batch(server_url, token, input_file, **payload):
+    """Translate every text in a file on a server, printing one JSON result per text."""
+
+    payload = _absolute_paths(payload)
+    for item_id, text in _read_inputs(input_file):
+        try:
+            result = send_request(
+                server_url, "translate", dict(payload, text=text), token
+            )
+            result = {"id": item_id, "text": text, **result}
+        except ServerError as e:
+            result = {"id": item_id, "text": text, "error": str(e)}
+
+        click.echo(json.dumps(result, ensure_ascii=False))
@@ -1,17 +1,16 @@
+import contextlib
+import json
+import sys
+
 import click
 
+from ..checkpoint import Checkpoint, get_checkpoint_path, get_state
 from ..embeddings import get_embeddings_model
 from ..language import (
-    ImproveDictionaryError,
-    create_dictionary_for_text,
-    generate_language,
-    improve_dictionary,
-    improve_language,
+    LanguageError,
     load_dictionary,
-    merge_dictionaries,
-    modify_language,
     save_dictionary,
-    translate_text,
+    translate_and_improve,
 )
 
 
@@ -22,76 +21,186 @@ def translate(
     max_improvements,
     similarity_threshold,
     model,
+    index="auto",
+    index_probes=8,
+    max_concurrency=4,
+    explain=True,
+    resume=False,
 ):
-    """Translate text to or from a constructed language."""
+    """
+    Translate text to or from a constructed language.
+
+    Every step is journaled as soon as it finishes, so that if resume is set,
+    an interrupted run picks up where it stopped.
+    """
 
     # Load the beginner's guide
     with open(guide_path, "r") as file:
         guide = file.read()
 
     # Load the dictionary
-    dictionary = load_dictionary(dictionary_path)
+    dictionary = load_dictionary(dictionary_path, index=index, n_probe=index_probes)
 
     # Create the embedding model
     embedding_model = get_embeddings_model()
 
-    # Add any missing words to the dictionary
-    new_words = create_dictionary_for_text(
-        guide, text, dictionary, similarity_threshold, model, embedding_model
+    # Open the journal of this run, or of the interrupted run to resume
+    checkpoint = Checkpoint(
+        get_checkpoint_path("translate", dictionary_path),
+        get_state(guide, dictionary, model),
+        resume,
     )
-    dictionary = merge_dictionaries(
-        dictionary, new_words, similarity_threshold, embedding_model
+
+    # Translate the text, printing the translation as soon as it arrives
+    guide, dictionary, _, explanation = translate_and_improve(
+        guide,
+        dictionary,
+        text,
+        max_improvements,
+        similarity_threshold,
+        model,
+        embedding_model,
+        max_concurrency,
+        on_translation=lambda translation: click.echo(
+            click.style(translation.strip(), bold=True)
+        ),
+        explain=explain,
+        checkpoint=checkpoint,
     )
+    if explanation is not None:
+        click.echo(f"\n{explanation}")
 
-    for _ in range(max_improvements):
-        # Try to improve the language guide using the English text
-        improved_guide = improve_language(
-            guide, dictionary, model, embedding_model, text
-        )
+    # Save the updated guide
+    with open(guide_path, "w") as file:
+        file.write(guide)
+
+    # Save the updated dictionary
+    save_dictionary(dictionary, dictionary_path, embedding_model)
+    checkpoint.finish()
+
+
+def _read_inputs(file):
+    """
+    Read the texts to translate from a file.
 
-        # Stop if no problems were found
-        if improved_guide is None:
-            break
+    Each non-empty line is either a JSON object with a "text" key (and
+    optionally an "id" key) or the text itself. Yields (id, text) tuples; if
+    no id is given, the line number is used.
+    """
+
+    for line_number, line in enumerate(file, start=1):
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            item = None
+
+        if isinstance(item, dict) and "text" in item:
+            yield item.get("id", line_number), item["text"]
+        elif isinstance(item, str):
+            yield line_number, item
+        else:
+            yield line_number, line
+
+
+def translate_batch(
+    guide_path,
+    dictionary_path,
+    input_file,
+    max_improvements,
+    similarity_threshold,
+    model,
+    index="auto",
+    index_probes=8,
+    max_concurrency=4,
+    save_every=None,
+    explain=True,
+    resume=False,
+):
+    """
+    Translate every text in a file.
 
-        # Update the language guide
-        guide = improved_guide
+    Writes one JSON object per text to stdout as soon as it is translated.
+    Progress messages are written to stderr instead. The guide and dictionary
+    are saved at the end, and also after every save_every texts if given.
+
+    Every step is journaled as soon as it finishes. If resume is set, an
+    interrupted run skips the texts translated before its last save and
+    replays the steps that finished after it.
+    """
+
+    # Keep a handle on stdout before progress messages are redirected
+    output = sys.stdout
+
+    # Load the beginner's guide
+    with open(guide_path, "r") as file:
+        guide = file.read()
+
+    # Load the dictionary
+    dictionary = load_dictionary(dictionary_path, index=index, n_probe=index_probes)
+
+    # Create the embedding model
+    embedding_model = get_embeddings_model()
+
+    def save():
+        with open(guide_path, "w") as file:
+            file.write(guide)
+        save_dictionary(dictionary, dictionary_path, embedding_model)
+        checkpoint.saved(get_state(guide, dictionary, model), translated=translated)
+
+    translated = 0
+    with contextlib.redirect_stdout(sys.stderr):
+        # Open the journal of this run, or of the interrupted run to resume
+        checkpoint = Checkpoint(
+            get_checkpoint_path("translate-batch", dictionary_path),
+            get_state(guide, dictionary, model),
+            resume,
+        )
+        skip = (checkpoint.resumed_from or {}).get("translated", 0)
+        if skip:
+            click.echo(
+                click.style(
+                    f"Skipping {skip} text(s) translated before the last save.",
+                    dim=True,
+                )
+            )
+
+        for item_id, text in _read_inputs(input_file):
+            # Texts are counted the same way when resuming
+            translated += 1
+            if translated <= skip:
+                continue
 
-        # Update the dictionary with the new guide
-        while True:
             try:
-                dictionary = improve_dictionary(
-                    dictionary, guide, similarity_threshold, model, embedding_model
+                guide, dictionary, translated_text, explanation = translate_and_improve(
+                    guide,
+                    dictionary,
+                    text,
+                    max_improvements,
+                    similarity_threshold,
+                    model,
+                    embedding_model,
+                    max_concurrency,
+                    explain=explain,
+                    checkpoint=checkpoint,
                 )
-                break
-            except ImproveDictionaryError as e:
-                # If the dictionary can't be updated, it is most likely because
-                # the guide is invalid. Try to fix the guide and then try
-                # again.
-                changes = f"The following problem(s) with the guide were encountered while updating the dictionary:\n\n{e}"
-                click.echo(click.style(changes, fg="yellow"))
-                modified_guide = modify_language(guide, changes, model)
-                if modified_guide == guide:
-                    click.echo(
-                        click.style(
-                            "The guide could not be modified to fix the problem(s).",
-                            fg="yellow",
-                        )
-                    )
-                else:
-                    click.echo(
-                        click.style(
-                            "The guide was modified to fix the problem(s).", dim=True
-                        )
-                    )
-                    guide = modified_guide
-
-    # Translate the text
-    _, explanation = translate_text(text, guide, dictionary, model, embedding_model)
-    click.echo(explanation)
+                result = {
+                    "id": item_id,
+                    "text": text,
+                    "translation": translated_text.strip(),
+                    "explanation": explanation,
+                }
+            except LanguageError as e:
+                result = {"id": item_id, "text": text, "error": str(e)}
 
-    # Save the updated guide
-    with open(guide_path, "w") as file:
-        file.write(guide)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
 
-    # Save the updated dictionary
-    save_dictionary(dictionary, dictionary_path)
+            if save_every and translated % save_every == 0:
+                save()
+
+        save()
+        checkpoint.finish()
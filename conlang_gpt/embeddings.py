@@ -1,10 +1,439 @@
-from langchain.embeddings import CacheBackedEmbeddings, HuggingFaceBgeEmbeddings
-from langchain.storage import LocalFileStore
+import os
+import threading
+import time
 
+from .cache import EmbeddingCache
+from .trace import span
 
-def get_embeddings_model(model_name="BAAI/bge-small-en"):
-    fs = LocalFileStore(".conlang/cache/embeddings")
-    hf_embeddings = HuggingFaceBgeEmbeddings(model_name=model_name)
-    return CacheBackedEmbeddings.from_bytes_store(
-        hf_embeddings, fs, namespace=hf_embeddings.model_name
+# Where embeddings are cached, for every dictionary and command
+EMBEDDING_CACHE_PATH = os.path.join(".conlang", "cache", "embeddings.db")
+
+DEFAULT_MODEL_NAME = "BAAI/bge-small-en"
+
+# Number of texts each process embeds at once when embedding in bulk
+BULK_BATCH_SIZE = 512
+
+# Number of characters a batch may hold when embedding in bulk. Batches of
+# long texts are cut short, so that every batch takes about as long.
+BULK_BATCH_CHARACTERS = 32_768
+
+# Ways to run the embeddings model: full precision PyTorch, or PyTorch with
+# the weights of its linear layers quantized to int8, which is faster on CPUs
+RUNTIMES = ("torch", "int8")
+
+# Runtime and number of CPU threads to embed with, set with
+# set_embeddings_runtime. None threads lets PyTorch decide.
+embeddings_runtime = "torch"
+embeddings_threads = None
+
+
+def set_embeddings_runtime(runtime, threads=None):
+    """Replace the runtime and number of threads of the embeddings model."""
+
+    global embeddings_runtime, embeddings_threads
+    embeddings_runtime = runtime
+    embeddings_threads = threads
+
+
+class LazyEmbeddings:
+    """
+    Embeddings model that is only loaded the first time something is embedded.
+
+    Loading the model imports langchain and sentence-transformers and reads
+    the model weights, which takes seconds, so commands that never embed
+    anything (for example because the dictionary is empty) skip it.
+
+    Documents and queries are both looked up in the cache, if given, before
+    the model is loaded, so texts that were embedded before never load it.
+    Embeddings from the int8 runtime are close to, but not the same as, those
+    of the full precision model, so they are cached separately.
+    """
+
+    def __init__(self, model_name, cache=None, runtime="torch", threads=None):
+        if runtime not in RUNTIMES:
+            raise ValueError(
+                f"Unknown runtime {runtime}. Expected one of: {', '.join(RUNTIMES)}."
+            )
+
+        self.model_name = model_name
+        self.cache = cache
+        self.runtime = runtime
+        self.threads = threads
+        self._namespace = get_model_name(self)
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                with span(
+                    "load embeddings model", model=self.model_name, runtime=self.runtime
+                ):
+                    model = _load_embeddings_model(self.model_name)
+                    _optimize_embeddings_model(model, self.runtime, self.threads)
+                    self._model = model
+            return self._model
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def _embed_missing(self, texts, query):
+        """Embed texts that are not cached, yielding (indices, vectors) batches."""
+
+        # The model sorts the texts by length itself, so that texts padded
+        # together have about the same length
+        model = self._load()
+        if query:
+            yield range(len(texts)), _embed_queries(model, texts)
+        else:
+            yield range(len(texts)), model.embed_documents(texts)
+
+    def _embed(self, texts, query):
+        import numpy as np
+
+        if self.cache is None:
+            vectors = [None] * len(texts)
+            for indices, batch in self._embed_missing(texts, query):
+                for i, vector in zip(indices, batch):
+                    vectors[i] = vector
+            return vectors
+
+        keys = [self.cache.key(self._namespace, text, query) for text in texts]
+        with span("embedding cache", texts=len(texts)) as details:
+            found = self.cache.get_many(keys)
+            details["hits"] = len(found)
+
+        # Embed each text that is not cached once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            missing_keys = list(missing)
+            # Cache each batch as soon as it is embedded, so that an
+            # interrupted run does not embed it again
+            for indices, vectors in self._embed_missing(list(missing.values()), query):
+                embedded = {
+                    missing_keys[i]: np.asarray(vector, dtype=np.float32).tobytes()
+                    for i, vector in zip(indices, vectors)
+                }
+                self.cache.put_many(embedded)
+                found.update(embedded)
+
+        return [np.frombuffer(found[key], dtype=np.float32) for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, query=False)
+
+    def embed_query(self, text):
+        return self._embed([text], query=True)[0]
+
+    def embed_queries(self, texts):
+        return self._embed(texts, query=True)
+
+
+class ParallelEmbeddings(LazyEmbeddings):
+    """
+    Embeddings model that embeds many texts at once in a pool of processes.
+
+    Texts that are not cached are sorted by length and split into batches of
+    up to batch_size texts and batch_characters characters, which are
+    embedded by a pool of worker processes, each loading the model once and
+    using its share of the CPU threads. With one worker, batches are embedded
+    in this process. Each batch is cached as soon as it is embedded, and
+    on_progress, if given, is called with the number of texts embedded so far
+    and the number to embed.
+
+    The workers are started the first time they are needed and kept for
+    later calls. Call close, or use the model as a context manager, to stop
+    them.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        cache=None,
+        runtime="torch",
+        threads=None,
+        workers=1,
+        batch_size=BULK_BATCH_SIZE,
+        on_progress=None,
+        batch_characters=BULK_BATCH_CHARACTERS,
+    ):
+        super().__init__(model_name, cache, runtime, threads)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_characters = batch_characters
+        self.on_progress = on_progress
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes, cancelling the batches not started yet."""
+
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Share the CPU threads between the workers, so that they do not
+            # compete for them
+            threads = self.threads or max(1, (os.cpu_count() or 1) // self.workers)
+
+            # Start workers without copying this process, which may have the
+            # model, threads or open databases
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_start_worker,
+                initargs=(self.model_name, self.runtime, threads),
+            )
+        return self._pool
+
+    def _embed_missing(self, texts, query):
+        batches = _get_batches(texts, self.batch_size, self.batch_characters)
+        embedded = 0
+        if self.workers == 1 or len(batches) == 1:
+            for indices in batches:
+                batch = [texts[i] for i in indices]
+                _, vectors = next(super()._embed_missing(batch, query))
+                embedded += len(batch)
+                if self.on_progress is not None:
+                    self.on_progress(embedded, len(texts))
+                yield indices, vectors
+            return
+
+        from concurrent.futures import as_completed
+
+        pool = self._get_pool()
+        futures = {}
+        try:
+            with span(
+                "embed in parallel", texts=len(texts), workers=self.workers, query=query
+            ):
+                futures = {
+                    pool.submit(
+                        _embed_in_worker, [texts[i] for i in indices], query
+                    ): indices
+                    for indices in batches
+                }
+                for future in as_completed(futures):
+                    vectors = future.result()
+                    embedded += len(vectors)
+                    if self.on_progress is not None:
+                        self.on_progress(embedded, len(texts))
+                    yield futures[future], vectors
+        finally:
+            # Do not embed the remaining batches if this was interrupted
+            for future in futures:
+                future.cancel()
+
+
+def _get_batches(texts, batch_size, batch_characters):
+    """
+    Split texts into batches of texts of about the same length.
+
+    Returns the indices of the texts of each batch. A batch is cut once it
+    holds batch_size texts or batch_characters characters, so that batches of
+    short texts are large and texts padded together waste little work.
+    """
+
+    batches = []
+    batch = []
+    characters = 0
+    for i in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+        if batch and (
+            len(batch) == batch_size or characters + len(texts[i]) > batch_characters
+        ):
+            batches.append(batch)
+            batch = []
+            characters = 0
+        batch.append(i)
+        characters += len(texts[i])
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+# The model of a worker process of ParallelEmbeddings
+_worker_model = None
+
+
+def _start_worker(model_name, runtime, threads):
+    global _worker_model
+    _worker_model = LazyEmbeddings(model_name, runtime=runtime, threads=threads)
+
+
+def _embed_in_worker(texts, query):
+    import numpy as np
+
+    _, vectors = next(_worker_model._embed_missing(texts, query))
+    # Send the vectors back as one array, which is much faster to pickle
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _load_embeddings_model(model_name):
+    from langchain.embeddings import HuggingFaceBgeEmbeddings
+
+    return HuggingFaceBgeEmbeddings(model_name=model_name)
+
+
+def _optimize_embeddings_model(model, runtime, threads):
+    """Set the number of threads of a loaded model and quantize it if asked."""
+
+    if runtime == "torch" and threads is None:
+        return
+
+    import torch
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if runtime == "int8":
+        # Quantize the weights of the linear layers, which do most of the
+        # work, and quantize their inputs on the fly
+        model.client = torch.quantization.quantize_dynamic(
+            model.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+
+def _embed_queries(model, texts):
+    """Embed queries in one batch if the model allows it."""
+
+    instruction = getattr(model, "query_instruction", None)
+    if instruction is None or len(texts) == 1:
+        return [model.embed_query(text) for text in texts]
+
+    # BGE models embed a query as a document that starts with an instruction
+    return model.embed_documents([instruction + text for text in texts])
+
+
+def get_embeddings_model(
+    model_name=DEFAULT_MODEL_NAME,
+    cache_path=EMBEDDING_CACHE_PATH,
+    runtime=None,
+    threads=None,
+):
+    """
+    Return the embeddings model, caching its embeddings in cache_path.
+
+    If cache_path is None, nothing is cached. runtime and threads default to
+    those set with set_embeddings_runtime.
+    """
+
+    cache = None if cache_path is None else EmbeddingCache(cache_path)
+    return LazyEmbeddings(
+        model_name,
+        cache,
+        embeddings_runtime if runtime is None else runtime,
+        embeddings_threads if threads is None else threads,
+    )
+
+
+def get_bulk_embeddings_model(
+    workers=1,
+    batch_size=BULK_BATCH_SIZE,
+    on_progress=None,
+    model_name=DEFAULT_MODEL_NAME,
+    cache_path=EMBEDDING_CACHE_PATH,
+):
+    """
+    Return an embeddings model that embeds many texts in worker processes.
+
+    Like get_embeddings_model, its embeddings are cached in cache_path and it
+    uses the runtime set with set_embeddings_runtime.
+    """
+
+    cache = None if cache_path is None else EmbeddingCache(cache_path)
+    return ParallelEmbeddings(
+        model_name,
+        cache,
+        embeddings_runtime,
+        embeddings_threads,
+        workers=workers,
+        batch_size=batch_size,
+        on_progress=on_progress,
+    )
+
+
+def compare_runtimes(texts, runtime, model_name=DEFAULT_MODEL_NAME, threads=None):
+    """
+    Embed texts with the full precision model and with another runtime.
+
+    Returns, for the other runtime, the cosine similarity of each embedding to
+    the full precision one, the share of texts whose most similar other text
+    is the same with both, and the number of texts each runtime embeds per
+    second (documents and queries, after a warm-up).
+    """
+
+    import numpy as np
+
+    if threads is None:
+        threads = embeddings_threads
+
+    from .index import normalize
+
+    results = {}
+    for name in dict.fromkeys(["torch", runtime]):
+        model = LazyEmbeddings(model_name, runtime=name, threads=threads)
+        model.embed_documents(texts[:8])
+
+        start = time.perf_counter()
+        documents = model.embed_documents(texts)
+        queries = _embed_queries(model._load(), texts)
+        seconds = time.perf_counter() - start
+
+        results[name] = (normalize(documents), normalize(queries), seconds)
+
+    reference_documents, reference_queries, reference_seconds = results["torch"]
+    documents, queries, seconds = results[runtime]
+    similarities = np.concatenate(
+        [
+            np.sum(reference_documents * documents, axis=1),
+            np.sum(reference_queries * queries, axis=1),
+        ]
+    )
+
+    # Compare which document is the most similar to each query
+    def nearest(queries, documents):
+        scores = queries @ documents.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argmax(scores, axis=1)
+
+    agreement = np.mean(
+        nearest(reference_queries, reference_documents) == nearest(queries, documents)
+    )
+
+    return {
+        "similarities": similarities,
+        "agreement": float(agreement),
+        "texts_per_second": {
+            "torch": 2 * len(texts) / reference_seconds,
+            runtime: 2 * len(texts) / seconds,
+        },
+    }
+
+
+def get_model_name(embeddings_model):
+    """
+    Return the name of the model behind an embeddings model, if known.
+
+    Runtimes other than full precision PyTorch produce slightly different
+    vectors, so their name includes the runtime, e.g. "BAAI/bge-small-en:int8".
+    """
+
+    underlying_embeddings = getattr(
+        embeddings_model, "underlying_embeddings", embeddings_model
     )
+    model_name = getattr(underlying_embeddings, "model_name", None)
+    runtime = getattr(underlying_embeddings, "runtime", "torch")
+    if model_name is None or runtime == "torch":
+        return model_name
+    return f"{model_name}:{runtime}"
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+
+from .embeddings import get_model_name
+from .trace import span
+
+# Default max number of guide tokens to include in prompts that only need the
+# parts of the guide relevant to some text
+DEFAULT_TOKEN_BUDGET = 2000
+
+# Number of split and embedded guides to keep in memory
+MAX_CACHED_GUIDES = 8
+
+# A section starts at a Markdown heading or a numbered rule (e.g. "2. Tones")
+_SECTION_START = re.compile(r"^(#{1,6}\s|\d+[.)]\s)")
+
+
+# Max number of guide tokens to include in prompts, set with set_token_budget.
+# None includes the whole guide.
+token_budget = DEFAULT_TOKEN_BUDGET
+
+
+def set_token_budget(budget):
+    """Replace the guide token budget (None includes the whole guide)."""
+
+    global token_budget
+    token_budget = budget
+
+
+def count_tokens(text):
+    """Roughly estimate the number of tokens in some text."""
+
+    # About four characters per token
+    return len(text) // 4 + 1
+
+
+def split_guide(guide):
+    """Split a guide into sections at Markdown headings and numbered rules."""
+
+    sections = []
+    lines = []
+    for line in guide.splitlines():
+        if _SECTION_START.match(line) and "".join(lines).strip():
+            sections.append("\n".join(lines).strip())
+            lines = []
+        lines.append(line)
+    if "".join(lines).strip():
+        sections.append("\n".join(lines).strip())
+
+    return sections
+
+
+class _EmbeddedGuide:
+    def __init__(self, sections, vectors):
+        self.sections = sections
+        self.vectors = vectors
+        self.tokens = [count_tokens(section) for section in sections]
+
+
+_embedded_guides = OrderedDict()
+_lock = threading.Lock()
+
+
+def _embed_guide(guide, embeddings_model):
+    """Split and embed a guide, reusing the result for the same guide."""
+
+    # Imported here so that the CLI can set the budget without loading numpy
+    from .index import normalize
+
+    key = (
+        get_model_name(embeddings_model),
+        hashlib.sha1(guide.encode("utf-8")).hexdigest(),
+    )
+    with _lock:
+        if key in _embedded_guides:
+            _embedded_guides.move_to_end(key)
+            return _embedded_guides[key]
+
+    sections = split_guide(guide)
+    with span("embed guide", sections=len(sections)):
+        vectors = normalize(embeddings_model.embed_documents(sections))
+    embedded_guide = _EmbeddedGuide(sections, vectors)
+
+    with _lock:
+        _embedded_guides[key] = embedded_guide
+        while len(_embedded_guides) > MAX_CACHED_GUIDES:
+            _embedded_guides.popitem(last=False)
+
+    return embedded_guide
+
+
+def select_guide(guide, text, embeddings_model, budget=None):
+    """
+    Return the sections of a guide most relevant to some text.
+
+    Sections are added from most to least similar to the text until the token
+    budget is used up, and then joined in their original order. The first
+    section usually names and introduces the language, so it is always
+    included. The whole guide is returned if it fits in the budget.
+    """
+
+    import numpy as np
+
+    from .index import normalize
+
+    if budget is None:
+        budget = token_budget
+    if budget is None or count_tokens(guide) <= budget or not text.strip():
+        return guide
+
+    embedded_guide = _embed_guide(guide, embeddings_model)
+    if len(embedded_guide.sections) < 2:
+        return guide
+
+    query = normalize([embeddings_model.embed_query(text)])[0]
+    similarities = embedded_guide.vectors @ query
+
+    # Add the most similar sections that fit in the budget
+    selected = [0]
+    used = embedded_guide.tokens[0]
+    for i in np.argsort(-similarities, kind="stable"):
+        i = int(i)
+        if i == 0 or used + embedded_guide.tokens[i] > budget:
+            continue
+        selected.append(i)
+        used += embedded_guide.tokens[i]
+
+    return "\n\n".join(embedded_guide.sections[i] for i in sorted(selected))
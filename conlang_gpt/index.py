@@ -0,0 +1,526 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .embeddings import get_model_name
+from .quantize import Codec, Encoded, normalize
+from .trace import span
+
+# Number of stored rows to decode at once when comparing against them
+DECODE_BLOCK_SIZE = 4096
+
+# A saved matrix starts with this header and a random generation, which its row
+# map must match
+MATRIX_HEADER = b"CONLANGV"
+MATRIX_HEADER_SIZE = 16
+
+
+def top_k(similarities, k):
+    """
+    Return the column indices of the k largest values in each row, best first.
+
+    Ties are broken by column order, so the result is deterministic.
+    """
+
+    n = similarities.shape[1]
+    k = min(k, n)
+    if k == 1:
+        return np.argmax(similarities, axis=1).reshape(-1, 1)
+
+    # Narrow each row down to its k best candidates, then order them
+    candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    results = []
+    for row, row_candidates in zip(similarities, candidates):
+        # Include every column tied with the k-th best so ties resolve by index
+        cutoff = row[row_candidates].min()
+        tied = np.flatnonzero(row >= cutoff)
+        order = np.lexsort((tied, -row[tied]))[:k]
+        results.append(tied[order])
+
+    return np.array(results)
+
+
+def similar_pairs(vectors, threshold, block_size=1024):
+    """
+    Find every pair of rows whose cosine similarity is above a threshold.
+
+    Yields (i, j, similarity) with i < j, ordered by i and then j. Similarities
+    are computed one block_size x block_size block at a time, so memory use
+    does not depend on the number of rows. vectors can be Encoded rows, which
+    are decoded one block at a time.
+    """
+
+    if not isinstance(vectors, Encoded):
+        vectors = normalize(vectors)
+    n = len(vectors)
+    for start in range(0, n, block_size):
+        rows = vectors[start : start + block_size]
+        row_indices = np.arange(start, start + len(rows)).reshape(-1, 1)
+        pairs = []
+        # Only the upper triangle is needed, so start at the diagonal block
+        for column_start in range(start, n, block_size):
+            columns = vectors[column_start : column_start + block_size]
+            similarities = rows @ columns.T
+            column_indices = np.arange(column_start, column_start + len(columns))
+            above = (similarities > threshold) & (column_indices > row_indices)
+            i, j = np.nonzero(above)
+            pairs.append((i + start, j + column_start, similarities[i, j]))
+
+        i = np.concatenate([pair[0] for pair in pairs])
+        j = np.concatenate([pair[1] for pair in pairs])
+        similarities = np.concatenate([pair[2] for pair in pairs])
+        for k in np.lexsort((j, i)):
+            yield int(i[k]), int(j[k]), float(similarities[k])
+
+
+def similarity_rows(queries, vectors, block_size=1024):
+    """
+    Yield the similarities of each query to every vector, in query order.
+
+    Queries are compared block_size at a time with one matrix multiply each,
+    so only block_size rows of similarities exist at once. vectors can be
+    Encoded rows, which are decoded DECODE_BLOCK_SIZE rows at a time.
+    """
+
+    queries = normalize(queries)
+    if not isinstance(vectors, Encoded):
+        vectors = normalize(vectors)
+        for start in range(0, len(queries), block_size):
+            yield from queries[start : start + block_size] @ vectors.T
+        return
+
+    for start in range(0, len(queries), block_size):
+        yield from _decoded_similarities(
+            queries[start : start + block_size], vectors.rows, vectors.codec
+        )
+
+
+def _decoded_similarities(queries, rows, codec):
+    """Compare normalized queries to stored rows, decoding a block at a time."""
+
+    if codec.precision == "float32":
+        return queries @ np.asarray(rows).T
+
+    # Decoding only normalizes the rows, so divide the dot products by their
+    # norms instead, which is faster than normalizing each block
+    similarities = np.empty((len(queries), len(rows)), dtype=np.float32)
+    for start in range(0, len(rows), DECODE_BLOCK_SIZE):
+        block = rows[start : start + DECODE_BLOCK_SIZE].astype(np.float32)
+        norms = np.sqrt(np.einsum("ij,ij->i", block, block))
+        norms[norms == 0] = 1
+        similarities[:, start : start + len(block)] = (queries @ block.T) / norms
+    return similarities
+
+
+class DictionaryIndex:
+    """
+    Exact nearest-neighbour index over a dictionary.
+
+    Each entry is stored as two normalized rows, one for the conlang word and
+    one for its translation. An entry's similarity to a query is the higher of
+    the two. If a codec is given, the rows are already stored by it and stay
+    compressed, and are only decoded one block at a time while searching.
+    """
+
+    def __init__(self, words, word_vectors, translation_vectors, codec=None):
+        self.words = list(words)
+        self.codec = Codec() if codec is None else codec
+        if codec is None:
+            self.matrix = np.vstack(
+                [normalize(word_vectors), normalize(translation_vectors)]
+            )
+        else:
+            self.matrix = np.concatenate([word_vectors, translation_vectors])
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def from_dictionary(cls, dictionary, embeddings_model, store=None):
+        """
+        Embed every word and translation of a dictionary in one batch.
+
+        If a vector store is given, only entries missing from it are embedded.
+        """
+
+        if store is None:
+            store = VectorStore()
+
+        words = list(dictionary.keys())
+        translations = [dictionary[word] for word in words]
+        vectors = store.get(words + translations, embeddings_model, decoded=False)
+        return cls(
+            words,
+            vectors.rows[: len(words)],
+            vectors.rows[len(words) :],
+            codec=store.codec,
+        )
+
+    def similarities(self, queries):
+        """Return the similarity of each query to each entry."""
+
+        queries = normalize(queries)
+        n = len(self.words)
+        scores = _decoded_similarities(queries, self.matrix, self.codec)
+        return scores.reshape(len(queries), 2, n).max(axis=1)
+
+    def search(self, queries, k=1, min_similarity=None):
+        """
+        Find the k most similar entries for each query.
+
+        Returns one list of (word, similarity) pairs per query, best first.
+        Entries less similar than min_similarity are left out.
+        """
+
+        if not self.words:
+            return [[] for _ in range(len(queries))]
+
+        scores = self.similarities(queries)
+        results = []
+        for row, indices in zip(scores, top_k(scores, k)):
+            matches = [(self.words[i], float(row[i])) for i in indices]
+            if min_similarity is not None:
+                matches = [
+                    (word, similarity)
+                    for word, similarity in matches
+                    if similarity >= min_similarity
+                ]
+            results.append(matches)
+
+        return results
+
+
+class LexicalIndex:
+    """
+    Exact, case-insensitive lookups of the words and translations of a dictionary.
+
+    Maps each lowercase conlang word and each lowercase translation to the
+    words that have it, in the order they were added, so lookups do not need
+    to scan or embed the dictionary.
+    """
+
+    def __init__(self, dictionary=None):
+        self._words = {}
+        self._translations = {}
+        for word, translation in (dictionary or {}).items():
+            self.add(word, translation)
+
+    def add(self, word, translation):
+        """Add an entry."""
+
+        self._words.setdefault(word.lower(), {})[word] = None
+        self._translations.setdefault(translation.lower(), {})[word] = None
+
+    def remove(self, word, translation):
+        """Remove an entry."""
+
+        for entries, key in [
+            (self._words, word.lower()),
+            (self._translations, translation.lower()),
+        ]:
+            words = entries.get(key)
+            if words is None:
+                continue
+            words.pop(word, None)
+            if not words:
+                del entries[key]
+
+    def clear(self):
+        self._words.clear()
+        self._translations.clear()
+
+    def find_words(self, word):
+        """Return the conlang words equal to a word, ignoring case."""
+
+        return list(self._words.get(word.lower(), ()))
+
+    def find_translations(self, translation):
+        """Return the conlang words with a translation, ignoring case."""
+
+        return list(self._translations.get(translation.lower(), ()))
+
+    def find(self, text):
+        """
+        Return the conlang words that text matches exactly, ignoring case.
+
+        Words equal to the text come before words translated as the text.
+        """
+
+        return list(dict.fromkeys(self.find_words(text) + self.find_translations(text)))
+
+
+def _read_generation(path):
+    """Return the generation in the header of a saved matrix, if it has one."""
+
+    with open(path, "rb") as file:
+        header = file.read(MATRIX_HEADER_SIZE)
+    if len(header) < MATRIX_HEADER_SIZE or not header.startswith(MATRIX_HEADER):
+        return None
+    return header[len(MATRIX_HEADER) :].hex()
+
+
+def _key(text, query):
+    kind = "query" if query else "document"
+    return hashlib.sha1(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class VectorStore:
+    """
+    Normalized embeddings of dictionary text, keyed by content hash.
+
+    A store can be persisted next to a dictionary as a raw matrix
+    (``<dictionary>.idx``) and a JSON row map (``<dictionary>.idx.json``). The
+    matrix is memory-mapped when loaded, and saving only appends rows that are
+    not on disk yet. Both files carry the generation of the matrix, so a row
+    map is never used with a matrix it was not written for.
+
+    Rows are stored by the store's codec, which can compress them (see
+    quantize.Codec). They stay compressed in memory and on disk, and are
+    decoded when they are returned.
+    """
+
+    def __init__(self, model_name=None, codec=None):
+        self.model_name = model_name
+        self.codec = Codec() if codec is None else codec
+        self._rows = {}
+        # Rows that are already on disk
+        self._stored = np.zeros((0, 0), dtype=self.codec.dtype)
+        # Rows that were embedded since the store was loaded
+        self._new = []
+        self._new_matrix = None
+        # Where the stored rows were loaded from, and their generation
+        self._path = None
+        self._generation = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    @property
+    def dimensions(self):
+        if len(self._stored):
+            return self._stored.shape[1]
+        if self._new:
+            return len(self._new[0])
+        return 0
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map the store saved at the given path, if there is one."""
+
+        store = cls()
+        try:
+            with open(f"{path}.json", "r") as file:
+                row_map = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return store
+
+        rows = row_map["rows"]
+        dimensions = row_map["dimensions"]
+        codec = Codec.from_json(row_map.get("codec"))
+        generation = row_map.get("generation")
+        size = len(rows) * dimensions * codec.dtype.itemsize
+        if (
+            len(rows) == 0
+            or not os.path.exists(path)
+            or os.path.getsize(path) < MATRIX_HEADER_SIZE + size
+        ):
+            # The matrix is missing or truncated
+            return store
+        if _read_generation(path) != generation:
+            # The matrix was replaced without its row map, or the other way
+            # around
+            return store
+
+        store.model_name = row_map["model"]
+        store.codec = codec
+        store._rows = {key: i for i, key in enumerate(rows)}
+        store._stored = np.memmap(
+            path,
+            dtype=codec.dtype,
+            mode="r",
+            offset=MATRIX_HEADER_SIZE,
+            shape=(len(rows), dimensions),
+        )
+        store._path = path
+        store._generation = generation
+        return store
+
+    @classmethod
+    def from_matrix(cls, keys, matrix, model_name=None, codec=None):
+        """Create a store from rows stored by a codec that are kept somewhere else."""
+
+        store = cls(model_name, codec)
+        store._rows = {key: i for i, key in enumerate(keys)}
+        store._stored = matrix
+        return store
+
+    def save(self, path, keys=None):
+        """
+        Write the store to the given path.
+
+        If keys is given, only rows with those keys are written. Rows that are
+        already on disk are kept as long as most of them are still in use,
+        otherwise the file is rewritten without them. Saving to another path
+        than the store was loaded from always writes every row.
+        """
+
+        live = set(self._rows) if keys is None else set(keys) & set(self._rows)
+        stored = len(self._stored)
+        stale = stored - len([key for key in live if self._rows[key] < stored])
+        if stale > stored // 2 or not stored or path != self._path:
+            # Compact the file into a new generation. The row map is written
+            # first, so a crash before the matrix is replaced leaves a row map
+            # that does not match the old matrix, and both are discarded.
+            order = sorted(live, key=self._rows.get)
+            generation = os.urandom(MATRIX_HEADER_SIZE - len(MATRIX_HEADER))
+            matrix = self.encoded(order)
+            self._save_row_map(path, order, generation.hex())
+            # Write a new file instead of truncating the one that is mapped
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(MATRIX_HEADER + generation)
+                file.write(matrix.tobytes())
+            os.replace(temp_path, path)
+        else:
+            # Append the new rows. The previous row map still matches the
+            # matrix until it is replaced, since it only has fewer rows.
+            order = [
+                key for key in self._rows if key in live and self._rows[key] >= stored
+            ]
+            order.sort(key=self._rows.get)
+            with open(path, "r+b") as file:
+                file.truncate(
+                    MATRIX_HEADER_SIZE
+                    + stored * self.dimensions * self.codec.dtype.itemsize
+                )
+                file.seek(0, os.SEEK_END)
+                file.write(self.encoded(order).tobytes())
+            rows = sorted(
+                (key for key in self._rows if self._rows[key] < stored),
+                key=self._rows.get,
+            )
+            self._save_row_map(path, rows + order, self._generation)
+
+        # Reload the store from disk so that it stays memory-mapped
+        saved = VectorStore.load(path)
+        self._rows = saved._rows
+        self._stored = saved._stored
+        self._new = []
+        self._new_matrix = None
+        self._path = saved._path
+        self._generation = saved._generation
+
+    def _save_row_map(self, path, rows, generation):
+        # Replace the row map atomically, so a crash leaves the previous one
+        temp_path = f"{path}.json.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(
+                {
+                    "model": self.model_name,
+                    "dimensions": self.dimensions,
+                    "codec": self.codec.to_json(),
+                    "generation": generation,
+                    "rows": rows,
+                },
+                file,
+            )
+        os.replace(temp_path, f"{path}.json")
+
+    def encoded(self, keys):
+        """Return the stored rows for the given keys, as stored by the codec."""
+
+        rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64)
+        matrix = np.empty((len(rows), self.dimensions), dtype=self.codec.dtype)
+        stored = len(self._stored)
+        on_disk = rows < stored
+        if on_disk.any():
+            matrix[on_disk] = self._stored[rows[on_disk]]
+        if not on_disk.all():
+            if self._new_matrix is None or len(self._new_matrix) != len(self._new):
+                self._new_matrix = np.array(self._new, dtype=self.codec.dtype)
+            matrix[~on_disk] = self._new_matrix[rows[~on_disk] - stored]
+        return matrix
+
+    def vectors(self, keys):
+        """Return the stored rows for the given keys as normalized embeddings."""
+
+        return self.codec.decode(self.encoded(keys))
+
+    def add(self, keys, vectors):
+        """Add vectors for the given keys, normalizing and encoding them."""
+
+        for key, vector in zip(keys, self.codec.encode(vectors)):
+            if key in self._rows:
+                continue
+            self._rows[key] = len(self._stored) + len(self._new)
+            self._new.append(vector)
+
+    def keys(self, texts, query=False):
+        return [_key(text, query) for text in texts]
+
+    def compressed(self, codec):
+        """
+        Return a copy of the store with every row stored by another codec.
+
+        A projection can only be applied to rows that are not projected yet.
+        If the new codec has none, rows keep the current one.
+        """
+
+        keys = sorted(self._rows, key=self._rows.get)
+        vectors = self.vectors(keys)
+        if codec.components is None:
+            codec = Codec(codec.precision, self.codec.components)
+            matrix = codec.quantize(vectors)
+        elif self.codec.components is None:
+            matrix = codec.encode(vectors)
+        else:
+            raise ValueError("The embeddings are already projected.")
+        return VectorStore.from_matrix(keys, matrix, self.model_name, codec)
+
+    def get(self, texts, embeddings_model, query=False, decoded=True):
+        """
+        Return normalized embeddings for the given texts.
+
+        Only texts that are not in the store yet are embedded, in one batch.
+        If decoded is not set, the rows are returned as stored, as Encoded
+        rows, so that large matrices are not decoded all at once.
+        """
+
+        model_name = get_model_name(embeddings_model)
+        if model_name != self.model_name:
+            if len(self):
+                # The stored vectors came from a different model, which a
+                # projection does not apply to
+                self.__init__(codec=Codec(self.codec.precision))
+            self.model_name = model_name
+
+        keys = self.keys(texts, query)
+        missing = list(
+            dict.fromkeys(
+                text for text, key in zip(texts, keys) if key not in self._rows
+            )
+        )
+        if missing:
+            with span("embed", texts=len(missing), query=query):
+                if query and hasattr(embeddings_model, "embed_queries"):
+                    vectors = embeddings_model.embed_queries(missing)
+                elif query:
+                    vectors = [embeddings_model.embed_query(text) for text in missing]
+                else:
+                    vectors = embeddings_model.embed_documents(missing)
+            self.add(self.keys(missing, query), vectors)
+
+        if not decoded:
+            if not keys:
+                return Encoded(
+                    np.zeros((0, self.dimensions), dtype=self.codec.dtype), self.codec
+                )
+            return Encoded(self.encoded(keys), self.codec)
+        if not keys:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return self.vectors(keys)
@@ -1,14 +1,26 @@
 import csv
 import io
-from itertools import combinations
 import math
-import re
-from openai.embeddings_utils import cosine_similarity
 import os
+import re
 
 import click
-
-from .openai import complete_chat
+import numpy as np
+
+from . import ann
+from .checkpoint import Checkpoint
+from .guide import select_guide
+from .index import (
+    DictionaryIndex,
+    LexicalIndex,
+    VectorStore,
+    similar_pairs,
+    similarity_rows,
+)
+from .openai import complete_chat, complete_chats, get_model
+from .storage import get_backend
+from .tokens import STOPWORDS, lemmas, tokenize
+from .trace import traced
 
 
 class LanguageError(Exception):
@@ -55,46 +67,190 @@ class TranslationError(LanguageError):
     pass
 
 
-def _get_related_words(text, dictionary, embeddings_model):
-    """Get the most related words from the dictionary."""
+class Dictionary(dict):
+    """
+    A Conlang-to-English dictionary.
+
+    Behaves like a regular dict, but also carries a store of embeddings for
+    its words and translations so that they are only computed once, and an
+    index of its words and translations for exact lookups, which is kept up
+    to date as the dictionary changes. It also keeps track of the words that
+    changed since it was loaded, saved or last searched, so that only those
+    are written or indexed again.
+    """
 
-    click.echo(
-        click.style(f"Getting the most relevant words from the dictionary...", dim=True)
-    )
+    def __init__(self, *args, embeddings=None, search_index=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.embeddings = VectorStore() if embeddings is None else embeddings
+        # An approximate index that is kept up to date as the dictionary
+        # changes, or None to search the dictionary exactly
+        self.search_index = search_index
+        self.lexicon = LexicalIndex(self)
+        # The file the dictionary was loaded from or last saved to, and the
+        # words added, changed or removed since then (None if unknown)
+        self.saved_path = None
+        self.unsaved = None
+        # The words added, changed or removed since the search index was
+        # last updated with the dictionary
+        self.unindexed = set()
+
+    def _changed(self, word):
+        self.unindexed.add(word)
+        if self.unsaved is not None:
+            self.unsaved.add(word)
+
+    def __setitem__(self, word, translation):
+        if word in self:
+            self.lexicon.remove(word, self[word])
+        super().__setitem__(word, translation)
+        self.lexicon.add(word, translation)
+        self._changed(word)
+
+    def __delitem__(self, word):
+        translation = self[word]
+        super().__delitem__(word)
+        self.lexicon.remove(word, translation)
+        self._changed(word)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, word, *default):
+        if word not in self:
+            return super().pop(word, *default)
+        translation = super().pop(word)
+        self.lexicon.remove(word, translation)
+        self._changed(word)
+        return translation
+
+    def popitem(self):
+        word, translation = super().popitem()
+        self.lexicon.remove(word, translation)
+        self._changed(word)
+        return word, translation
+
+    def setdefault(self, word, translation=None):
+        if word not in self:
+            self[word] = translation
+        return self[word]
+
+    def update(self, *args, **kwargs):
+        for word, translation in dict(*args, **kwargs).items():
+            self[word] = translation
+
+    def clear(self):
+        self.unindexed.update(self)
+        if self.unsaved is not None:
+            self.unsaved.update(self)
+        super().clear()
+        self.lexicon.clear()
+
+    def copy(self):
+        """Return a copy that shares the embeddings and search index."""
+
+        copy = Dictionary(
+            self, embeddings=self.embeddings, search_index=self.search_index
+        )
+        copy.saved_path = self.saved_path
+        copy.unsaved = None if self.unsaved is None else set(self.unsaved)
+        return copy
+
+    def embedding_keys(self):
+        """Return the vector store keys used by the entries of this dictionary."""
+
+        translations = list(self.values())
+        return (
+            self.embeddings.keys(list(self.keys()))
+            + self.embeddings.keys(translations)
+            + self.embeddings.keys(translations, query=True)
+        )
 
-    # Calculate the cosine similarity between each word in the text and each
-    # word in the dictionary (both the word and its English translation)
-    words_in_text = text.split()
-    word_embeddings = [
-        embeddings_model.embed_documents([word])[0] for word in words_in_text
-    ]
-    related_words = []
-    for word_embedding in word_embeddings:
-        word_similarities = {}
-        for word, translation in dictionary.items():
-            word_similarity = cosine_similarity(
-                word_embedding, embeddings_model.embed_documents([word])[0]
-            )
-            translation_similarity = cosine_similarity(
-                word_embedding, embeddings_model.embed_documents([translation])[0]
-            )
-            similarity = max(word_similarity, translation_similarity)
-            word_similarities[word] = similarity
 
-        if not word_similarities:
-            continue
+def _get_embeddings(dictionary):
+    """Get the vector store of a dictionary, or a new one for a plain dict."""
 
-        most_related_word = sorted(
-            word_similarities, key=word_similarities.get, reverse=True
-        )[0]
+    if isinstance(dictionary, Dictionary):
+        return dictionary.embeddings
 
-        # Skip words that aren't similar enough
-        if word_similarities[most_related_word] < 0.75:
-            continue
+    return VectorStore()
+
+
+def _get_lexicon(dictionary):
+    """Get the exact lookup index of a dictionary, or build one for a plain dict."""
 
-        related_words.append(most_related_word)
+    if isinstance(dictionary, Dictionary):
+        return dictionary.lexicon
 
-    return related_words
+    return LexicalIndex(dictionary)
+
+
+def _get_search_index(dictionary, embeddings_model):
+    """Get an index for finding the entries most similar to some text."""
+
+    store = _get_embeddings(dictionary)
+    index = getattr(dictionary, "search_index", None)
+    if index is None:
+        return DictionaryIndex.from_dictionary(dictionary, embeddings_model, store)
+
+    # Only compare the entries that changed since the last search
+    words = getattr(dictionary, "unindexed", None)
+    index.update(dictionary, embeddings_model, store, words=words)
+    if words is not None:
+        words.clear()
+    return index
+
+
+@traced("related words")
+def _get_related_words(text, dictionary, embeddings_model, min_similarity=0.75):
+    """Get the most related words from the dictionary."""
+
+    click.echo(
+        click.style(f"Getting the most relevant words from the dictionary...", dim=True)
+    )
+
+    # Only look up each distinct word once, without punctuation or case
+    words_in_text = list(dict.fromkeys(tokenize(text)))
+    if not dictionary or not words_in_text:
+        return []
+
+    # Words that are exactly a conlang word or a translation, or whose base
+    # form is, are looked up without embedding them
+    lexicon = _get_lexicon(dictionary)
+    most_related_words = {}
+    unmatched_words = []
+    for word in words_in_text:
+        matches = lexicon.find(word)
+        for lemma in lemmas(word):
+            if matches:
+                break
+            matches = lexicon.find(lemma)
+
+        if matches:
+            most_related_words[word] = matches
+        elif word not in STOPWORDS:
+            unmatched_words.append(word)
+
+    # Embed each other word in the text, and find the dictionary entry closest
+    # to it (comparing against both the conlang word and its English
+    # translation). Stopwords are too vague to search for.
+    if unmatched_words:
+        store = _get_embeddings(dictionary)
+        word_embeddings = store.get(unmatched_words, embeddings_model)
+        index = _get_search_index(dictionary, embeddings_model)
+        matches = index.search(word_embeddings, k=1, min_similarity=min_similarity)
+        for word, word_matches in zip(unmatched_words, matches):
+            if word_matches:
+                most_related_words[word] = [word_matches[0][0]]
+
+    # List each related word once, in the order of the text
+    return list(
+        dict.fromkeys(
+            related_word
+            for word in words_in_text
+            for related_word in most_related_words.get(word, [])
+        )
+    )
 
 
 def _parse_dictionary_from_paragraph(paragraph, similarity_threshold, embeddings_model):
@@ -137,6 +293,7 @@ def _parse_dictionary_from_paragraph(paragraph, similarity_threshold, embeddings
     return dictionary
 
 
+@traced("parse dictionary")
 def _parse_dictionary(text, similarity_threshold, embeddings_model):
     if text.startswith("```") and text.endswith("```"):
         text = text[3:-3].removeprefix("csv\n")
@@ -165,14 +322,63 @@ def _parse_dictionary(text, similarity_threshold, embeddings_model):
     return dictionary
 
 
-def translate_text(text, language_guide, dictionary, model, embeddings_model):
-    """Translate text into a constructed language."""
+class _TranslationParser:
+    """Find the translation in a response as it is streamed."""
+
+    def __init__(self):
+        self.response = ""
+        self.translation = None
+
+    def feed(self, chunk):
+        """
+        Add the next chunk of the response.
+
+        Returns the translation once its closing tag has arrived, otherwise
+        None.
+        """
+
+        self.response += chunk
+        if self.translation is None:
+            match = re.search(
+                "<translation>(.*?)</translation>",
+                self.response,
+                flags=re.IGNORECASE | re.DOTALL,
+            )
+            if match:
+                self.translation = match.group(1)
+
+        return self.translation
+
+
+def translate_text(
+    text,
+    language_guide,
+    dictionary,
+    model,
+    embeddings_model,
+    on_translation=None,
+    explain=True,
+):
+    """
+    Translate text into a constructed language.
+
+    The response is streamed. on_translation, if given, is called with the
+    translation as soon as it arrives. If explain is not set, the response is
+    cut off there and the explanation returned is None.
+    """
 
     # Get the most related words from the dictionary
     related_words = _get_related_words(text, dictionary, embeddings_model)
 
+    # Only include the parts of the guide that are relevant to the text
+    language_guide = select_guide(language_guide, text, embeddings_model)
+
     # Translate the text
-    click.echo(click.style(f"Translating text using {model}...", dim=True))
+    click.echo(
+        click.style(
+            f"Translating text using {get_model('translate', model)}...", dim=True
+        )
+    )
     if related_words:
         formatted_related_words = "\n".join(
             [f"- {word}: {dictionary[word]}" for word in related_words]
@@ -180,58 +386,60 @@ def translate_text(text, language_guide, dictionary, model, embeddings_model):
         click.echo(
             click.style(f"Most related words:\n\n{formatted_related_words}", dim=True)
         )
-        chat_completion = complete_chat(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Translate the text below from or into the following constructed language. Explain how you arrived at the translation. Only use words found in either the guide or the list below. Wrap the final translation with <translation> and </translation>.\n\nLanguage guide:\n\n{language_guide}\n\nPotentially-related words:\n\n{formatted_related_words}\n\nText to translate:\n\n{text}",
-                }
-            ],
-            temperature=0,
-        )
-        response = chat_completion["choices"][0]["message"]["content"]
+        content = f"Translate the text below from or into the following constructed language. Explain how you arrived at the translation. Only use words found in either the guide or the list below. Wrap the final translation with <translation> and </translation>.\n\nLanguage guide:\n\n{language_guide}\n\nPotentially-related words:\n\n{formatted_related_words}\n\nText to translate:\n\n{text}"
 
     else:
-        chat_completion = complete_chat(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Translate the text below from or into the following constructed language. Explain how you arrived at the translation. Only use words found in the guide.\n\nNo relevant words from dictionary found. Wrap the final translation with <translation> and </translation>.\n\nLanguage guide:\n\n{language_guide}\n\nText to translate:\n\n{text}",
-                }
-            ],
-            temperature=0,
-        )
-        response = chat_completion["choices"][0]["message"]["content"]
+        content = f"Translate the text below from or into the following constructed language. Explain how you arrived at the translation. Only use words found in the guide.\n\nNo relevant words from dictionary found. Wrap the final translation with <translation> and </translation>.\n\nLanguage guide:\n\n{language_guide}\n\nText to translate:\n\n{text}"
+
+    chunks = complete_chat(
+        stage="translate",
+        model=model,
+        messages=[{"role": "user", "content": content}],
+        temperature=0,
+        stream=True,
+    )
 
-    # Parse the translation
-    if (
-        "<translation>" not in response.lower()
-        or "</translation>" not in response.lower()
-    ):
+    # Parse the translation as the response arrives
+    parser = _TranslationParser()
+    try:
+        for chunk in chunks:
+            if parser.feed(chunk) is None:
+                continue
+
+            if on_translation is not None:
+                on_translation(parser.translation)
+                on_translation = None
+            if not explain:
+                break
+    finally:
+        chunks.close()
+    response = parser.response
+
+    if parser.translation is None:
         # If the translation is not wrapped in <translation> and </translation>,
         # the response is probably an explanation of why the text cannot be
         # translated.
         raise TranslationError(response)
 
-    # Extract the final translation
-    translated_text = re.split("<translation>", response, flags=re.IGNORECASE)[1]
-    translated_text = re.split("</translation>", translated_text, flags=re.IGNORECASE)[
-        0
-    ]
+    if not explain:
+        return parser.translation, None
+
     # Remove the xml markup from the explanation
     explanation = re.sub("<translation>", "", response, flags=re.IGNORECASE)
     explanation = re.sub("</translation>", "", explanation, flags=re.IGNORECASE)
 
-    return translated_text, explanation
+    return parser.translation, explanation
 
 
 def generate_english_text(model):
     click.echo(
-        click.style(f"Generating random English text using {model}...", dim=True)
+        click.style(
+            f"Generating random English text using {get_model('sample', model)}...",
+            dim=True,
+        )
     )
     chat_completion = complete_chat(
+        stage="sample",
         model=model,
         temperature=0.9,
         frequency_penalty=0.5,
@@ -250,11 +458,16 @@ def generate_english_text(model):
 
 
 def improve_language(guide, dictionary, model, embeddings_model, text=None):
-    click.echo(click.style(f"Improving language using {model}...", dim=True))
+    click.echo(
+        click.style(
+            f"Improving language using {get_model('critique', model)}...", dim=True
+        )
+    )
 
     if text is None:
         # Identify problems with the language
         chat_completion = complete_chat(
+            stage="critique",
             model=model,
             temperature=0.5,
             presence_penalty=0.5,
@@ -280,6 +493,7 @@ def improve_language(guide, dictionary, model, embeddings_model, text=None):
 
         # Identify problems with the language using the translated text as an example/reference
         chat_completion = complete_chat(
+            stage="critique",
             model=model,
             temperature=0.1,
             # TODO: Replace with `presence_penalty=0.1`
@@ -302,6 +516,7 @@ def improve_language(guide, dictionary, model, embeddings_model, text=None):
 
     # Rewrite the language guide
     chat_completion = complete_chat(
+        stage="guide",
         model=model,
         temperature=0.1,
         messages=[
@@ -319,8 +534,9 @@ def improve_language(guide, dictionary, model, embeddings_model, text=None):
 def generate_language(design_goals, model):
     """Generate a constructed language."""
 
-    click.echo(f"Generating language using {model}...")
+    click.echo(f"Generating language using {get_model('guide', model)}...")
     chat_completion = complete_chat(
+        stage="guide",
         model=model,
         temperature=0.9,
         presence_penalty=0.5,
@@ -340,8 +556,13 @@ def generate_language(design_goals, model):
 def modify_language(guide, changes, model):
     """Apply specified changes to a constructed language."""
 
-    click.echo(click.style(f"Modifying language using {model}...", dim=True))
+    click.echo(
+        click.style(
+            f"Modifying language using {get_model('guide', model)}...", dim=True
+        )
+    )
     chat_completion = complete_chat(
+        stage="guide",
         model=model,
         temperature=0.1,
         messages=[
@@ -356,30 +577,36 @@ def modify_language(guide, changes, model):
     return improved_guide
 
 
+@traced("reduce dictionary")
 def reduce_dictionary(words, similarity_threshold, embeddings_model):
     """Remove similar words from a dictionary."""
 
     click.echo(click.style(f"Removing similar words using local model...", dim=True))
 
-    # Retrieve the embeddings for each word
-    translation_embeddings = {
-        word: embeddings_model.embed_query(translation)
-        for word, translation in words.items()
-    }
+    # A single word cannot be similar to another one
+    if len(words) < 2:
+        return words
 
-    # Remove similar words
+    # Retrieve the embeddings for each word, keeping them compressed if they
+    # are stored compressed
+    store = _get_embeddings(words)
+    word_list = list(words.keys())
+    translation_embeddings = store.get(
+        list(words.values()), embeddings_model, query=True, decoded=False
+    )
+
+    # Remove similar words, keeping the first of each similar pair
     words_to_remove = set()
-    for (word_a, embedding_a), (word_b, embedding_b) in combinations(
-        translation_embeddings.items(), 2
-    ):
-        if cosine_similarity(embedding_a, embedding_b) > similarity_threshold:
-            click.echo(
-                click.style(
-                    f"Removing {word_b} ({words[word_b]}) because it is too similar to {word_a} ({words[word_a]}).",
-                    dim=True,
-                )
+    for i, j, _ in similar_pairs(translation_embeddings, similarity_threshold):
+        word_a = word_list[i]
+        word_b = word_list[j]
+        click.echo(
+            click.style(
+                f"Removing {word_b} ({words[word_b]}) because it is too similar to {word_a} ({words[word_a]}).",
+                dim=True,
             )
-            words_to_remove.add(word_b)
+        )
+        words_to_remove.add(word_b)
 
     # Remove the similar words from the dictionary
     for word in words_to_remove:
@@ -393,11 +620,16 @@ def create_dictionary_for_text(
 ) -> dict:
     """Generate words for a constructed language."""
 
-    click.echo(click.style(f"Generating words using {model}...", dim=True))
+    click.echo(
+        click.style(f"Generating words using {get_model('words', model)}...", dim=True)
+    )
 
     # Get related words from the existing dictionary
     related_words = _get_related_words(text, existing_dictionary, embeddings_model)
 
+    # Only include the parts of the guide that are relevant to the text
+    relevant_guide = select_guide(guide, text, embeddings_model)
+
     # Format the related words as a CSV document
     mutable_formatted_related_words = io.StringIO()
     writer = csv.writer(mutable_formatted_related_words)
@@ -410,11 +642,12 @@ def create_dictionary_for_text(
     user_message = None
     if len(related_words) > 0:
         click.echo(f"Related words:\n\n{formatted_related_words}\n")
-        user_message = f"Create any new words required to translate the following text into the constructed language outlined below. The Conlang-to-English dictionary is lazy-generated. The words you create will be saved to this dictionary. Write each new word in its root form. Omit words that can be derived from existing words in the dictionary. Omit all proper nouns, except for common words (such as days of the week). In general, the conlang word should not resemble its English translation. Your response should be a CSV document with any new words. The document should start with the following header: Conlang,English. Any following rows should have exactly two cells and contain each new word with its translation.\n\nLanguage guide:\n\n{guide}\n\nText to translate (either from or to the conlang):\n\n{text}\n\nExisting words that could be related:\n\n{formatted_related_words}"
+        user_message = f"Create any new words required to translate the following text into the constructed language outlined below. The Conlang-to-English dictionary is lazy-generated. The words you create will be saved to this dictionary. Write each new word in its root form. Omit words that can be derived from existing words in the dictionary. Omit all proper nouns, except for common words (such as days of the week). In general, the conlang word should not resemble its English translation. Your response should be a CSV document with any new words. The document should start with the following header: Conlang,English. Any following rows should have exactly two cells and contain each new word with its translation.\n\nLanguage guide:\n\n{relevant_guide}\n\nText to translate (either from or to the conlang):\n\n{text}\n\nExisting words that could be related:\n\n{formatted_related_words}"
     else:
-        user_message = f"Create all the root words required to translate the following text into the constructed language outlined below. The Conlang-to-English dictionary is lazy-generated. None of the words found in the text currently have translations in this dictionary. The words you create will be saved there. Write each word in its root form. In general, the conlang word should not resemble its English translation. YYour response should be a CSV document beginning with the following header: Conlang,English. Each row should have exactly two cells.\n\nLanguage guide:\n\n{guide}\n\nEnglish text:\n\n{text}."
+        user_message = f"Create all the root words required to translate the following text into the constructed language outlined below. The Conlang-to-English dictionary is lazy-generated. None of the words found in the text currently have translations in this dictionary. The words you create will be saved there. Write each word in its root form. In general, the conlang word should not resemble its English translation. YYour response should be a CSV document beginning with the following header: Conlang,English. Each row should have exactly two cells.\n\nLanguage guide:\n\n{relevant_guide}\n\nEnglish text:\n\n{text}."
 
     chat_completion = complete_chat(
+        stage="words",
         model=model,
         messages=[
             {
@@ -438,12 +671,10 @@ def create_dictionary_for_text(
         return {}
 
     # Remove new words that already had translations in the conlang
-    existing_english_words = set(
-        [word.lower() for word in existing_dictionary.values()]
-    )
+    lexicon = _get_lexicon(existing_dictionary)
     words_to_remove = set()
     for conlang_word, english_word in words.items():
-        if english_word.lower() in existing_english_words:
+        if lexicon.find_translations(english_word):
             click.echo(
                 click.style(
                     f"Removed {conlang_word} because it already had a translation.",
@@ -456,14 +687,12 @@ def create_dictionary_for_text(
 
     # Regenerate duplicate conlang words
     while True:
-        # Get the words that are already in the dictionary
-        existing_conlang_words = set([word.lower() for word in existing_dictionary])
-
         # Get the words that are in the dictionary but have different translations
         conflicting_words = {}
         for word in words:
-            if word.lower() in existing_conlang_words:
-                conflicting_words[word] = existing_dictionary[word]
+            existing_words = lexicon.find_words(word)
+            if existing_words:
+                conflicting_words[word] = existing_dictionary[existing_words[0]]
 
         # If there are no conflicting words, stop
         if len(conflicting_words) == 0:
@@ -480,6 +709,9 @@ def create_dictionary_for_text(
         for word, translation in conflicting_words.items():
             writer.writerow([word, translation])
         formatted_conflicting_words = mutable_formatted_conflicting_words.getvalue()
+        relevant_guide = select_guide(
+            guide, " ".join(conflicting_words.values()), embeddings_model
+        )
 
         # Regenerate the conflicting words
         click.echo(
@@ -489,11 +721,12 @@ def create_dictionary_for_text(
             )
         )
         chat_completion = complete_chat(
+            stage="regenerate",
             model=model,
             messages=[
                 {
                     "role": "user",
-                    "content": f"Replace the following conlang words with completely new ones. The translations should remain exactly the same. Your response should be a CSV document with two columns: Conlang and English. Each row should have exactly two cells.\n\nLanguage guide:\n\n{guide}\n\nWords to regenerate:\n\n{formatted_conflicting_words}",
+                    "content": f"Replace the following conlang words with completely new ones. The translations should remain exactly the same. Your response should be a CSV document with two columns: Conlang and English. Each row should have exactly two cells.\n\nLanguage guide:\n\n{relevant_guide}\n\nWords to regenerate:\n\n{formatted_conflicting_words}",
                 }
             ],
             temperature=1,
@@ -528,40 +761,90 @@ def create_dictionary_for_text(
 
 
 def improve_dictionary(
-    dictionary, guide, similarity_threshold, model, embeddings_model, batch_size=25
+    dictionary,
+    guide,
+    similarity_threshold,
+    model,
+    embeddings_model,
+    batch_size=25,
+    max_concurrency=4,
+    completed=None,
+    on_batch=None,
 ):
-    """Update the dictionary to match the guide by focusing on updating the words themselves instead of their translations."""
+    """
+    Update the dictionary to match the guide by focusing on updating the words themselves instead of their translations.
 
-    click.echo(click.style(f"Improving dictionary using {model}...", dim=True))
+    completed maps the indexes of batches that were already improved to their
+    responses, which are used instead of requesting them again. on_batch is
+    called with the index and response of each batch as soon as it arrives.
+    """
+
+    click.echo(
+        click.style(
+            f"Improving dictionary using {get_model('improve-words', model)}...",
+            dim=True,
+        )
+    )
 
     # Get the words to improve
     words_to_improve = list(dictionary.keys())
+    batches = [
+        words_to_improve[i : i + batch_size]
+        for i in range(0, len(words_to_improve), batch_size)
+    ]
 
-    # Improve the words
-    for i in range(0, len(words_to_improve), batch_size):
+    # Request improvements for all the batches at once, with at most
+    # max_concurrency requests in flight. Batches that were already improved
+    # are not requested again.
+    responses = dict(completed or {})
+    pending = [i for i in range(len(batches)) if i not in responses]
+    requests = []
+    for batch in [batches[i] for i in pending]:
         # Dump the batch to a csv string
         mutable_batch_string = io.StringIO()
         writer = csv.writer(mutable_batch_string)
         writer.writerow(["Conlang", "English"])
-        for word in words_to_improve[i : i + batch_size]:
-            if not word in dictionary:
-                continue
+        for word in batch:
             writer.writerow([word, dictionary[word]])
         formatted_batch = mutable_batch_string.getvalue()
 
-        # Improve the words
-        chat_completion = complete_chat(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f'Ensure that the following words are correctly translated into the constructed language outlined below. If any of the words do not adhere to the guide below, update them as you see fit. Your response should be a CSV document with two columns: Conlang and English. Each row represents an updated word and should have exactly two cells. If the word list below is correct and complete, respond with "No problems found".\n\nLanguage guide:\n\n{guide}\n\nWords to improve:\n\n{formatted_batch}',
-                }
-            ],
-            temperature=0,
-            presence_penalty=1,
+        # Only include the parts of the guide relevant to the batch
+        relevant_guide = select_guide(
+            guide, " ".join(dictionary[word] for word in batch), embeddings_model
+        )
+
+        requests.append(
+            dict(
+                stage="improve-words",
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": f'Ensure that the following words are correctly translated into the constructed language outlined below. If any of the words do not adhere to the guide below, update them as you see fit. Your response should be a CSV document with two columns: Conlang and English. Each row represents an updated word and should have exactly two cells. If the word list below is correct and complete, respond with "No problems found".\n\nLanguage guide:\n\n{relevant_guide}\n\nWords to improve:\n\n{formatted_batch}',
+                    }
+                ],
+                temperature=0,
+                presence_penalty=1,
+            )
+        )
+
+    # Journal each batch as soon as it arrives, if asked to
+    kwargs = {}
+    if on_batch is not None:
+        kwargs["on_completion"] = lambda i, chat_completion: on_batch(
+            pending[i], chat_completion["choices"][0]["message"]["content"]
         )
-        response = chat_completion["choices"][0]["message"]["content"]
+
+    if requests:
+        chat_completions = complete_chats(
+            requests, max_concurrency=max_concurrency, **kwargs
+        )
+        for i, chat_completion in zip(pending, chat_completions):
+            responses[i] = chat_completion["choices"][0]["message"]["content"]
+
+    # Apply the improvements in batch order
+    for i, batch in enumerate(batches):
+        response = responses[i]
 
         # Parse the response
         if "No problems found" in response:
@@ -576,7 +859,7 @@ def improve_dictionary(
 
         # Update the words in the dictionary with the improved words
         for improved_word, improved_translation in improved_words.items():
-            for existing_word in words_to_improve[i : i + batch_size]:
+            for existing_word in batch:
                 if not existing_word in dictionary:
                     continue
 
@@ -593,44 +876,47 @@ def improve_dictionary(
     return dictionary
 
 
+@traced("merge dictionaries")
 def merge_dictionaries(a, b, similarity_threshold, embeddings_model):
     """Merge two vocabulary dictionaries, removing similar words."""
 
     click.echo(click.style(f"Merging dictionaries using local model...", dim=True))
 
-    # Retrieve the embeddings for each translation
-    a_embeddings = {
-        word: embeddings_model.embed_query(translation)
-        for word, translation in a.items()
-    }
-    b_embeddings = {
-        word: embeddings_model.embed_query(translation)
-        for word, translation in b.items()
-    }
-
-    # Calculate the cosine similarity between each pair of translations
-    a = dict(a)
+    # Retrieve the embeddings for each translation. The existing dictionary's
+    # embeddings are usually stored already, so only the new words are
+    # embedded.
+    store = _get_embeddings(a)
     b = dict(b)
-    similarities = {}
-    for a_word, a_embedding in a_embeddings.items():
-        for b_word, b_embedding in b_embeddings.items():
-            similarities[(a_word, b_word)] = cosine_similarity(a_embedding, b_embedding)
+    a_words = list(a.keys())
+    removed_words = []
 
+    # Compare each new word against the closest remaining existing word.
     # Remove words whose translations are too similar. Prefer shorter words.
-    for (a_word, b_word), similarity in similarities.items():
-        # Skip words that have already been removed
-        if a_word not in a or b_word not in b:
-            continue
+    # There is nothing to compare (or embed) if either dictionary is empty.
+    if a and b:
+        a_embeddings = store.get(
+            list(a.values()), embeddings_model, query=True, decoded=False
+        )
+        b_embeddings = store.get(list(b.values()), embeddings_model, query=True)
+        removed = np.zeros(len(a_words), dtype=bool)
+        for b_word, similarities in zip(
+            list(b.keys()), similarity_rows(b_embeddings, a_embeddings)
+        ):
+            similarities[removed] = -np.inf
+            i = int(np.argmax(similarities))
+            if similarities[i] <= similarity_threshold:
+                continue
 
-        if similarity > similarity_threshold:
+            a_word = a_words[i]
             if len(b_word) < len(a_word):
                 click.echo(
                     click.style(
-                        f"Removing {a_word} ({b[b_word]}) because it is too similar to {b_word} ({b[b_word]}).",
+                        f"Removing {a_word} ({a[a_word]}) because it is too similar to {b_word} ({b[b_word]}).",
                         dim=True,
                     )
                 )
-                del a[a_word]
+                removed_words.append(a_word)
+                removed[i] = True
             else:
                 click.echo(
                     click.style(
@@ -640,33 +926,265 @@ def merge_dictionaries(a, b, similarity_threshold, embeddings_model):
                 )
                 del b[b_word]
 
-    # Merge the dictionaries
-    merged = {**a, **b}
+    # Merge the dictionaries, keeping track of the words that changed
+    if isinstance(a, Dictionary):
+        merged = a.copy()
+    else:
+        merged = Dictionary(a, embeddings=store)
+    for word in removed_words:
+        del merged[word]
+    merged.update(b)
 
     return merged
 
 
-def load_dictionary(dictionary_path):
-    # Load the dictionary
-    if os.path.exists(dictionary_path):
-        with open(dictionary_path, "r") as file:
-            reader = csv.reader(file)
+def improve_language_and_dictionary(
+    guide,
+    dictionary,
+    max_iterations,
+    similarity_threshold,
+    model,
+    embeddings_model,
+    max_concurrency=4,
+    text=None,
+    checkpoint=None,
+):
+    """
+    Improve a guide and dictionary, optionally using an English text to find
+    problems. Returns the improved guide and dictionary.
+
+    Each step that calls the OpenAI API is journaled in the checkpoint, if
+    given, and replayed from it if it already finished.
+    """
 
-            # Skip the header row
-            next(reader)
+    if checkpoint is None:
+        checkpoint = Checkpoint(None, None)
 
-            # Load the dictionary
-            dictionary = {row[0]: row[1] for row in reader}
-    else:
-        dictionary = {}
+    # Revise the language guide
+    for _ in range(max_iterations):
+        # Try to improve the language guide
+        improved_guide = checkpoint.step(
+            "improve guide",
+            lambda: improve_language(guide, dictionary, model, embeddings_model, text),
+        )
+
+        # Stop if no problems were found
+        if improved_guide is None:
+            break
+
+        # Update the language guide
+        guide = improved_guide
+
+        # Update the dictionary with the new guide, journaling each batch
+        while True:
+            try:
+                dictionary = improve_dictionary(
+                    dictionary,
+                    guide,
+                    similarity_threshold,
+                    model,
+                    embeddings_model,
+                    max_concurrency=max_concurrency,
+                    completed=checkpoint.parts("improve dictionary"),
+                    on_batch=lambda i, response: checkpoint.record_part(
+                        "improve dictionary", i, response
+                    ),
+                )
+                break
+            except ImproveDictionaryError as e:
+                # If the dictionary can't be updated, it is most likely because
+                # the guide is invalid. Try to fix the guide and then try
+                # again.
+                changes = f"The following problem(s) with the guide were encountered while updating the dictionary:\n\n{e}"
+                click.echo(click.style(changes, fg="yellow"))
+                modified_guide = checkpoint.step(
+                    "modify guide", lambda: modify_language(guide, changes, model)
+                )
+                if modified_guide == guide:
+                    click.echo(
+                        click.style(
+                            "The guide could not be modified to fix the problem(s).",
+                            fg="yellow",
+                        )
+                    )
+                else:
+                    click.echo(
+                        click.style(
+                            "The guide was modified to fix the problem(s).", dim=True
+                        )
+                    )
+                    guide = modified_guide
+
+    return guide, dictionary
+
+
+def modify_language_and_dictionary(
+    guide,
+    dictionary,
+    changes,
+    similarity_threshold,
+    model,
+    embeddings_model,
+    max_concurrency=4,
+):
+    """Apply changes to a guide and dictionary. Returns the modified guide and dictionary."""
+
+    # Update the language guide
+    guide = modify_language(guide, changes, model)
+
+    # Update the dictionary with the new guide
+    dictionary = improve_dictionary(
+        dictionary,
+        guide,
+        similarity_threshold,
+        model,
+        embeddings_model,
+        max_concurrency=max_concurrency,
+    )
+
+    return guide, dictionary
+
+
+def translate_and_improve(
+    guide,
+    dictionary,
+    text,
+    max_improvements,
+    similarity_threshold,
+    model,
+    embeddings_model,
+    max_concurrency=4,
+    on_translation=None,
+    explain=True,
+    checkpoint=None,
+):
+    """
+    Translate one text, improving the guide and dictionary along the way.
+
+    Returns the updated guide and dictionary, the translation and its
+    explanation (None unless explain is set). on_translation is called with
+    the translation as soon as it arrives. Each step that calls the OpenAI
+    API is journaled in the checkpoint, if given, and replayed from it if it
+    already finished.
+    """
+
+    if checkpoint is None:
+        checkpoint = Checkpoint(None, None)
 
+    # Add any missing words to the dictionary
+    new_words = checkpoint.step(
+        "create words",
+        lambda: create_dictionary_for_text(
+            guide, text, dictionary, similarity_threshold, model, embeddings_model
+        ),
+        key=text,
+    )
+    dictionary = merge_dictionaries(
+        dictionary, new_words, similarity_threshold, embeddings_model
+    )
+
+    # Improve the language guide and dictionary using the English text
+    guide, dictionary = improve_language_and_dictionary(
+        guide,
+        dictionary,
+        max_improvements,
+        similarity_threshold,
+        model,
+        embeddings_model,
+        max_concurrency,
+        text=text,
+        checkpoint=checkpoint,
+    )
+
+    # Translate the text. A translation replayed from the checkpoint is
+    # passed to on_translation too.
+    streamed = []
+
+    def on_streamed_translation(translation):
+        streamed.append(translation)
+        if on_translation is not None:
+            on_translation(translation)
+
+    translated_text, explanation = checkpoint.step(
+        "translate",
+        lambda: list(
+            translate_text(
+                text,
+                guide,
+                dictionary,
+                model,
+                embeddings_model,
+                on_translation=on_streamed_translation,
+                explain=explain,
+            )
+        ),
+    )
+    if not streamed and on_translation is not None:
+        on_translation(translated_text)
+
+    return guide, dictionary, translated_text, explanation
+
+
+@traced("load dictionary")
+def load_dictionary(dictionary_path, index="auto", n_lists=None, n_probe=8):
+    """
+    Load a dictionary from a CSV file or a SQLite database (.db, .sqlite or
+    .sqlite3).
+
+    index selects how related words are searched for: "exact", "ivf"
+    (approximate) or "auto" (approximate for very large dictionaries). n_lists
+    and n_probe tune the approximate index.
+    """
+
+    # Load the dictionary and the embeddings saved with it, if any
+    backend = get_backend(dictionary_path)
+    dictionary = backend.load()
+    embeddings = backend.load_embeddings()
+
+    # Search very large dictionaries approximately, with the index saved
+    # with the dictionary if there is one
+    search_index = None
+    if index == "ivf" or (index == "auto" and len(dictionary) >= ann.MIN_ENTRIES):
+        options = {"n_lists": n_lists, "n_probe": n_probe}
+        search_index = ann.IVFIndex.load(
+            _get_search_index_path(dictionary_path), embeddings, **options
+        )
+        if search_index is None:
+            search_index = ann.IVFIndex(**options)
+
+    dictionary = Dictionary(
+        dictionary, embeddings=embeddings, search_index=search_index
+    )
+    dictionary.saved_path = os.path.abspath(dictionary_path)
+    dictionary.unsaved = set()
     return dictionary
 
 
-def save_dictionary(dictionary, dictionary_path):
-    # Save the dictionary in alphabetical order
-    with open(dictionary_path, "w") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Word", "Translation"])
-        for word in sorted(dictionary.keys()):
-            writer.writerow([word, dictionary[word]])
+def _get_search_index_path(dictionary_path):
+    return f"{dictionary_path}.ivf"
+
+
+@traced("save dictionary")
+def save_dictionary(dictionary, dictionary_path, embeddings_model=None):
+    """Save a dictionary to a CSV file or a SQLite database, with its embeddings."""
+
+    backend = get_backend(dictionary_path)
+    if not isinstance(dictionary, Dictionary):
+        dictionary = Dictionary(dictionary, embeddings=backend.load_embeddings())
+    if embeddings_model is not None:
+        # Embed any entries that were never embedded during this run
+        words = list(dictionary.keys())
+        translations = list(dictionary.values())
+        dictionary.embeddings.get(words + translations, embeddings_model)
+        dictionary.embeddings.get(translations, embeddings_model, query=True)
+
+    backend.save(dictionary)
+    dictionary.saved_path = os.path.abspath(dictionary_path)
+    dictionary.unsaved = set()
+
+    # Save the approximate index, so that it is not trained again next time
+    search_index = dictionary.search_index
+    if search_index is not None and search_index.centroids is not None:
+        search_index_path = _get_search_index_path(dictionary_path)
+        if search_index.changed or not os.path.exists(search_index_path):
+            search_index.save(search_index_path, dictionary.embeddings)
@@ -1,58 +1,392 @@
+import asyncio
 import os
 import time
 
 import click
 import dotenv
-import openai
 
+from .ratelimit import backoff, estimate_tokens, get_retry_after
+from .trace import span
 
 dotenv.load_dotenv()
 
-if "OPENAI_API_KEY" not in os.environ:
-    raise Exception(
-        "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable to your API key."
-    )
-openai.api_key = os.environ["OPENAI_API_KEY"]
 
+def _get_openai(request):
+    """
+    Import the OpenAI package and return it with the API key for a request.
 
-def complete_chat(**kwargs):
-    """Complete a chat with the OpenAI API."""
+    The package is slow to import, so this is done the first time a request
+    is actually sent rather than when the CLI starts.
+    """
 
-    delay = 1
-    while True:
-        try:
-            completion = openai.ChatCompletion.create(**kwargs)
-            break
-        except openai.error.APIError as e:
-            click.echo(
-                click.style(
-                    f"OpenAI API error: {e}. Retrying in {delay} second(s)...", fg="red"
-                )
-            )
-            time.sleep(delay)
-        except openai.error.RateLimitError:
-            click.echo(
-                click.style(
-                    f"OpenAI API rate limit exceeded. Retrying in {delay} second(s)...",
-                    fg="red",
-                )
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key is None:
+        if "api_base" not in request:
+            raise Exception(
+                "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable to your API key."
             )
-            time.sleep(delay)
-            delay *= 2
-        except openai.error.ServiceUnavailableError:
-            click.echo(
-                click.style(
-                    f"OpenAI API service unavailable. Retrying in {delay} second(s)...",
-                    fg="red",
-                )
+        # Local servers usually ignore the key, but one has to be sent
+        api_key = "none"
+
+    import openai
+
+    return openai, api_key
+
+
+# Stages of the commands that send requests. Each stage can be routed to its
+# own model and server.
+STAGES = {
+    "guide": "generating, rewriting and modifying the language guide",
+    "critique": "finding problems in the language guide",
+    "translate": "translating text",
+    "sample": "generating English text to translate while improving",
+    "words": "creating the words needed for a text",
+    "regenerate": "replacing new words that already exist",
+    "improve-words": "checking batches of words against the guide",
+}
+
+# Model and base URL to use for each stage, set with set_routes
+routes = {}
+
+
+def set_routes(new_routes):
+    """Replace the (model, base URL) routes of the stages."""
+
+    global routes
+    routes = new_routes
+
+
+def parse_route(route):
+    """
+    Parse a route of the form STAGE=MODEL, STAGE=MODEL@BASE_URL or
+    STAGE=@BASE_URL.
+
+    Returns the stage and a (model, base URL) tuple, where either may be None.
+    """
+
+    stage, separator, target = route.partition("=")
+    if not separator or stage not in STAGES:
+        raise ValueError(
+            f"Invalid route: {route}. Expected STAGE=MODEL[@BASE_URL], where STAGE is one of {', '.join(STAGES)}."
+        )
+
+    model, _, base_url = target.partition("@")
+    if not model and not base_url:
+        raise ValueError(f"Invalid route: {route}. Expected a model or a base URL.")
+
+    return stage, (model or None, base_url or None)
+
+
+def get_model(stage, model):
+    """Return the model that requests of a stage are sent to instead of model."""
+
+    routed_model, _ = routes.get(stage, (None, None))
+    return model if routed_model is None else routed_model
+
+
+def _route(request):
+    """Return a request with the model and base URL of its stage applied."""
+
+    request = dict(request)
+    model, base_url = routes.get(request.pop("stage", None), (None, None))
+    if model is not None:
+        request["model"] = model
+    if base_url is not None:
+        request["api_base"] = base_url
+
+    return request
+
+
+# Completions of repeatable requests are cached here, if set with
+# set_response_cache. The CLI sets it; other callers are not cached unless
+# they set it too.
+response_cache = None
+
+
+def set_response_cache(cache):
+    """Replace the cache used for chat completions (None disables caching)."""
+
+    global response_cache
+    response_cache = cache
+
+
+def _get_retryable_errors(openai):
+    """Return the errors after which a request is retried."""
+
+    return (
+        openai.error.APIError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+    )
+
+
+# Limits the rate of requests, if set with set_rate_limiter
+rate_limiter = None
+
+
+def set_rate_limiter(limiter):
+    """Replace the rate limiter used for chat completions (None disables it)."""
+
+    global rate_limiter
+    rate_limiter = limiter
+
+
+def _get_retry_delay(error, attempt):
+    """
+    Report that a request failed and return how long to wait before retrying.
+
+    A Retry-After header is honored if the response has one. Otherwise, rate
+    limit errors back off exponentially and other errors are retried after
+    about a second. Delays are jittered.
+    """
+
+    import openai
+
+    delay = get_retry_after(error)
+    if delay is not None and rate_limiter is not None:
+        # Hold back the other workers too
+        rate_limiter.block(delay)
+
+    if isinstance(error, openai.error.RateLimitError):
+        if delay is None:
+            delay = backoff(attempt)
+        message = (
+            f"OpenAI API rate limit exceeded. Retrying in {delay:.1f} second(s)..."
+        )
+    else:
+        if delay is None:
+            delay = backoff(0)
+        if isinstance(error, openai.error.ServiceUnavailableError):
+            message = (
+                f"OpenAI API service unavailable. Retrying in {delay:.1f} second(s)..."
             )
-            time.sleep(delay)
-        except openai.error.Timeout:
-            click.echo(
-                click.style(
-                    f"OpenAI API timeout. Retrying in {delay} second(s)...", fg="red"
+        elif isinstance(error, openai.error.Timeout):
+            message = f"OpenAI API timeout. Retrying in {delay:.1f} second(s)..."
+        else:
+            message = f"OpenAI API error: {error}. Retrying in {delay:.1f} second(s)..."
+
+    click.echo(click.style(message, fg="red"))
+    return delay
+
+
+def _record_usage(limiter, completion, estimated_tokens):
+    """Correct the rate limiter's token count with the tokens actually used."""
+
+    usage = completion.get("usage") or {}
+    if "total_tokens" in usage:
+        limiter.consume(usage["total_tokens"] - estimated_tokens)
+
+
+def _describe_completion(details, completion, attempt):
+    """Attach the retries and token usage of a completion to a span."""
+
+    details["retries"] = attempt
+    usage = completion.get("usage") or {}
+    for name in ["prompt_tokens", "completion_tokens"]:
+        if name in usage:
+            details[name] = usage[name]
+
+
+class _ChatRequest:
+    """
+    A chat request on its way to the OpenAI API.
+
+    Holds the steps shared by complete_chat, acomplete_chat and stream_chat:
+    routing, the response cache, the rate limiter and the retry rules.
+    """
+
+    def __init__(self, kwargs):
+        self.kwargs = _route(kwargs)
+        self.cache = response_cache
+        # The rate limits only apply to OpenAI, not to other servers
+        self.limiter = rate_limiter if "api_base" not in self.kwargs else None
+        self.estimated_tokens = estimate_tokens(self.kwargs)
+        self.attempt = 0
+
+    def cached(self, details):
+        """Return the cached completion of the request, if there is one."""
+
+        if self.cache is None:
+            return None
+
+        completion = self.cache.get(self.kwargs)
+        if completion is not None:
+            details["cached"] = True
+        return completion
+
+    def _retry_delay(self, error):
+        delay = _get_retry_delay(error, self.attempt)
+        self.attempt += 1
+        return delay
+
+    def send(self, **options):
+        """Send the request, retrying it after errors that can be retried."""
+
+        openai, api_key = _get_openai(self.kwargs)
+        retryable_errors = _get_retryable_errors(openai)
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire(self.estimated_tokens)
+            try:
+                return openai.ChatCompletion.create(
+                    api_key=api_key, **self.kwargs, **options
                 )
-            )
-            time.sleep(delay)
+            except retryable_errors as e:
+                time.sleep(self._retry_delay(e))
+
+    async def asend(self, semaphore=None):
+        """
+        Send the request asynchronously, retrying it after errors that can be
+        retried. The semaphore, if given, is only held while it is in flight.
+        """
+
+        openai, api_key = _get_openai(self.kwargs)
+        retryable_errors = _get_retryable_errors(openai)
+        while True:
+            if self.limiter is not None:
+                await self.limiter.aacquire(self.estimated_tokens)
+            try:
+                if semaphore is None:
+                    return await openai.ChatCompletion.acreate(
+                        api_key=api_key, **self.kwargs
+                    )
+                async with semaphore:
+                    return await openai.ChatCompletion.acreate(
+                        api_key=api_key, **self.kwargs
+                    )
+            except retryable_errors as e:
+                # Blocking the other workers locks the rate limiter's state,
+                # so do it in a thread
+                await asyncio.sleep(await asyncio.to_thread(self._retry_delay, e))
+
+    def finish(self, completion, details):
+        """Record the retries and token usage of a completion, and cache it."""
+
+        _describe_completion(details, completion, self.attempt)
+        if self.limiter is not None:
+            _record_usage(self.limiter, completion, self.estimated_tokens)
+        if self.cache is not None:
+            self.cache.put(self.kwargs, completion)
+
+
+def complete_chat(**kwargs):
+    """
+    Complete a chat with the OpenAI API.
+
+    The request may name the stage it belongs to, which sends it to the model
+    and server routed to that stage. If stream is set, the content of the
+    completion is streamed with stream_chat instead.
+    """
+
+    if kwargs.get("stream"):
+        return stream_chat(**kwargs)
+
+    request = _ChatRequest(kwargs)
+    with span("complete chat", model=request.kwargs.get("model")) as details:
+        completion = request.cached(details)
+        if completion is None:
+            completion = request.send()
+            request.finish(completion, details)
+
+        return completion
+
+
+async def acomplete_chat(semaphore=None, **kwargs):
+    """
+    Complete a chat with the OpenAI API asynchronously.
+
+    If a semaphore is given, it is held while a request is in flight, which
+    limits the number of concurrent requests. It is released while waiting
+    to retry.
+    """
+
+    request = _ChatRequest(kwargs)
+    with span("complete chat", model=request.kwargs.get("model")) as details:
+        completion = request.cached(details)
+        if completion is None:
+            completion = await request.asend(semaphore)
+            # Recording the usage locks the rate limiter's state, so do it in
+            # a thread
+            await asyncio.to_thread(request.finish, completion, details)
+
+        return completion
+
+
+def stream_chat(**kwargs):
+    """
+    Complete a chat with the OpenAI API, yielding its content as it arrives.
+
+    Closing the generator stops the request. Responses that are streamed to
+    the end are cached like those of complete_chat, and cached responses are
+    yielded in one piece.
+    """
+
+    kwargs = dict(kwargs)
+    kwargs.pop("stream", None)
+    request = _ChatRequest(kwargs)
+    with span("stream chat", model=request.kwargs.get("model")) as details:
+        completion = request.cached(details)
+        if completion is not None:
+            yield completion["choices"][0]["message"]["content"]
+            return
+
+        start = time.perf_counter()
+        chunks = request.send(stream=True)
+        details["retries"] = request.attempt
+
+        content = []
+        try:
+            for chunk in chunks:
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                if not content:
+                    details["first_content_s"] = time.perf_counter() - start
+                content.append(delta)
+                yield delta
+        except GeneratorExit:
+            details["stopped_early"] = True
+            raise
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+        request.finish(
+            {
+                "choices": [
+                    {
+                        "message": {
+                            "role": "assistant",
+                            "content": "".join(content),
+                        }
+                    }
+                ]
+            },
+            details,
+        )
+
+
+def complete_chats(requests, max_concurrency=4, on_completion=None):
+    """
+    Complete several chats concurrently with the OpenAI API.
+
+    Each request is a dict of keyword arguments for complete_chat. At most
+    max_concurrency requests are in flight at once. Returns the completions
+    in the same order as the requests. on_completion is called with the
+    index of each request and its completion as soon as it finishes.
+    """
+
+    async def complete(semaphore, i, request):
+        completion = await acomplete_chat(semaphore, **request)
+        if on_completion is not None:
+            on_completion(i, completion)
+        return completion
+
+    async def complete_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(
+            *[complete(semaphore, i, request) for i, request in enumerate(requests)]
+        )
 
-    return completion
+    return asyncio.run(complete_all())
@@ -0,0 +1,235 @@
+import base64
+
+import numpy as np
+
+# Ways to store each number of an embedding, from most to least precise
+PRECISIONS = ("float32", "float16", "int8")
+
+# Max number of rows to fit a projection on
+PCA_SAMPLE_SIZE = 50_000
+
+
+def normalize(vectors):
+    """Scale each row of a matrix to unit length."""
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Leave zero vectors alone instead of dividing by zero
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class Codec:
+    """
+    How normalized embeddings are stored.
+
+    Each embedding is optionally projected onto the principal components of
+    the embeddings it was fitted on, which keeps most of the information in
+    fewer dimensions, and then stored with the given precision: float32,
+    float16 (half the size) or int8 (a quarter of the size, each row scaled
+    so that its largest number is 127).
+
+    Only cosine similarities are needed, so rows are normalized again when
+    they are decoded and int8 rows do not need to keep their scale.
+    """
+
+    def __init__(self, precision="float32", components=None):
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision {precision}. Expected one of: {', '.join(PRECISIONS)}."
+            )
+
+        self.precision = precision
+        # Rows of the projection, or None to keep every dimension
+        self.components = (
+            None if components is None else np.asarray(components, dtype=np.float32)
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Codec) or self.precision != other.precision:
+            return False
+        if self.components is None or other.components is None:
+            return self.components is None and other.components is None
+        return np.array_equal(self.components, other.components)
+
+    def __repr__(self):
+        dimensions = "" if self.components is None else f", {len(self.components)}"
+        return f"Codec({self.precision}{dimensions})"
+
+    @property
+    def dtype(self):
+        return np.dtype(self.precision)
+
+    def dimensions(self, input_dimensions):
+        """Return the number of stored dimensions for embeddings of a size."""
+
+        if self.components is None:
+            return input_dimensions
+        return len(self.components)
+
+    @classmethod
+    def fit(cls, vectors, precision="float32", dimensions=None, seed=0):
+        """
+        Fit a codec to a sample of embeddings.
+
+        If dimensions is given, embeddings are projected onto that many
+        principal components. The projection is not centered, so that dot
+        products, and with them similarities, are kept as well as possible.
+        """
+
+        if dimensions is None:
+            return cls(precision)
+
+        vectors = normalize(vectors)
+        if len(vectors) > PCA_SAMPLE_SIZE:
+            rng = np.random.default_rng(seed)
+            vectors = vectors[rng.choice(len(vectors), PCA_SAMPLE_SIZE, replace=False)]
+        _, _, components = np.linalg.svd(vectors, full_matrices=False)
+        return cls(precision, components[:dimensions])
+
+    def project(self, vectors):
+        """Project and normalize embeddings, without quantizing them."""
+
+        vectors = normalize(vectors)
+        if self.components is not None:
+            vectors = normalize(vectors @ self.components.T)
+        return vectors
+
+    def quantize(self, vectors):
+        """Store projected, normalized embeddings with the codec's precision."""
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if self.precision == "float16":
+            return vectors.astype(np.float16)
+        if self.precision == "int8":
+            scales = np.abs(vectors).max(axis=1, keepdims=True)
+            scales[scales == 0] = 1
+            return np.round(vectors * (127 / scales)).astype(np.int8)
+        return vectors
+
+    def encode(self, vectors):
+        """Project and quantize embeddings."""
+
+        return self.quantize(self.project(vectors))
+
+    def decode(self, rows):
+        """Return stored rows as normalized float32 embeddings."""
+
+        if self.precision == "float32":
+            return np.asarray(rows, dtype=np.float32)
+        return normalize(rows)
+
+    def to_json(self):
+        codec = {"precision": self.precision}
+        if self.components is not None:
+            codec["components"] = {
+                "shape": list(self.components.shape),
+                "data": base64.b64encode(self.components.tobytes()).decode("ascii"),
+            }
+        return codec
+
+    @classmethod
+    def from_json(cls, codec):
+        if not codec:
+            return cls()
+
+        components = codec.get("components")
+        if components is not None:
+            components = np.frombuffer(
+                base64.b64decode(components["data"]), dtype=np.float32
+            ).reshape(components["shape"])
+        return cls(codec["precision"], components)
+
+
+class Encoded:
+    """
+    Rows stored by a codec that are decoded one slice at a time.
+
+    Functions that compare embeddings in blocks can take this instead of a
+    matrix, so that only one block of float32 rows exists at once.
+    """
+
+    def __init__(self, rows, codec):
+        self.rows = rows
+        self.codec = codec
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.codec.decode(self.rows[index])
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+
+def measure_drift(vectors, codecs, thresholds, n_queries=1000, seed=0):
+    """
+    Compare the similarities of compressed embeddings to full precision ones.
+
+    A sample of n_queries rows is compared to every row. For each codec,
+    returns a dict with the mean and max absolute error of the similarities
+    and, for each threshold, the recall and precision of the pairs above it
+    (how many of the pairs above the threshold at full precision are still
+    above it, and how many of the pairs above it after compression were
+    above it before).
+    """
+
+    vectors = normalize(vectors)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+
+    results = []
+    for codec in codecs:
+        encoded = Encoded(codec.encode(vectors), codec)
+        decoded = encoded[:]
+        total_error = 0.0
+        max_error = 0.0
+        counts = {threshold: [0, 0, 0] for threshold in thresholds}
+        for start in range(0, len(queries), 64):
+            block = queries[start : start + 64]
+            exact = vectors[block] @ vectors.T
+            approximate = decoded[block] @ decoded.T
+
+            # A row compared to itself is not a pair
+            error = np.abs(exact - approximate)
+            error[np.arange(len(block)), block] = 0
+            exact[np.arange(len(block)), block] = -np.inf
+            approximate[np.arange(len(block)), block] = -np.inf
+
+            total_error += float(error.sum())
+            max_error = max(max_error, float(error.max(initial=0)))
+            for threshold in thresholds:
+                above = exact >= threshold
+                approximately_above = approximate >= threshold
+                counts[threshold][0] += int(above.sum())
+                counts[threshold][1] += int(approximately_above.sum())
+                counts[threshold][2] += int((above & approximately_above).sum())
+
+        n_pairs = len(queries) * (len(vectors) - 1)
+        results.append(
+            {
+                "codec": codec,
+                "bytes": encoded.nbytes,
+                "mean_error": total_error / max(n_pairs, 1),
+                "max_error": max_error,
+                "thresholds": {
+                    threshold: {
+                        "pairs": above,
+                        "recall": both / above if above else 1.0,
+                        "precision": (
+                            both / approximately_above if approximately_above else 1.0
+                        ),
+                    }
+                    for threshold, (above, approximately_above, both) in counts.items()
+                },
+            }
+        )
+
+    return results
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # File locks are only used to share limits between processes
+    fcntl = None
+
+
+# Max number of seconds to wait between retries
+MAX_BACKOFF = 60
+
+# Tokens to expect in a completion when the request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+def estimate_tokens(request):
+    """Roughly estimate the number of tokens a chat request will use."""
+
+    prompt_tokens = 0
+    for message in request.get("messages", []):
+        # About four characters per token, plus some overhead per message
+        prompt_tokens += len(message.get("content") or "") // 4 + 4
+
+    completion_tokens = request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt_tokens + completion_tokens * request.get("n", 1)
+
+
+def backoff(attempt, base=1):
+    """
+    Return how long to wait before retry number attempt (starting at 0).
+
+    The delay doubles with each attempt up to MAX_BACKOFF, and is jittered so
+    that workers that failed together do not retry together.
+    """
+
+    delay = min(MAX_BACKOFF, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_retry_after(error):
+    """Return the number of seconds an error asked us to wait, if any."""
+
+    headers = getattr(error, "headers", None) or {}
+    for name, value in headers.items():
+        if name.lower() == "retry-after":
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return None
+    return None
+
+
+class RateLimiter:
+    """
+    Client-side limit on requests and tokens per minute.
+
+    Requests and tokens are drawn from two token buckets that refill
+    continuously. If a state path is given, the buckets are kept in that file
+    and locked while they are updated, so every process on the host that uses
+    the same path shares the limits.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, path=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _initial_state(self):
+        return {
+            "requests": self.requests_per_minute or 0,
+            "tokens": self.tokens_per_minute or 0,
+            "updated": time.time(),
+            "blocked_until": 0,
+        }
+
+    def _update(self, function):
+        """Apply a function to the shared state and return its result."""
+
+        with self._lock:
+            if self.path is None:
+                if self._state is None:
+                    self._state = self._initial_state()
+                return function(self._state)
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a+") as file:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    file.seek(0)
+                    try:
+                        state = json.loads(file.read())
+                    except json.JSONDecodeError:
+                        state = self._initial_state()
+
+                    result = function(state)
+
+                    file.seek(0)
+                    file.truncate()
+                    file.write(json.dumps(state))
+                    file.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(file, fcntl.LOCK_UN)
+
+            return result
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state["updated"])
+        state["updated"] = now
+        if self.requests_per_minute:
+            state["requests"] = min(
+                self.requests_per_minute,
+                state["requests"] + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            state["tokens"] = min(
+                self.tokens_per_minute,
+                state["tokens"] + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def try_acquire(self, tokens):
+        """
+        Take one request and some tokens from the buckets if they are there.
+
+        Returns 0 if they were taken, otherwise the number of seconds to wait
+        before trying again.
+        """
+
+        # A request can never need more tokens than the bucket holds
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        def acquire(state):
+            now = time.time()
+            self._refill(state, now)
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+
+            wait = 0.0
+            if self.requests_per_minute and state["requests"] < 1:
+                wait = (1 - state["requests"]) * 60 / self.requests_per_minute
+            if self.tokens_per_minute and state["tokens"] < tokens:
+                wait = max(
+                    wait, (tokens - state["tokens"]) * 60 / self.tokens_per_minute
+                )
+            if wait > 0:
+                return wait
+
+            state["requests"] -= 1
+            state["tokens"] -= tokens
+            return 0.0
+
+        return self._update(acquire)
+
+    def acquire(self, tokens):
+        """Wait until a request with the given number of tokens may be sent."""
+
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens):
+        """Wait asynchronously until a request may be sent."""
+
+        while True:
+            # The shared state is locked and read in a thread, so that waiting
+            # for another process's lock does not block the event loop
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def consume(self, tokens):
+        """Take extra tokens (or return them, if negative) after a request."""
+
+        def consume(state):
+            self._refill(state, time.time())
+            state["tokens"] -= tokens
+
+        self._update(consume)
+
+    def block(self, seconds):
+        """Hold back every request for some number of seconds."""
+
+        def block(state):
+            state["blocked_until"] = max(state["blocked_until"], time.time() + seconds)
+
+        self._update(block)
@@ -0,0 +1,389 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import inspect
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import click
+
+from .embeddings import get_embeddings_model
+from .language import (
+    LanguageError,
+    create_dictionary_for_text,
+    improve_language_and_dictionary,
+    load_dictionary,
+    merge_dictionaries,
+    modify_language_and_dictionary,
+    save_dictionary,
+    translate_and_improve,
+)
+
+
+class ServerError(Exception):
+    """Exception raised when a request to the server fails."""
+
+    pass
+
+
+class ForbiddenError(Exception):
+    """Exception raised when a request uses a file outside the served root."""
+
+    pass
+
+
+class Language:
+    """A guide and dictionary kept in memory by the server."""
+
+    def __init__(self, guide_path, dictionary_path, index="auto", index_probes=8):
+        self.guide_path = guide_path
+        self.dictionary_path = dictionary_path
+        # Held while the language is used, since operations update it
+        self.lock = threading.Lock()
+        self.dirty = False
+
+        with open(guide_path, "r") as file:
+            self.guide = file.read()
+
+        if dictionary_path is not None:
+            self.dictionary = load_dictionary(
+                dictionary_path, index=index, n_probe=index_probes
+            )
+        else:
+            self.dictionary = {}
+
+    def save(self, embeddings_model):
+        """Write the guide and dictionary to disk if they changed."""
+
+        if not self.dirty:
+            return
+
+        with open(self.guide_path, "w") as file:
+            file.write(self.guide)
+        if self.dictionary_path is not None:
+            save_dictionary(self.dictionary, self.dictionary_path, embeddings_model)
+        self.dirty = False
+
+
+class Workspace:
+    """
+    The state a server keeps between requests.
+
+    The embeddings model is loaded once, and each language is loaded the first
+    time it is used and then kept in memory. Changes are written to disk when
+    flush is called. Only guides and dictionaries under root (the current
+    directory by default) can be used.
+    """
+
+    def __init__(self, embeddings_model=None, root=None):
+        self._embeddings_model = embeddings_model
+        self._languages = {}
+        # Held while the languages are looked up. Each language is loaded under
+        # its own lock and the embeddings model under another, so that loading
+        # one does not block requests that use the others.
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._model_lock = threading.Lock()
+        self.root = os.path.realpath(os.getcwd() if root is None else root)
+
+    def _resolve(self, path):
+        # Follow symbolic links, so that they cannot point outside the root
+        if path is None:
+            return None
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, resolved]) != self.root:
+            raise ForbiddenError(f"{path} is outside of {self.root}.")
+        return resolved
+
+    @property
+    def embeddings_model(self):
+        with self._model_lock:
+            if self._embeddings_model is None:
+                self._embeddings_model = get_embeddings_model()
+            return self._embeddings_model
+
+    def language(self, guide_path, dictionary_path, index="auto", index_probes=8):
+        """Get a language, loading it if necessary."""
+
+        guide_path = self._resolve(guide_path)
+        dictionary_path = self._resolve(dictionary_path)
+        # The search index is part of the key, since it is built on load
+        key = (guide_path, dictionary_path, index, index_probes)
+        with self._lock:
+            if key in self._languages:
+                return self._languages[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # Load the language without blocking requests for other languages
+        with loading:
+            with self._lock:
+                if key in self._languages:
+                    return self._languages[key]
+            language = Language(guide_path, dictionary_path, index, index_probes)
+            with self._lock:
+                self._languages[key] = language
+                del self._loading[key]
+            return language
+
+    def flush(self):
+        """Write every language that changed to disk."""
+
+        with self._lock:
+            languages = list(self._languages.values())
+
+        for language in languages:
+            with language.lock:
+                if language.dirty:
+                    language.save(self.embeddings_model)
+
+    def translate(
+        self,
+        guide_path,
+        dictionary_path,
+        text,
+        max_improvements=5,
+        similarity_threshold=0.98,
+        model="chatgpt-4o-latest",
+        index="auto",
+        index_probes=8,
+        max_concurrency=4,
+        explain=True,
+    ):
+        language = self.language(guide_path, dictionary_path, index, index_probes)
+        with language.lock:
+            guide, dictionary, translated_text, explanation = translate_and_improve(
+                language.guide,
+                language.dictionary,
+                text,
+                max_improvements,
+                similarity_threshold,
+                model,
+                self.embeddings_model,
+                max_concurrency,
+                explain=explain,
+            )
+            language.guide = guide
+            language.dictionary = dictionary
+            language.dirty = True
+
+        return {"translation": translated_text.strip(), "explanation": explanation}
+
+    def create_words(
+        self,
+        guide_path,
+        dictionary_path,
+        text,
+        similarity_threshold=0.98,
+        model="chatgpt-4o-latest",
+        index="auto",
+        index_probes=8,
+    ):
+        language = self.language(guide_path, dictionary_path, index, index_probes)
+        with language.lock:
+            new_words = create_dictionary_for_text(
+                language.guide,
+                text,
+                language.dictionary,
+                similarity_threshold,
+                model,
+                self.embeddings_model,
+            )
+            language.dictionary = merge_dictionaries(
+                language.dictionary,
+                new_words,
+                similarity_threshold,
+                self.embeddings_model,
+            )
+            language.dirty = True
+
+        # Only report the words that survived the merge
+        return {
+            "words": {
+                word: translation
+                for word, translation in new_words.items()
+                if word in language.dictionary
+            }
+        }
+
+    def improve(
+        self,
+        guide_path,
+        dictionary_path,
+        max_iterations=5,
+        similarity_threshold=0.98,
+        model="chatgpt-4o-latest",
+        max_concurrency=4,
+    ):
+        language = self.language(guide_path, dictionary_path)
+        with language.lock:
+            language.guide, language.dictionary = improve_language_and_dictionary(
+                language.guide,
+                language.dictionary,
+                max_iterations,
+                similarity_threshold,
+                model,
+                self.embeddings_model,
+                max_concurrency,
+            )
+            language.dirty = True
+
+        return {"message": "Language improved successfully."}
+
+    def modify(
+        self,
+        guide_path,
+        dictionary_path,
+        changes,
+        similarity_threshold=0.98,
+        model="chatgpt-4o-latest",
+        max_concurrency=4,
+    ):
+        language = self.language(guide_path, dictionary_path)
+        with language.lock:
+            language.guide, language.dictionary = modify_language_and_dictionary(
+                language.guide,
+                language.dictionary,
+                changes,
+                similarity_threshold,
+                model,
+                self.embeddings_model,
+                max_concurrency,
+            )
+            language.dirty = True
+
+        return {"message": "Language modified successfully."}
+
+    def operations(self):
+        """Return the operations that can be run on the workspace, by name."""
+
+        return {
+            "translate": self.translate,
+            "create-words": self.create_words,
+            "improve": self.improve,
+            "modify": self.modify,
+            "flush": self.flush,
+        }
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def _respond(self, status, body):
+        encoded = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _authorized(self):
+        expected = f"Bearer {self.server.token}".encode("utf-8")
+        received = self.headers.get("Authorization", "").encode("utf-8")
+        return hmac.compare_digest(expected, received)
+
+    def do_POST(self):
+        if not self._authorized():
+            self._respond(401, {"error": "Invalid or missing server token."})
+            return
+
+        operation_name = self.path.strip("/")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError
+        except ValueError:
+            self._respond(400, {"error": "The request body must be a JSON object."})
+            return
+
+        operation = self.server.workspace.operations().get(operation_name)
+        if operation is None:
+            self._respond(404, {"error": f"Unknown operation: {operation_name}"})
+            return
+
+        try:
+            inspect.signature(operation).bind(**payload)
+        except TypeError as e:
+            self._respond(400, {"error": str(e)})
+            return
+
+        try:
+            result = operation(**payload) or {}
+        except ForbiddenError as e:
+            self._respond(403, {"error": str(e)})
+        except (LanguageError, OSError) as e:
+            self._respond(422, {"error": str(e)})
+        except Exception as e:
+            self._respond(500, {"error": f"{type(e).__name__}: {e}"})
+            raise
+        else:
+            self._respond(200, result)
+
+    def log_message(self, format, *args):
+        click.echo(click.style(format % args, dim=True), err=True)
+
+
+def create_server(host, port, token, workspace=None):
+    """
+    Create an HTTP server for a workspace. Requests must send the token as
+    "Authorization: Bearer <token>".
+    """
+
+    if not token:
+        raise ValueError("The server token must not be empty.")
+
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.workspace = Workspace() if workspace is None else workspace
+    server.token = token
+    return server
+
+
+def serve(host, port, flush_interval, token, workspace=None):
+    """Serve a workspace over HTTP until interrupted."""
+
+    server = create_server(host, port, token, workspace)
+
+    # Write changes to disk periodically
+    stopped = threading.Event()
+
+    def flush_periodically():
+        while not stopped.wait(flush_interval):
+            server.workspace.flush()
+
+    flusher = threading.Thread(target=flush_periodically, daemon=True)
+    flusher.start()
+
+    click.echo(f"Serving {server.workspace.root} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        server.workspace.flush()
+
+
+def send_request(server_url, operation, payload, token=None):
+    """Run an operation on a server and return its result."""
+
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(
+        f"{server_url.rstrip('/')}/{operation}",
+        data=json.dumps(payload).encode("utf-8"),
+        headers=headers,
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read())["error"]
+        except (ValueError, KeyError):
+            message = str(e)
+        raise ServerError(message) from e
+    except urllib.error.URLError as e:
+        raise ServerError(f"Could not reach server at {server_url}: {e.reason}") from e
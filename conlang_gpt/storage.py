@@ -0,0 +1,305 @@
+import csv
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from .index import VectorStore
+from .quantize import Codec
+
+# Extensions of dictionaries stored in SQLite databases
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+class CsvBackend:
+    """
+    Dictionary stored as a CSV file sorted by word.
+
+    The embeddings of the entries are stored next to it, in
+    ``<dictionary>.idx`` and ``<dictionary>.idx.json``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def index_path(self):
+        return f"{self.path}.idx"
+
+    def load(self):
+        """Return the entries of the dictionary."""
+
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path, "r") as file:
+            reader = csv.reader(file)
+
+            # Skip the header row
+            next(reader)
+
+            return {row[0]: row[1] for row in reader}
+
+    def load_embeddings(self):
+        """Return a store with the saved embeddings of the entries."""
+
+        return VectorStore.load(self.index_path)
+
+    def save(self, dictionary):
+        """Write a Dictionary and its embeddings."""
+
+        # Write a new file and then replace the old one, so that a crash does
+        # not leave half a dictionary
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Word", "Translation"])
+            for word in sorted(dictionary.keys()):
+                writer.writerow([word, dictionary[word]])
+        os.replace(temp_path, self.path)
+
+        self.save_embeddings(dictionary)
+
+    def save_embeddings(self, dictionary):
+        """Write the embeddings of a Dictionary whose entries are saved already."""
+
+        if len(dictionary.embeddings):
+            dictionary.embeddings.save(self.index_path, dictionary.embedding_keys())
+
+
+class SqliteBackend:
+    """
+    Dictionary stored in a SQLite database.
+
+    Entries are keyed by word. Saving only writes the entries that changed,
+    in one transaction: those a Dictionary loaded from the same database
+    tracked as changed, or otherwise those that differ from the saved ones.
+    The embeddings of each entry's word, translation and translation query
+    are stored in the same row, once they are known. Entries without them
+    are indexed, so that saving finds them without reading every row.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS words (word TEXT PRIMARY KEY, translation TEXT NOT NULL, word_embedding BLOB, translation_embedding BLOB, query_embedding BLOB)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS words_unembedded ON words (word) WHERE word_embedding IS NULL"
+        )
+        # Exact lookups are made in memory, so translations are not indexed
+        connection.execute("DROP INDEX IF EXISTS words_translation")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        return connection
+
+    def _get_metadata(self, connection):
+        return dict(connection.execute("SELECT key, value FROM metadata"))
+
+    @staticmethod
+    def _get_codec(metadata):
+        return Codec.from_json(json.loads(metadata.get("codec", "null")))
+
+    def load(self):
+        """Return the entries of the dictionary."""
+
+        if not os.path.exists(self.path):
+            return {}
+
+        connection = self._connect()
+        try:
+            return dict(
+                connection.execute("SELECT word, translation FROM words ORDER BY word")
+            )
+        finally:
+            connection.close()
+
+    def load_embeddings(self):
+        """Return a store with the saved embeddings of the entries."""
+
+        if not os.path.exists(self.path):
+            return VectorStore()
+
+        connection = self._connect()
+        try:
+            metadata = self._get_metadata(connection)
+            if "dimensions" not in metadata:
+                return VectorStore()
+            (n_rows,) = connection.execute(
+                "SELECT count(*) FROM words WHERE word_embedding IS NOT NULL"
+            ).fetchone()
+            if not n_rows:
+                return VectorStore()
+
+            # Copy the embeddings into one matrix as the rows are read, rather
+            # than holding every row in memory first
+            store = VectorStore()
+            codec = self._get_codec(metadata)
+            matrix = np.empty(
+                (3 * n_rows, int(metadata["dimensions"])), dtype=codec.dtype
+            )
+            keys = []
+            rows = connection.execute(
+                "SELECT word, translation, word_embedding, translation_embedding, query_embedding FROM words WHERE word_embedding IS NOT NULL LIMIT ?",
+                (n_rows,),
+            )
+            for i, (word, translation, *embeddings) in enumerate(rows):
+                keys += store.keys([word, translation]) + store.keys(
+                    [translation], query=True
+                )
+                for j, embedding in enumerate(embeddings):
+                    matrix[3 * i + j] = np.frombuffer(embedding, dtype=codec.dtype)
+        finally:
+            connection.close()
+
+        return VectorStore.from_matrix(
+            keys, matrix[: len(keys)], metadata.get("model"), codec
+        )
+
+    def _get_changes(self, connection, dictionary, tracked):
+        """
+        Return the saved words that are no longer in a Dictionary, and the
+        saved translation (or None) and whether it has embeddings, for each
+        word of the Dictionary that may need writing.
+
+        If tracked is set, only the words the Dictionary changed since it was
+        loaded or saved are compared, instead of every saved entry.
+        """
+
+        if tracked:
+            # Only the words the dictionary changed, and the entries saved
+            # without embeddings, can differ from the saved ones
+            saved = {
+                word: (translation, False)
+                for word, translation in connection.execute(
+                    "SELECT word, translation FROM words WHERE word_embedding IS NULL"
+                )
+            }
+            words = set(saved) | dictionary.unsaved
+            for word in dictionary.unsaved - set(saved):
+                row = connection.execute(
+                    "SELECT translation, word_embedding IS NOT NULL FROM words WHERE word = ?",
+                    (word,),
+                ).fetchone()
+                if row is not None:
+                    saved[word] = row
+        else:
+            words = None
+            saved = {
+                word: (translation, embedded)
+                for word, translation, embedded in connection.execute(
+                    "SELECT word, translation, word_embedding IS NOT NULL FROM words"
+                )
+            }
+
+        removed = [word for word in saved if word not in dictionary]
+        if words is None:
+            candidates = dictionary.keys()
+        else:
+            candidates = [word for word in words if word in dictionary]
+        return removed, {word: saved.get(word, (None, False)) for word in candidates}
+
+    def save(self, dictionary):
+        """Write the entries of a Dictionary that changed and their embeddings."""
+
+        # The changes the dictionary tracked are only enough to update the
+        # database it was loaded from or last saved to
+        tracked = (
+            dictionary.unsaved is not None
+            and dictionary.saved_path == os.path.abspath(self.path)
+            and os.path.exists(self.path)
+        )
+
+        store = dictionary.embeddings
+        connection = self._connect()
+        try:
+            with connection:
+                metadata = self._get_metadata(connection)
+                if store.dimensions and (
+                    metadata.get("model") != store.model_name
+                    or metadata.get("dimensions") != str(store.dimensions)
+                    or self._get_codec(metadata) != store.codec
+                ):
+                    # The saved embeddings came from another model, or were
+                    # compressed differently
+                    connection.execute(
+                        "UPDATE words SET word_embedding = NULL, translation_embedding = NULL, query_embedding = NULL"
+                    )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                        [
+                            ("model", store.model_name),
+                            ("dimensions", str(store.dimensions)),
+                            ("codec", json.dumps(store.codec.to_json())),
+                        ],
+                    )
+
+                removed, saved = self._get_changes(connection, dictionary, tracked)
+
+                # Remove the entries that are gone
+                connection.executemany(
+                    "DELETE FROM words WHERE word = ?", [(word,) for word in removed]
+                )
+
+                # Write the entries that are new or changed, or whose
+                # embeddings are known now
+                changed = []
+                embedded = []
+                for word, (saved_translation, saved_embedded) in saved.items():
+                    translation = dictionary[word]
+                    unchanged = saved_translation == translation
+                    if unchanged and saved_embedded:
+                        continue
+
+                    keys = store.keys([word, translation]) + store.keys(
+                        [translation], query=True
+                    )
+                    has_embeddings = all(key in store for key in keys)
+                    if unchanged and not has_embeddings:
+                        continue
+                    if has_embeddings:
+                        embedded.append((word, translation, keys))
+                    else:
+                        changed.append((word, translation, None, None, None))
+
+                if embedded:
+                    matrix = store.encoded(
+                        [key for _, _, keys in embedded for key in keys]
+                    ).reshape(len(embedded), 3, -1)
+                    for (word, translation, _), vectors in zip(embedded, matrix):
+                        changed.append(
+                            (
+                                word,
+                                translation,
+                                *(vector.tobytes() for vector in vectors),
+                            )
+                        )
+
+                connection.executemany(
+                    "INSERT INTO words VALUES (?, ?, ?, ?, ?) ON CONFLICT (word) DO UPDATE SET translation = excluded.translation, word_embedding = excluded.word_embedding, translation_embedding = excluded.translation_embedding, query_embedding = excluded.query_embedding",
+                    changed,
+                )
+        finally:
+            connection.close()
+
+    def save_embeddings(self, dictionary):
+        """
+        Write the embeddings of a Dictionary whose entries are saved already.
+
+        Only the entries whose embeddings are new are written.
+        """
+
+        self.save(dictionary)
+
+
+def get_backend(path):
+    """Return the backend for a dictionary, chosen by its file extension."""
+
+    if str(path).lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteBackend(path)
+    return CsvBackend(path)
@@ -0,0 +1,64 @@
+import re
+
+# Punctuation removed from the start and end of words. Marks that conlangs
+# use inside or after words, such as tone markers (^, `, ´, ~), are kept.
+PUNCTUATION = ".,;:!?\"'()[]{}<>«»“”‘’„…—–-*_/\\|"
+
+# Common English words that are too vague to search for by similarity
+STOPWORDS = frozenset("""
+    a an and are as at be been but by can could did do does doing for from had
+    has have having he her here hers him his how i if in into is it its just
+    me my no nor of on or our ours she should so some such than that the their
+    theirs them then there these they this those to too was we were what when
+    where which who whom why will with would you your yours
+    """.split())
+
+_DOUBLE_CONSONANT = re.compile(r"([bcdfgklmnprstvz])\1$")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words, without the punctuation around them.
+
+    Words are returned in order, including repeated ones.
+    """
+
+    tokens = []
+    for token in text.split():
+        token = token.strip(PUNCTUATION).lower()
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def lemmas(word):
+    """
+    Return candidate base forms of a lowercase English word, most likely first.
+
+    Only common suffixes are removed, without a list of words, so some
+    candidates are not words. They are meant to be looked up, not shown.
+    """
+
+    candidates = []
+    if word.endswith(("'s", "’s")):
+        word = word[:-2]
+        candidates.append(word)
+
+    if word.endswith("ies") and len(word) > 4:
+        candidates.append(word[:-3] + "y")
+    elif word.endswith(("sses", "shes", "ches", "xes", "zes")):
+        candidates.append(word[:-2])
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        candidates.append(word[:-1])
+
+    for suffix in ["ing", "ed"]:
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            stem = word[: -len(suffix)]
+            # running -> run, loved -> love, walked -> walk
+            if _DOUBLE_CONSONANT.search(stem):
+                candidates.append(stem[:-1])
+            candidates += [stem, stem + "e"]
+            if suffix == "ed" and stem.endswith("i"):
+                candidates.append(stem[:-1] + "y")
+
+    return list(dict.fromkeys(candidates))
@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Tracer:
+    """
+    Records how long each phase of a command takes.
+
+    Phases are recorded as spans, which can be saved as Chrome trace events
+    (open them in chrome://tracing or https://ui.perfetto.dev) or summarized
+    in a table. If memory is set, the peak memory allocated by Python during
+    each span is recorded too, which slows everything down.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        # Peak memory of the spans in progress, by ID
+        self._open_peaks = {}
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _sample_memory(self):
+        """Update the peak memory of the spans in progress."""
+
+        _, peak = tracemalloc.get_traced_memory()
+        for open_peak in self._open_peaks.values():
+            open_peak[0] = max(open_peak[0], peak)
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """
+        Record a span while the context is active.
+
+        The context yields the span's arguments, which can be updated to
+        attach more details to the span.
+        """
+
+        peak = [0]
+        if self.memory:
+            with self._lock:
+                self._sample_memory()
+                self._open_peaks[id(peak)] = peak
+
+        thread_id = _get_thread_id()
+        start = time.perf_counter()
+        try:
+            yield args
+        except GeneratorExit:
+            # A generator was closed before it finished, which is not an error
+            raise
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._start) * 1_000_000,
+                "dur": (end - start) * 1_000_000,
+                "pid": os.getpid(),
+                "tid": thread_id,
+                "args": args,
+            }
+            with self._lock:
+                if self.memory:
+                    self._sample_memory()
+                    del self._open_peaks[id(peak)]
+                    args["peak_memory_mb"] = round(peak[0] / 1_000_000, 3)
+                self.events.append(event)
+
+    def save(self, path):
+        """Save the spans as Chrome trace events."""
+
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as file:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms"}, file, default=str
+            )
+
+    def summary(self):
+        """Return a table of the number of calls and time spent in each span."""
+
+        with self._lock:
+            events = list(self.events)
+
+        totals = {}
+        for event in events:
+            total = totals.setdefault(
+                event["name"], {"calls": 0, "total": 0.0, "max": 0.0, "peak": None}
+            )
+            duration = event["dur"] / 1_000_000
+            total["calls"] += 1
+            total["total"] += duration
+            total["max"] = max(total["max"], duration)
+            if "peak_memory_mb" in event["args"]:
+                total["peak"] = max(total["peak"] or 0, event["args"]["peak_memory_mb"])
+
+        header = f"{'Span':<28} {'Calls':>6} {'Total (s)':>10} {'Mean (s)':>10} {'Max (s)':>10}"
+        if self.memory:
+            header += f" {'Peak (MB)':>10}"
+        lines = [header, "-" * len(header)]
+
+        # Slowest first
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["total"]):
+            line = f"{name[:28]:<28} {total['calls']:>6} {total['total']:>10.3f} {total['total'] / total['calls']:>10.3f} {total['max']:>10.3f}"
+            if self.memory:
+                peak = total["peak"]
+                line += f" {peak:>10.1f}" if peak is not None else f" {'':>10}"
+            lines.append(line)
+
+        return "\n".join(lines)
+
+
+def _get_thread_id():
+    # Concurrent requests run as tasks on one thread, so give each task its
+    # own row in the trace
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task)
+    return threading.get_ident()
+
+
+# Records spans, if set with set_tracer
+tracer = None
+
+
+def set_tracer(new_tracer):
+    """Replace the tracer used to record spans (None disables tracing)."""
+
+    global tracer
+    tracer = new_tracer
+
+
+def span(name, **args):
+    """Record a span with the current tracer, if there is one."""
+
+    if tracer is None:
+        return contextlib.nullcontext(args)
+    return tracer.span(name, **args)
+
+
+def traced(name):
+    """Decorate a function to record a span each time it is called."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
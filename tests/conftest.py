@@ -76,3 +76,41 @@ def dictionary_path(tmp_path, dictionary):
     for word, translation in dictionary.items():
         csv_writer.writerow([word, translation])
     return path
+
+
+class FakeEmbeddings:
+    """Deterministic, offline stand-in for the embeddings model."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self.calls = 0
+        self.embedded = 0
+
+    def _embed(self, text):
+        import numpy as np
+
+        # Hash the character trigrams of the text so that similar strings
+        # have similar vectors
+        vector = np.zeros(self.size)
+        padded = f"  {text.lower()} "
+        for i in range(len(padded) - 2):
+            trigram = padded[i : i + 3]
+            seed = sum(ord(c) * 31**j for j, c in enumerate(trigram))
+            vector += np.random.default_rng(seed).standard_normal(self.size)
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.embedded += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        self.embedded += 1
+        # Like BGE, queries are embedded with an instruction prefix
+        return self._embed(f"query: {text}")
+
+
+@pytest.fixture()
+def fake_embeddings_model():
+    return FakeEmbeddings()
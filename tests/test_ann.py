@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from conlang_gpt.ann import IVFIndex, measure_recall
+from conlang_gpt.index import DictionaryIndex
+from conlang_gpt.language import (
+    Dictionary,
+    _get_search_index,
+    load_dictionary,
+    save_dictionary,
+)
+
+
+def _random_dictionary(size):
+    rng = np.random.default_rng(0)
+    letters = list("aeioukmnst")
+    return {
+        "".join(rng.choice(letters, 6)): "".join(rng.choice(letters, 5))
+        for _ in range(size)
+    }
+
+
+def test_ivf_index_probing_every_list_matches_exact_search(fake_embeddings_model):
+    dictionary = _random_dictionary(300)
+    queries = fake_embeddings_model.embed_documents(list(dictionary.values())[:20])
+    exact = DictionaryIndex.from_dictionary(dictionary, fake_embeddings_model)
+
+    index = IVFIndex(n_lists=8, n_probe=8)
+    index.update(dictionary, fake_embeddings_model)
+
+    assert [
+        [word for word, _ in matches] for matches in index.search(queries, k=3)
+    ] == [[word for word, _ in matches] for matches in exact.search(queries, k=3)]
+
+
+def test_ivf_index_update_adds_and_removes_entries(fake_embeddings_model):
+    index = IVFIndex(n_lists=2)
+    index.update({"E": "Hello", "I": "world"}, fake_embeddings_model)
+
+    index.update({"E": "Hello", "O": "fruit"}, fake_embeddings_model)
+
+    assert index.entries == {"E": "Hello", "O": "fruit"}
+    queries = fake_embeddings_model.embed_documents(["world", "fruit"])
+    matches = index.search(queries, min_similarity=0.75)
+    assert matches[0] == []
+    assert matches[1][0][0] == "O"
+
+
+def test_measure_recall_is_perfect_when_probing_every_list(fake_embeddings_model):
+    dictionary = _random_dictionary(200)
+
+    results = measure_recall(
+        dictionary,
+        list(dictionary.values())[:10],
+        fake_embeddings_model,
+        [1, 4],
+        k=5,
+        n_lists=4,
+    )
+
+    assert [n_probe for n_probe, _, _ in results] == [1, 4]
+    assert results[1][1] == 1
+
+
+def test_measure_recall_rejects_empty_dictionaries(fake_embeddings_model):
+    with pytest.raises(ValueError):
+        measure_recall({}, [], fake_embeddings_model, [1])
+
+
+def test_ivf_index_is_saved_and_loaded_with_its_dictionary(
+    tmp_path, fake_embeddings_model
+):
+    path = str(tmp_path / "dictionary.csv")
+    dictionary = load_dictionary(path, index="ivf", n_lists=4)
+    dictionary.update(_random_dictionary(100))
+    queries = fake_embeddings_model.embed_documents(list(dictionary.values())[:5])
+    expected = _get_search_index(dictionary, fake_embeddings_model).search(queries)
+    save_dictionary(dictionary, path)
+
+    dictionary = load_dictionary(path, index="ivf", n_lists=4)
+    index = dictionary.search_index
+    assert len(index) == 100 and not index.changed
+    assert (
+        _get_search_index(dictionary, fake_embeddings_model).search(queries) == expected
+    )
+    assert not index.changed
+
+
+def test_ivf_index_is_trained_again_when_most_entries_are_removed(
+    fake_embeddings_model,
+):
+    dictionary = _random_dictionary(200)
+    index = IVFIndex()
+    index.update(dictionary, fake_embeddings_model)
+    assert len(index.centroids) == int(4 * np.sqrt(200))
+
+    remaining = dict(list(dictionary.items())[:20])
+    index.update(remaining, fake_embeddings_model)
+
+    assert len(index.centroids) == int(4 * np.sqrt(20))
+    assert len(index._alive) == 20
+    assert index.entries == remaining
+
+
+def test_ivf_index_only_compares_the_words_that_changed(fake_embeddings_model):
+    dictionary = Dictionary(_random_dictionary(50), search_index=IVFIndex(n_lists=2))
+    index = _get_search_index(dictionary, fake_embeddings_model)
+    assert not dictionary.unindexed
+
+    word, other_word = list(dictionary)[:2]
+    dictionary[word] = "fruit"
+    del dictionary[other_word]
+    # A change that is not tracked is not seen by the index
+    dict.__setitem__(dictionary, "untracked", "world")
+
+    assert _get_search_index(dictionary, fake_embeddings_model) is index
+    assert not dictionary.unindexed
+    assert index.entries[word] == "fruit"
+    assert other_word not in index.entries
+    assert "untracked" not in index.entries
+
+
+def test_ivf_index_is_compared_in_full_with_another_dictionary(
+    fake_embeddings_model,
+):
+    dictionary = Dictionary(_random_dictionary(50), search_index=IVFIndex(n_lists=2))
+    index = _get_search_index(dictionary, fake_embeddings_model)
+    copy = dictionary.copy()
+    word = next(iter(dictionary))
+    copy[word] = "fruit"
+    _get_search_index(copy, fake_embeddings_model)
+
+    # The original dictionary did not change, but the shared index did
+    _get_search_index(dictionary, fake_embeddings_model)
+
+    assert index.entries == dictionary
@@ -0,0 +1,45 @@
+import json
+
+from click.testing import CliRunner
+
+from benchmarks.__main__ import main
+from benchmarks.harness import find_regressions
+
+
+def test_benchmarks_run_and_compare_against_baseline(tmp_path):
+    output = tmp_path / "results.json"
+
+    result = CliRunner().invoke(
+        main, ["--sizes", "20", "--repeat", "1", "--output", str(output)]
+    )
+
+    assert result.exit_code == 0, result.output
+    results = json.loads(output.read_text())
+    assert set(results) == {
+        "related_words[20]",
+        "related_words_document[20]",
+        "reduce_dictionary[20]",
+        "merge_dictionaries[20]",
+        "parse_dictionary[20]",
+        "save_dictionary[20]",
+        "load_dictionary[20]",
+        "save_dictionary_sqlite[20]",
+        "update_dictionary_sqlite[20]",
+        "load_dictionary_sqlite[20]",
+    }
+
+
+def test_find_regressions_reports_slower_or_bigger_benchmarks():
+    baseline = {
+        "a": {"min": 1.0, "peak_memory_mb": 10.0},
+        "b": {"min": 1.0, "peak_memory_mb": 10.0},
+    }
+    results = {
+        "a": {"min": 1.1, "peak_memory_mb": 10.0},
+        "b": {"min": 1.0, "peak_memory_mb": 20.0},
+        "c": {"min": 5.0, "peak_memory_mb": 50.0},
+    }
+
+    assert find_regressions(results, baseline, 0.2) == [
+        "b: peak_memory_mb went from 10 to 20"
+    ]
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from conlang_gpt.cache import EmbeddingCache, ResponseCache
+
+
+@pytest.fixture()
+def cache_path(tmp_path):
+    return str(tmp_path / "completions.db")
+
+
+def _request(content, temperature=0):
+    return {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": content}],
+        "temperature": temperature,
+    }
+
+
+def test_response_cache_returns_completions_from_disk(cache_path):
+    ResponseCache(cache_path).put(_request("Hello"), {"id": "hello"})
+
+    cache = ResponseCache(cache_path)
+
+    assert cache.get(_request("Hello")) == {"id": "hello"}
+    assert cache.get(_request("Goodbye")) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_response_cache_skips_random_requests_unless_allowed(cache_path):
+    cache = ResponseCache(cache_path)
+    cache.put(_request("Hello", temperature=1), {"id": "hello"})
+
+    assert cache.get(_request("Hello", temperature=1)) is None
+
+    cache = ResponseCache(cache_path, cache_random=True)
+    cache.put(_request("Hello", temperature=1), {"id": "hello"})
+
+    assert cache.get(_request("Hello", temperature=1)) == {"id": "hello"}
+
+
+def test_response_cache_evicts_least_recently_used(cache_path):
+    cache = ResponseCache(cache_path, max_size=40)
+    cache.put(_request("a"), {"id": "a" * 10})
+    cache.put(_request("b"), {"id": "b" * 10})
+    # Use the first completion so that the second one is evicted
+    ResponseCache(cache_path).get(_request("a"))
+    cache.put(_request("c"), {"id": "c" * 10})
+
+    fresh = ResponseCache(cache_path, max_size=40)
+    assert fresh.get(_request("a")) is not None
+    assert fresh.get(_request("b")) is None
+    assert fresh.get(_request("c")) is not None
+
+
+def test_embedding_cache_gets_and_puts_batches(cache_path):
+    keys = [EmbeddingCache.key("model", text) for text in ["a", "b", "c"]]
+    EmbeddingCache(cache_path).put_many({keys[0]: b"1234", keys[1]: b"5678"})
+
+    cache = EmbeddingCache(cache_path)
+
+    assert cache.get_many(keys) == {keys[0]: b"1234", keys[1]: b"5678"}
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert EmbeddingCache.key("model", "a", query=True) != keys[0]
+
+
+def test_embedding_cache_keeps_recent_entries_in_memory(cache_path):
+    cache = EmbeddingCache(cache_path, max_entries=2)
+    cache.put_many({"a": b"1", "b": b"2"})
+    cache.get_many(["a"])
+    cache.put_many({"c": b"3"})
+
+    assert list(cache._memo) == ["a", "c"]
+    assert cache.get_many(["b"]) == {"b": b"2"}
+
+
+def test_embedding_cache_evicts_least_recently_used(cache_path, monkeypatch):
+    monkeypatch.setattr(EmbeddingCache, "RECENT", 0)
+    a, b, c = (bytes([i]) * 100_000 for i in range(3))
+    cache = EmbeddingCache(cache_path, max_size=250_000)
+    cache.put_many({"a": a, "b": b})
+    # Use the first embedding so that the second one is evicted
+    EmbeddingCache(cache_path).get_many(["a"])
+    cache.put_many({"c": c})
+    cache.compact()
+
+    assert EmbeddingCache(cache_path).get_many(["a", "b", "c"]) == {"a": a, "c": c}
+    assert os.path.getsize(cache_path) < 250_000
@@ -0,0 +1,120 @@
+import csv
+import os
+
+import pytest
+
+from conlang_gpt.checkpoint import Checkpoint, get_checkpoint_path, get_state
+from conlang_gpt.command.improve import improve
+
+
+def fail():
+    raise AssertionError("A finished step was run again")
+
+
+def test_checkpoint_replays_finished_steps(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    checkpoint = Checkpoint(path, "state")
+    assert checkpoint.step("guide", lambda: "new guide") == "new guide"
+    checkpoint.record_part("batch", 1, "response")
+
+    # A record cut off by a crash is ignored
+    with open(path, "a") as file:
+        file.write('{"step": "batch", "ke')
+
+    checkpoint = Checkpoint(path, "state", resume=True)
+    assert checkpoint.step("guide", fail) == "new guide"
+    assert checkpoint.parts("batch") == {1: "response"}
+    assert checkpoint.step("translate", lambda: ["text", None]) == ["text", None]
+
+    checkpoint = Checkpoint(path, "state", resume=True)
+    assert checkpoint.step("guide", fail) == "new guide"
+    assert checkpoint.parts("batch") == {1: "response"}
+    assert checkpoint.step("translate", fail) == ["text", None]
+
+    checkpoint.finish()
+    assert not os.path.exists(path)
+
+
+def test_checkpoint_starts_over_if_the_state_changed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    Checkpoint(path, "state").step("guide", lambda: "new guide")
+
+    checkpoint = Checkpoint(path, "other state", resume=True)
+
+    assert checkpoint.resumed_from is None
+    assert checkpoint.step("guide", lambda: "other guide") == "other guide"
+
+
+def test_checkpoint_drops_steps_after_a_different_step(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    checkpoint = Checkpoint(path, "state")
+    checkpoint.step("create words", lambda: {"A": "a"}, key="a")
+    checkpoint.step("translate", lambda: ["A", None])
+
+    checkpoint = Checkpoint(path, "state", resume=True)
+    assert checkpoint.step("create words", lambda: {"E": "e"}, key="e") == {"E": "e"}
+    assert checkpoint.step("translate", lambda: ["E", None]) == ["E", None]
+
+    checkpoint = Checkpoint(path, "state", resume=True)
+    assert checkpoint.step("create words", fail, key="e") == {"E": "e"}
+
+
+def test_improve_resumes_after_an_interruption(
+    guide_path, dictionary_path, tmp_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        "conlang_gpt.command.improve.get_embeddings_model",
+        lambda: fake_embeddings_model,
+    )
+    with dictionary_path.open("w") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Word", "Translation"])
+        for i in range(30):
+            writer.writerow([f"word{i}", f"meaning {i}"])
+
+    guides = iter(["Improved guide", None])
+    monkeypatch.setattr(
+        "conlang_gpt.language.improve_language", lambda *args: next(guides)
+    )
+
+    requests = []
+
+    def complete_chats(batch_requests, max_concurrency, on_completion):
+        requests.append(len(batch_requests))
+        completion = {"choices": [{"message": {"content": "No problems found"}}]}
+        on_completion(0, completion)
+        if len(requests) == 1:
+            raise RuntimeError("API outage")
+        return [completion] * len(batch_requests)
+
+    monkeypatch.setattr("conlang_gpt.language.complete_chats", complete_chats)
+
+    # The first run is interrupted after the first batch of words
+    with pytest.raises(RuntimeError):
+        improve(str(guide_path), str(dictionary_path), 5, 0.98, "gpt-4")
+    assert guide_path.read_text() != "Improved guide"
+
+    # The guide is not improved again, and only the second batch is requested
+    improve(str(guide_path), str(dictionary_path), 5, 0.98, "gpt-4", resume=True)
+
+    assert requests == [2, 1]
+    assert guide_path.read_text() == "Improved guide"
+    assert not os.path.exists(get_checkpoint_path("improve", str(dictionary_path)))
+
+
+def test_state_depends_on_the_models(monkeypatch):
+    state = get_state("guide", {"E": "Hello"}, "gpt-4")
+
+    assert get_state("guide", {"E": "Hello"}, "gpt-4") == state
+    assert get_state("guide", {"E": "Hello"}, "gpt-4o") != state
+    monkeypatch.setattr(
+        "conlang_gpt.openai.routes", {"translate": ("gpt-4o-mini", None)}
+    )
+    assert get_state("guide", {"E": "Hello"}, "gpt-4") != state
+
+
+def test_journal_is_kept_next_to_the_dictionary(tmp_path):
+    path = get_checkpoint_path("translate", str(tmp_path / "dictionary.csv"))
+
+    assert path == str(tmp_path / "dictionary.csv.translate.journal.jsonl")
@@ -0,0 +1,33 @@
+import os
+import re
+import subprocess
+import sys
+
+# Seconds that importing the CLI may take. Loading langchain and OpenAI used
+# to take about a second.
+MAX_IMPORT_TIME = 0.5
+
+
+def test_help_starts_without_heavy_modules_or_api_key():
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "conlang_gpt", "--help"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "Usage:" in result.stdout
+
+    # Each line is "import time: <self us> | <cumulative us> | <module>"
+    imports = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s+)(\S+)", line)
+        if match:
+            imports[match.group(3)] = int(match.group(1)) / 1_000_000
+
+    for module in ["langchain", "openai", "numpy", "torch", "sentence_transformers"]:
+        assert module not in imports
+    assert imports["conlang_gpt.cli"] < MAX_IMPORT_TIME
@@ -0,0 +1,141 @@
+import shutil
+
+import click
+import pytest
+
+from conlang_gpt.command.index import compress, drift, rebuild, recall
+from conlang_gpt.language import load_dictionary, save_dictionary
+from conlang_gpt.quantize import Codec
+
+
+@pytest.fixture()
+def dictionary():
+    return {f"word{i}": f"meaning {i}" for i in range(30)}
+
+
+def test_compress_stores_projected_embeddings(
+    dictionary_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.command.index.get_embeddings_model",
+        lambda: fake_embeddings_model,
+    )
+
+    compress(str(dictionary_path), "int8", 16)
+
+    dictionary = load_dictionary(str(dictionary_path))
+    store = dictionary.embeddings
+    assert store.codec.precision == "int8"
+    assert store.dimensions == 16
+    assert len(store) == 90
+    assert store.get(["meaning 1"], fake_embeddings_model).shape == (1, 16)
+
+    # Compressing again starts from full precision embeddings
+    compress(str(dictionary_path), "float16", None)
+    store = load_dictionary(str(dictionary_path)).embeddings
+    assert store.codec == Codec("float16")
+    assert store.dimensions == fake_embeddings_model.size
+
+
+def test_drift_prints_one_row_per_codec(
+    dictionary_path, monkeypatch, capsys, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.command.index.get_embeddings_model",
+        lambda: fake_embeddings_model,
+    )
+
+    drift(str(dictionary_path), ["float32", "int8"], [8], [0.9], 10)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert "R@0.9" in lines[-4]
+    assert [line.split()[0] for line in lines[-3:]] == [
+        "Codec(float32,",
+        "Codec(int8)",
+        "Codec(int8,",
+    ]
+
+
+def test_rebuild_embeds_entries_without_embeddings(
+    dictionary_path, tmp_path, monkeypatch, capsys, fake_embeddings_model
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+
+    rebuild(str(dictionary_path), 1, 16)
+
+    assert len(load_dictionary(str(dictionary_path)).embeddings) == 90
+    assert "Embedded 90 new text(s) for 30 entries." in capsys.readouterr().out
+
+    # Nothing is embedded again
+    fake_embeddings_model.embedded = 0
+    rebuild(str(dictionary_path), 1, 16)
+    assert fake_embeddings_model.embedded == 0
+    assert "Embedded 0 new text(s)" in capsys.readouterr().out
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("filename", ["dictionary.csv", "dictionary.db"])
+def test_rebuild_resumes_from_the_saved_shards(
+    dictionary_path, tmp_path, monkeypatch, fake_embeddings_model, filename
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    path = str(tmp_path / filename)
+    if filename.endswith(".db"):
+        save_dictionary(load_dictionary(str(dictionary_path)), path)
+
+    # Interrupt the run while it embeds the second of three shards
+    embed_documents = fake_embeddings_model.embed_documents
+
+    def interrupted_embed_documents(texts):
+        if fake_embeddings_model.embedded >= 30:
+            raise Interrupted
+        return embed_documents(texts)
+
+    monkeypatch.setattr(
+        fake_embeddings_model, "embed_documents", interrupted_embed_documents
+    )
+    with pytest.raises(Interrupted):
+        rebuild(path, 1, 16, shard_size=10)
+    monkeypatch.setattr(fake_embeddings_model, "embed_documents", embed_documents)
+    assert len(load_dictionary(path).embeddings) == 30
+
+    # The first shard is not embedded again, even without the embedding cache
+    shutil.rmtree(tmp_path / ".conlang")
+    fake_embeddings_model.embedded = 0
+    rebuild(path, 1, 16, shard_size=10)
+    assert fake_embeddings_model.embedded == 60
+    assert len(load_dictionary(path).embeddings) == 90
+
+
+def test_recall_rejects_small_dictionaries(tmp_path):
+    with pytest.raises(click.ClickException):
+        recall(str(tmp_path / "missing.csv"), [1], None, 10, 10)
+
+    assert not (tmp_path / "missing.csv").exists()
+
+
+def test_recall_and_drift_leave_the_dictionary_alone(
+    dictionary_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.command.index.get_embeddings_model",
+        lambda: fake_embeddings_model,
+    )
+    before = dictionary_path.stat().st_mtime_ns
+
+    recall(str(dictionary_path), [1], 2, 5, 3)
+    drift(str(dictionary_path), ["int8"], [], [0.9], 5)
+
+    assert dictionary_path.stat().st_mtime_ns == before
+    assert not (dictionary_path.parent / "dictionary.csv.idx").exists()
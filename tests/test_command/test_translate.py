@@ -1,6 +1,8 @@
 import csv
+import json
 
-from conlang_gpt.command.translate import translate
+from conlang_gpt.command.translate import translate, translate_batch
+from conlang_gpt.language import TranslationError
 
 
 def test_translate_with_improvements_disabled_populates_empty_dictionary(
@@ -19,3 +21,36 @@ def test_translate_with_improvements_disabled_populates_empty_dictionary(
     # Skip the header row
     next(csv_reader)
     assert len(list(csv_reader)) > 0
+
+
+def test_translate_batch_writes_one_json_result_per_input(
+    guide_path, dictionary_path, tmp_path, monkeypatch, capsys, fake_embeddings_model
+):
+    def fake_translate(guide, dictionary, text, *args, **kwargs):
+        if text == "fail":
+            raise TranslationError("Cannot translate")
+        dictionary = dict(dictionary, **{text.upper(): text})
+        return guide, dictionary, text.upper(), f"Explanation of {text}"
+
+    monkeypatch.setattr(
+        "conlang_gpt.command.translate.get_embeddings_model",
+        lambda: fake_embeddings_model,
+    )
+    monkeypatch.setattr(
+        "conlang_gpt.command.translate.translate_and_improve", fake_translate
+    )
+    input_path = tmp_path / "input.jsonl"
+    input_path.write_text('hello\n\n{"id": "b", "text": "world"}\nfail\n')
+
+    with input_path.open() as input_file:
+        translate_batch(
+            guide_path, dictionary_path, input_file, 0, 0.98, "gpt-4", save_every=1
+        )
+
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [result["id"] for result in results] == [1, "b", 4]
+    assert results[1]["translation"] == "WORLD"
+    assert results[2]["error"] == "Cannot translate"
+    csv_reader = csv.reader(dictionary_path.open("r"))
+    next(csv_reader)
+    assert len(list(csv_reader)) == 2
@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from conlang_gpt.embeddings import (
+    DEFAULT_MODEL_NAME,
+    _get_batches,
+    compare_runtimes,
+    get_bulk_embeddings_model,
+    get_embeddings_model,
+    get_model_name,
+)
+from conlang_gpt.language import load_dictionary, save_dictionary
+
+
+def test_embeddings_are_cached_without_loading_the_model(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    cache_path = str(tmp_path / "embeddings.db")
+
+    model = get_embeddings_model(cache_path=cache_path)
+    documents = model.embed_documents(["Hello", "world", "Hello"])
+    query = model.embed_query("Hello")
+    assert fake_embeddings_model.embedded == 3
+
+    model = get_embeddings_model(cache_path=cache_path)
+    assert np.allclose(model.embed_documents(["world", "Hello"]), documents[1::-1])
+    assert np.allclose(model.embed_query("Hello"), query)
+    assert not model.loaded
+    assert not np.allclose(query, documents[0])
+
+
+def test_queries_are_embedded_in_one_batch(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    expected = [fake_embeddings_model.embed_query(text) for text in ["a", "b", "c"]]
+    fake_embeddings_model.query_instruction = "query: "
+    fake_embeddings_model.calls = 0
+
+    model = get_embeddings_model(cache_path=str(tmp_path / "embeddings.db"))
+    vectors = model._embed(["a", "b", "c"], query=True)
+
+    assert fake_embeddings_model.calls == 1
+    assert np.allclose(vectors, expected)
+
+
+def test_runtimes_are_cached_apart_and_compared(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    optimized = []
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._optimize_embeddings_model",
+        lambda model, runtime, threads: optimized.append((runtime, threads)),
+    )
+    cache_path = str(tmp_path / "embeddings.db")
+    get_embeddings_model(cache_path=cache_path).embed_documents(["Hello"])
+
+    model = get_embeddings_model(cache_path=cache_path, runtime="int8", threads=2)
+    model.embed_documents(["Hello"])
+    assert model.loaded
+    assert optimized == [("torch", None), ("int8", 2)]
+
+    results = compare_runtimes(["Hello", "world", "fruit"], "int8")
+    assert np.allclose(results["similarities"], 1)
+    assert results["agreement"] == 1.0
+    assert set(results["texts_per_second"]) == {"torch", "int8"}
+
+
+def test_bulk_embeddings_are_cached_batch_by_batch(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    optimized = []
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._optimize_embeddings_model",
+        lambda model, runtime, threads: optimized.append(threads),
+    )
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    # Run the workers as threads of this process
+    monkeypatch.setattr(
+        "concurrent.futures.ProcessPoolExecutor",
+        lambda max_workers, mp_context, initializer, initargs: ThreadPoolExecutor(
+            max_workers, initializer=initializer, initargs=initargs
+        ),
+    )
+    cache_path = str(tmp_path / "embeddings.db")
+    texts = [f"text {i}" for i in range(10)]
+    progress = []
+
+    model = get_bulk_embeddings_model(
+        workers=2,
+        batch_size=3,
+        on_progress=lambda embedded, total: progress.append((embedded, total)),
+        cache_path=cache_path,
+    )
+    vectors = model.embed_documents(texts)
+    queries = model.embed_queries(texts[:4])
+    # Each worker gets its share of the CPU threads
+    assert set(optimized) == {4}
+
+    expected = get_embeddings_model(cache_path=None)
+    assert np.allclose(vectors, expected.embed_documents(texts))
+    assert np.allclose(queries, expected.embed_queries(texts[:4]))
+    assert [total for _, total in progress] == [10] * 4 + [4] * 2
+    assert progress[3] == (10, 10)
+
+    # Everything is cached, so nothing is embedded again
+    fake_embeddings_model.embedded = 0
+    model.embed_documents(texts)
+    assert fake_embeddings_model.embedded == 0
+
+
+@pytest.mark.parametrize("filename", ["dictionary.csv", "dictionary.db"])
+def test_switching_runtimes_replaces_the_stored_embeddings(
+    tmp_path, monkeypatch, fake_embeddings_model, filename
+):
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._load_embeddings_model",
+        lambda model_name: fake_embeddings_model,
+    )
+    monkeypatch.setattr(
+        "conlang_gpt.embeddings._optimize_embeddings_model",
+        lambda model, runtime, threads: None,
+    )
+    path = str(tmp_path / filename)
+    torch = get_embeddings_model(cache_path=None)
+    int8 = get_embeddings_model(cache_path=None, runtime="int8")
+    assert get_model_name(torch) == DEFAULT_MODEL_NAME
+    assert get_model_name(int8) == f"{DEFAULT_MODEL_NAME}:int8"
+    save_dictionary({"E": "Hello", "I": "world"}, path, torch)
+
+    # Every entry is embedded again, rather than mixing the two runtimes
+    fake_embeddings_model.embedded = 0
+    save_dictionary(load_dictionary(path), path, int8)
+    assert fake_embeddings_model.embedded == 6
+
+    dictionary = load_dictionary(path)
+    assert dictionary.embeddings.model_name == f"{DEFAULT_MODEL_NAME}:int8"
+    assert len(dictionary.embeddings) == 6
+
+
+def test_batches_hold_texts_of_about_the_same_length():
+    texts = ["a" * 10, "b", "c" * 10, "d", "e" * 10, "f"]
+
+    assert _get_batches(texts, 4, 25) == [[1, 3, 5, 0], [2, 4]]
+    assert _get_batches(texts, 2, 100) == [[1, 3], [5, 0], [2, 4]]
+    assert _get_batches([], 4, 25) == []
@@ -0,0 +1,55 @@
+from conlang_gpt.guide import count_tokens, select_guide, split_guide
+
+GUIDE = """# Pentalit
+
+A vowel-only language.
+
+## Tones
+
+Pentalit uses four tones: high, low, rising, and falling.
+
+## Numbers
+
+Numbers are counted in base five: one, two, three, four, five.
+
+## Questions
+
+Questions start with "AI", as in "Do I eat fruit?"."""
+
+
+def test_split_guide_splits_at_headings_and_numbered_rules():
+    assert split_guide(GUIDE) == [
+        "# Pentalit\n\nA vowel-only language.",
+        "## Tones\n\nPentalit uses four tones: high, low, rising, and falling.",
+        "## Numbers\n\nNumbers are counted in base five: one, two, three, four, five.",
+        '## Questions\n\nQuestions start with "AI", as in "Do I eat fruit?".',
+    ]
+    assert split_guide("Intro\n1. First rule\n2. Second rule") == [
+        "Intro",
+        "1. First rule",
+        "2. Second rule",
+    ]
+
+
+def test_select_guide_keeps_whole_guide_within_budget(fake_embeddings_model):
+    assert select_guide(GUIDE, "one two", fake_embeddings_model, budget=1000) == GUIDE
+    assert fake_embeddings_model.calls == 0
+
+
+def test_select_guide_keeps_relevant_sections_in_order(fake_embeddings_model):
+    sections = split_guide(GUIDE)
+    budget = count_tokens(sections[0]) + count_tokens(sections[2])
+
+    selected = select_guide(
+        GUIDE, "counted in base five", fake_embeddings_model, budget=budget
+    )
+
+    assert selected == f"{sections[0]}\n\n{sections[2]}"
+
+
+def test_select_guide_embeds_each_guide_once(fake_embeddings_model):
+    for text in ["four tones", "Do I eat fruit?"]:
+        select_guide(GUIDE + "\n", text, fake_embeddings_model, budget=30)
+
+    # The sections once, plus one query per text
+    assert fake_embeddings_model.embedded == len(split_guide(GUIDE)) + 2
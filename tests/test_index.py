@@ -0,0 +1,206 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conlang_gpt.index import (
+    MATRIX_HEADER_SIZE,
+    DictionaryIndex,
+    LexicalIndex,
+    VectorStore,
+    normalize,
+    similar_pairs,
+    top_k,
+)
+from conlang_gpt.quantize import Codec
+
+
+def test_normalize_scales_rows_to_unit_length():
+    vectors = normalize([[3, 4], [0, 0]])
+
+    assert np.allclose(vectors, [[0.6, 0.8], [0, 0]])
+
+
+def test_top_k_breaks_ties_by_column_order():
+    similarities = np.array([[0.5, 0.9, 0.9, 0.1]])
+
+    assert top_k(similarities, 1).tolist() == [[1]]
+    assert top_k(similarities, 3).tolist() == [[1, 2, 0]]
+
+
+def test_dictionary_index_search_uses_best_of_word_and_translation(
+    fake_embeddings_model,
+):
+    index = DictionaryIndex.from_dictionary(
+        {"E": "Hello", "hello": "Goodbye", "I": "world"}, fake_embeddings_model
+    )
+    queries = fake_embeddings_model.embed_documents(["hello", "world"])
+
+    matches = index.search(queries, k=2)
+
+    assert [word for word, _ in matches[0]] == ["E", "hello"]
+    assert matches[1][0][0] == "I"
+
+
+def test_dictionary_index_search_filters_by_min_similarity(fake_embeddings_model):
+    index = DictionaryIndex.from_dictionary({"E": "Hello"}, fake_embeddings_model)
+    queries = fake_embeddings_model.embed_documents(["Hello", "xyzzy"])
+
+    matches = index.search(queries, min_similarity=0.75)
+
+    assert matches[0][0][0] == "E"
+    assert matches[0][0][1] == pytest.approx(1)
+    assert matches[1] == []
+
+
+def test_lexical_index_matches_words_before_translations():
+    index = LexicalIndex({"E": "Hello", "I": "e", "O": "hello"})
+
+    assert index.find("e") == ["E", "I"]
+    assert index.find("HELLO") == ["E", "O"]
+    assert index.find("fruit") == []
+
+    index.remove("E", "Hello")
+    assert index.find("e") == ["I"]
+    assert index.find("hello") == ["O"]
+
+
+def test_vector_store_only_embeds_missing_texts(fake_embeddings_model):
+    store = VectorStore()
+    store.get(["Hello", "world"], fake_embeddings_model)
+
+    vectors = store.get(["world", "fruit", "fruit"], fake_embeddings_model)
+
+    assert fake_embeddings_model.embedded == 3
+    assert vectors.shape == (3, fake_embeddings_model.size)
+    assert np.allclose(vectors[1], vectors[2])
+
+
+def test_vector_store_keeps_queries_and_documents_apart(fake_embeddings_model):
+    store = VectorStore()
+
+    document = store.get(["Hello"], fake_embeddings_model)
+    query = store.get(["Hello"], fake_embeddings_model, query=True)
+
+    assert not np.allclose(document, query)
+
+
+def test_vector_store_save_appends_new_rows(tmp_path, fake_embeddings_model):
+    path = tmp_path / "dictionary.csv.idx"
+    store = VectorStore()
+    expected = store.get(["Hello", "world"], fake_embeddings_model)
+    store.save(path)
+
+    loaded = VectorStore.load(path)
+    loaded.get(["fruit"], fake_embeddings_model)
+    loaded.save(path)
+
+    reloaded = VectorStore.load(path)
+    assert isinstance(reloaded._stored, np.memmap)
+    assert len(reloaded) == 3
+    assert (
+        path.stat().st_size == MATRIX_HEADER_SIZE + 3 * fake_embeddings_model.size * 4
+    )
+    assert np.allclose(
+        reloaded.get(["Hello", "world"], fake_embeddings_model), expected
+    )
+    assert fake_embeddings_model.embedded == 3
+
+
+def test_vector_store_save_compacts_unused_rows(tmp_path, fake_embeddings_model):
+    path = tmp_path / "dictionary.csv.idx"
+    store = VectorStore()
+    store.get(["Hello", "world", "fruit"], fake_embeddings_model)
+    store.save(path)
+
+    store.save(path, store.keys(["fruit"]))
+
+    reloaded = VectorStore.load(path)
+    assert len(reloaded) == 1
+    assert path.stat().st_size == MATRIX_HEADER_SIZE + fake_embeddings_model.size * 4
+
+
+def test_vector_store_rejects_a_row_map_of_another_matrix(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    path = tmp_path / "dictionary.csv.idx"
+    store = VectorStore()
+    store.get(["Hello", "world", "fruit"], fake_embeddings_model)
+    store.save(path)
+
+    # Crash after the row map of the compacted file was written, but before
+    # the matrix was replaced
+    def crash(source, destination):
+        if str(destination) == str(path):
+            raise KeyboardInterrupt
+        return replace(source, destination)
+
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.save(path, store.keys(["fruit"]))
+    monkeypatch.undo()
+
+    assert json.loads((tmp_path / "dictionary.csv.idx.json").read_text())["rows"] == (
+        store.keys(["fruit"])
+    )
+    assert len(VectorStore.load(path)) == 0
+
+
+def test_similar_pairs_matches_pairwise_comparison():
+    vectors = normalize(np.random.default_rng(0).standard_normal((50, 4)))
+    expected = [
+        (i, j)
+        for i in range(50)
+        for j in range(i + 1, 50)
+        if vectors[i] @ vectors[j] > 0.8
+    ]
+
+    pairs = similar_pairs(vectors, 0.8, block_size=7)
+
+    assert [(i, j) for i, j, _ in pairs] == expected
+
+
+def test_vector_store_keeps_rows_compressed(tmp_path, fake_embeddings_model):
+    path = tmp_path / "dictionary.csv.idx"
+    store = VectorStore(codec=Codec("int8"))
+    expected = VectorStore().get(["Hello", "world"], fake_embeddings_model)
+    store.get(["Hello", "world"], fake_embeddings_model)
+    store.save(path)
+
+    reloaded = VectorStore.load(path)
+    assert reloaded.codec == Codec("int8")
+    assert reloaded.encoded(reloaded.keys(["Hello"])).dtype == np.int8
+    assert path.stat().st_size == MATRIX_HEADER_SIZE + 2 * fake_embeddings_model.size
+    vectors = reloaded.get(["Hello", "world"], fake_embeddings_model)
+    assert np.allclose(vectors, expected, atol=0.02)
+
+
+def test_vector_store_compressed_projects_every_row(fake_embeddings_model):
+    store = VectorStore()
+    texts = [f"word {i}" for i in range(20)]
+    vectors = store.get(texts, fake_embeddings_model)
+    codec = Codec.fit(vectors, "float16", dimensions=8)
+
+    compressed = store.compressed(codec)
+
+    assert compressed.dimensions == 8
+    assert np.allclose(
+        compressed.vectors(store.keys(texts)), codec.project(vectors), atol=1e-3
+    )
+    # New texts are projected the same way
+    assert compressed.get(["fruit"], fake_embeddings_model).shape == (1, 8)
+    with pytest.raises(ValueError):
+        compressed.compressed(codec)
+
+
+def test_dictionary_index_searches_compressed_rows(fake_embeddings_model):
+    dictionary = {"E": "Hello", "I": "world", "O": "fruit"}
+    store = VectorStore(codec=Codec("int8"))
+
+    index = DictionaryIndex.from_dictionary(dictionary, fake_embeddings_model, store)
+    matches = index.search(store.get(["hello"], fake_embeddings_model), k=1)
+
+    assert index.matrix.dtype == np.int8
+    assert matches[0][0][0] == "E"
@@ -4,13 +4,120 @@ from openai.embeddings_utils import cosine_similarity
 import pytest
 
 from conlang_gpt.embeddings import get_embeddings_model
+from conlang_gpt.index import LexicalIndex
 from conlang_gpt.language import (
+    Dictionary,
+    _get_related_words,
     create_dictionary_for_text,
     improve_dictionary,
+    load_dictionary,
     merge_dictionaries,
+    modify_language,
     reduce_dictionary,
+    save_dictionary,
     translate_text,
 )
+from conlang_gpt.openai import set_routes
+from conlang_gpt.tokens import STOPWORDS, tokenize
+
+
+def test_get_related_words_matches_pairwise_search(fake_embeddings_model):
+    dictionary = {"E": "Hello", "I": "world", "O": "fruit", "U": "not", "A": "I"}
+    text = "Hello, world. I do not eat fruit, world."
+
+    related_words = _get_related_words(text, dictionary, fake_embeddings_model)
+
+    # Compare against looking up exact matches, and scoring every other
+    # word/entry pair one at a time
+    lexicon = LexicalIndex(dictionary)
+    expected = []
+    for word in dict.fromkeys(tokenize(text)):
+        expected += lexicon.find(word)
+        if lexicon.find(word) or word in STOPWORDS:
+            continue
+
+        embedding = fake_embeddings_model.embed_documents([word])[0]
+        similarities = {
+            entry: max(
+                cosine_similarity(
+                    embedding, fake_embeddings_model.embed_documents([entry])[0]
+                ),
+                cosine_similarity(
+                    embedding, fake_embeddings_model.embed_documents([translation])[0]
+                ),
+            )
+            for entry, translation in dictionary.items()
+        }
+        best = max(similarities, key=similarities.get)
+        if similarities[best] >= 0.75:
+            expected.append(best)
+    assert related_words == list(dict.fromkeys(expected))
+    assert len(related_words) > 0
+
+
+def test_get_related_words_only_embeds_words_without_exact_matches(
+    fake_embeddings_model,
+):
+    dictionary = Dictionary({"E": "Hello", "I": "world", "O": "fruit"})
+
+    related_words = _get_related_words(
+        "hello WORLD e fruit apple", dictionary, fake_embeddings_model
+    )
+
+    assert related_words[:3] == ["E", "I", "O"]
+    # Only "apple" is embedded, along with the dictionary
+    assert fake_embeddings_model.embedded == 1 + 2 * len(dictionary)
+
+
+def test_get_related_words_normalizes_and_deduplicates_words(fake_embeddings_model):
+    dictionary = Dictionary({"E": "Hello", "I": "world", "O": "fruit", "U": "the"})
+
+    related_words = _get_related_words(
+        "Hello, WORLD! The world's fruits... hello", dictionary, fake_embeddings_model
+    )
+
+    assert related_words == ["E", "I", "U", "O"]
+    assert fake_embeddings_model.embedded == 0
+
+
+def test_dictionary_keeps_lexicon_up_to_date():
+    dictionary = Dictionary({"E": "Hello", "I": "world"})
+
+    dictionary["I"] = "fruit"
+    dictionary.update({"A": "Hello"})
+    del dictionary["E"]
+    dictionary.pop("O", None)
+
+    assert dictionary.lexicon.find_translations("hello") == ["A"]
+    assert dictionary.lexicon.find_translations("world") == []
+    assert dictionary.lexicon.find("FRUIT") == ["I"]
+    assert dictionary.lexicon.find_words("e") == []
+
+
+def test_get_related_words_returns_empty_list_for_empty_dictionary(
+    fake_embeddings_model,
+):
+    assert _get_related_words("Hello", {}, fake_embeddings_model) == []
+
+
+def test_save_dictionary_only_embeds_new_entries(tmp_path, fake_embeddings_model):
+    dictionary_path = tmp_path / "dictionary.csv"
+    save_dictionary(
+        {"E": "Hello", "I": "world"}, dictionary_path, fake_embeddings_model
+    )
+    fake_embeddings_model.embedded = 0
+
+    dictionary = load_dictionary(dictionary_path)
+    _get_related_words("Hi", dictionary, fake_embeddings_model)
+    dictionary = merge_dictionaries(
+        dictionary, {"O": "fruit"}, 0.98, fake_embeddings_model
+    )
+    save_dictionary(dictionary, dictionary_path, fake_embeddings_model)
+
+    # The word in the text, plus the new word, its translation, and the
+    # translation as a query
+    assert fake_embeddings_model.embedded == 4
+    assert dictionary == load_dictionary(dictionary_path)
 
 
 def test_create_dictionary_for_text_adds_all_required_words_to_empty_dictionary(guide):
@@ -83,6 +190,51 @@ def test_improve_dictionary_updates_words_that_do_not_follow_guide_rules(
     )
 
 
+def test_improve_dictionary_applies_batches_in_order(
+    guide, monkeypatch, fake_embeddings_model
+):
+    responses = [
+        "Conlang,English\nA,Hello",
+        "No problems found",
+        "Conlang,English\nEO,fruit",
+    ]
+    requested = []
+
+    def complete_chats(requests, max_concurrency):
+        requested.extend(requests)
+        return [
+            {"choices": [{"message": {"content": response}}]} for response in responses
+        ]
+
+    monkeypatch.setattr("conlang_gpt.language.complete_chats", complete_chats)
+
+    dictionary = improve_dictionary(
+        {"C": "Hello", "I": "world", "O": "fruit"},
+        guide,
+        0.98,
+        "gpt-4",
+        fake_embeddings_model,
+        batch_size=1,
+    )
+
+    assert len(requested) == 3
+    assert dictionary == {"I": "world", "A": "Hello", "EO": "fruit"}
+
+
+def test_modify_language_reports_the_model_of_its_stage(guide, monkeypatch, capsys):
+    monkeypatch.setattr(
+        "conlang_gpt.language.complete_chat",
+        lambda **request: {"choices": [{"message": {"content": "New guide"}}]},
+    )
+    set_routes({"guide": ("llama3", "http://localhost:8000/v1")})
+    try:
+        modify_language(guide, "Add plurals.", "gpt-4")
+    finally:
+        set_routes({})
+
+    assert "Modifying language using llama3..." in capsys.readouterr().out
+
+
 @pytest.mark.parametrize(
     "word1, translation1, word2, translation2",
     [
@@ -103,6 +255,16 @@ def test_reduce_dictionary_removes_similar_words(
     assert len(dictionary) == 1
 
 
+def test_reduce_dictionary_keeps_first_of_similar_words(fake_embeddings_model):
+    dictionary = reduce_dictionary(
+        {"E": "Hello", "O": "world", "I": "hello", "A": "World", "U": "fruit"},
+        0.98,
+        fake_embeddings_model,
+    )
+
+    assert dictionary == {"E": "Hello", "O": "world", "U": "fruit"}
+
+
 @pytest.mark.parametrize(
     "word1, translation1, word2, translation2",
     [
@@ -139,6 +301,55 @@ def test_merge_dictionaries_merges_words_with_similar_translations(
     assert len(dictionary) == 1
 
 
+def test_merge_dictionaries_prefers_shorter_words(fake_embeddings_model):
+    dictionary = merge_dictionaries(
+        {"EA": "Hello", "I": "world"},
+        {"E": "hello", "IO": "World", "O": "fruit"},
+        0.98,
+        fake_embeddings_model,
+    )
+
+    assert dictionary == {"I": "world", "E": "hello", "O": "fruit"}
+
+
+def test_merge_dictionaries_only_embeds_new_words(fake_embeddings_model):
+    existing = merge_dictionaries(
+        Dictionary({"E": "Hello"}), {"I": "world"}, 0.98, fake_embeddings_model
+    )
+    fake_embeddings_model.embedded = 0
+
+    merge_dictionaries(existing, {"O": "fruit"}, 0.98, fake_embeddings_model)
+
+    assert fake_embeddings_model.embedded == 1
+
+
+def test_merge_dictionaries_keeps_track_of_changed_words(
+    tmp_path, fake_embeddings_model
+):
+    path = str(tmp_path / "dictionary.csv")
+    save_dictionary({"EA": "Hello", "I": "world"}, path)
+    existing = load_dictionary(path)
+
+    merged = merge_dictionaries(
+        existing, {"E": "hello", "O": "fruit"}, 0.98, fake_embeddings_model
+    )
+
+    assert merged == {"I": "world", "E": "hello", "O": "fruit"}
+    assert merged.unsaved == {"EA", "E", "O"}
+    assert merged.saved_path == existing.saved_path
+    assert existing.unsaved == set()
+
+
+def test_merge_dictionaries_does_not_load_model_for_empty_dictionary(tmp_path):
+    embeddings_model = get_embeddings_model()
+
+    merged = merge_dictionaries({}, {"E": "Hello"}, 0.98, embeddings_model)
+    save_dictionary({}, str(tmp_path / "dictionary.csv"), embeddings_model)
+
+    assert merged == {"E": "Hello"}
+    assert not embeddings_model.loaded
+
+
 @pytest.mark.parametrize(
     "word1, translation1, word2, translation2",
     [
@@ -155,6 +366,43 @@ def test_merge_dictionaries_does_not_merge_words_with_distinct_translations(
     assert len(dictionary) == 2
 
 
+def test_translate_text_stops_streaming_after_translation(
+    guide, monkeypatch, fake_embeddings_model
+):
+    streamed = []
+
+    def complete_chat(**kwargs):
+        assert kwargs["stream"]
+        for chunk in ["<transl", "ation>E I</TRANS", "LATION> Because", " reasons"]:
+            streamed.append(chunk)
+            yield chunk
+
+    monkeypatch.setattr("conlang_gpt.language.complete_chat", complete_chat)
+    translations = []
+
+    translated_text, explanation = translate_text(
+        "Hello world",
+        guide,
+        {},
+        "gpt-4",
+        fake_embeddings_model,
+        on_translation=translations.append,
+        explain=False,
+    )
+
+    assert translated_text == "E I"
+    assert explanation is None
+    assert translations == ["E I"]
+    assert len(streamed) == 3
+
+    translated_text, explanation = translate_text(
+        "Hello world", guide, {}, "gpt-4", fake_embeddings_model
+    )
+
+    assert translated_text == "E I"
+    assert explanation == "E I Because reasons"
+
+
 def test_translate_text_translated_translation_is_similar_to_original_text(
     guide,
 ):
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import openai
+import pytest
+
+import conlang_gpt
+from conlang_gpt.cache import ResponseCache
+from conlang_gpt.openai import (
+    acomplete_chat,
+    complete_chat,
+    complete_chats,
+    parse_route,
+    set_response_cache,
+    set_routes,
+    stream_chat,
+)
+
+# Used to yield to other tasks while asyncio.sleep is patched
+yield_control = asyncio.sleep
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    # The OpenAI API is mocked, but a key is still required to call it
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr("conlang_gpt.openai.response_cache", None)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    async def async_sleep(delay):
+        pass
+
+    monkeypatch.setattr("time.sleep", lambda delay: None)
+    monkeypatch.setattr("asyncio.sleep", async_sleep)
+
+
+def test_complete_chat_retries_after_rate_limit(monkeypatch):
+    responses = [openai.error.RateLimitError("slow down"), {"id": "done"}]
+
+    def create(**kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    assert complete_chat(model="gpt-4", messages=[]) == {"id": "done"}
+
+
+def test_stream_chat_retries_after_rate_limit(monkeypatch):
+    chunks = iter([{"choices": [{"delta": {"content": "Hello"}}]}])
+    responses = [openai.error.RateLimitError("slow down"), chunks]
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    assert list(stream_chat(model="gpt-4", messages=[])) == ["Hello"]
+    assert len(requests) == 2
+    assert all(request["stream"] for request in requests)
+
+
+def test_acomplete_chat_retries_after_service_unavailable(monkeypatch):
+    responses = [openai.error.ServiceUnavailableError("down"), {"id": "done"}]
+
+    async def acreate(**kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    completion = asyncio.run(acomplete_chat(model="gpt-4", messages=[]))
+
+    assert completion == {"id": "done"}
+
+
+def test_complete_chats_limits_concurrency_and_keeps_order(monkeypatch):
+    in_flight = 0
+    max_in_flight = 0
+
+    async def acreate(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Finish later requests first
+        for _ in range(10 - kwargs["n"]):
+            await yield_control(0)
+        in_flight -= 1
+        return {"n": kwargs["n"]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    completions = complete_chats([{"n": n} for n in range(10)], max_concurrency=3)
+
+    assert [completion["n"] for completion in completions] == list(range(10))
+    assert max_in_flight == 3
+
+
+def test_complete_chat_reuses_cached_completions(monkeypatch, tmp_path):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return {"id": len(requests)}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    set_response_cache(ResponseCache(str(tmp_path / "completions.db")))
+
+    first = complete_chat(model="gpt-4", messages=[], temperature=0)
+    second = complete_chat(model="gpt-4", messages=[], temperature=0)
+    complete_chat(model="gpt-4", messages=[], temperature=1)
+    complete_chat(model="gpt-4", messages=[], temperature=1)
+
+    assert first == second == {"id": 1}
+    assert len(requests) == 3
+
+
+def test_complete_chat_waits_as_long_as_retry_after_header(monkeypatch):
+    responses = [
+        openai.error.RateLimitError("slow down", headers={"retry-after": "7"}),
+        {"id": "done"},
+    ]
+    delays = []
+
+    def create(**kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    monkeypatch.setattr("time.sleep", delays.append)
+
+    complete_chat(model="gpt-4", messages=[])
+
+    assert delays == [7]
+
+
+def test_complete_chat_sends_stages_to_their_routes(monkeypatch):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return {"id": len(requests)}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    set_routes(
+        {
+            "words": ("llama3", "http://localhost:8000/v1"),
+            "guide": ("gpt-4", None),
+        }
+    )
+    try:
+        complete_chat(stage="words", model="gpt-3.5-turbo", messages=[])
+        with pytest.raises(Exception, match="OpenAI API key not found"):
+            complete_chat(stage="guide", model="gpt-3.5-turbo", messages=[])
+    finally:
+        set_routes({})
+
+    assert requests == [
+        {
+            "model": "llama3",
+            "api_base": "http://localhost:8000/v1",
+            "api_key": "none",
+            "messages": [],
+        }
+    ]
+
+
+def test_completions_are_not_cached_unless_a_cache_is_set(tmp_path):
+    # The default cache is only created by the CLI
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(conlang_gpt.__file__))
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import conlang_gpt.openai as openai; assert openai.response_cache is None",
+        ],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert not (tmp_path / ".conlang").exists()
+
+
+def test_parse_route():
+    assert parse_route("words=gpt-4o-mini") == ("words", ("gpt-4o-mini", None))
+    assert parse_route("improve-words=llama3@http://localhost:8000/v1") == (
+        "improve-words",
+        ("llama3", "http://localhost:8000/v1"),
+    )
+    assert parse_route("words=@http://localhost:8000/v1") == (
+        "words",
+        (None, "http://localhost:8000/v1"),
+    )
+    for route in ["words", "unknown=gpt-4", "words="]:
+        with pytest.raises(ValueError):
+            parse_route(route)
+
+
+def test_stream_chat_yields_content_and_caches_complete_responses(
+    monkeypatch, tmp_path
+):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return iter(
+            [
+                {"choices": [{"delta": {"role": "assistant"}}]},
+                {"choices": [{"delta": {"content": "Hel"}}]},
+                {"choices": [{"delta": {"content": "lo"}}]},
+                {"choices": [{"delta": {}}]},
+            ]
+        )
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    set_response_cache(ResponseCache(str(tmp_path / "completions.db")))
+
+    # Stopping early does not cache the partial response
+    chunks = stream_chat(model="gpt-4", messages=[], temperature=0)
+    assert next(chunks) == "Hel"
+    chunks.close()
+
+    assert list(stream_chat(model="gpt-4", messages=[], temperature=0)) == [
+        "Hel",
+        "lo",
+    ]
+    assert list(
+        complete_chat(model="gpt-4", messages=[], temperature=0, stream=True)
+    ) == ["Hello"]
+    assert len(requests) == 2
+    assert requests[0]["stream"]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from conlang_gpt.index import normalize
+from conlang_gpt.quantize import Codec, Encoded, measure_drift
+
+
+def get_vectors(n=200, dimensions=32, seed=0):
+    rng = np.random.default_rng(seed)
+    # Embeddings share most of their directions, like those of a real model
+    basis = rng.standard_normal((8, dimensions))
+    return normalize(rng.standard_normal((n, 8)) @ basis)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_codec_keeps_similarities(precision):
+    vectors = get_vectors()
+    codec = Codec(precision)
+
+    rows = codec.encode(vectors)
+    decoded = codec.decode(rows)
+
+    assert rows.dtype == np.dtype(precision)
+    assert np.allclose(np.linalg.norm(decoded, axis=1), 1, atol=1e-5)
+    assert np.abs(decoded @ decoded.T - vectors @ vectors.T).max() < 0.02
+
+
+def test_codec_projection_keeps_similarities_in_fewer_dimensions():
+    vectors = get_vectors()
+    codec = Codec.fit(vectors, "float32", dimensions=8)
+
+    decoded = codec.decode(codec.encode(vectors))
+
+    assert decoded.shape == (200, 8)
+    assert codec.dimensions(32) == 8
+    assert np.abs(decoded @ decoded.T - vectors @ vectors.T).max() < 1e-4
+
+
+def test_codec_round_trips_through_json():
+    codec = Codec.fit(get_vectors(), "int8", dimensions=4)
+
+    assert Codec.from_json(codec.to_json()) == codec
+    assert Codec.from_json(None) == Codec()
+    assert Codec("int8") != codec
+
+
+def test_codec_rejects_unknown_precision():
+    with pytest.raises(ValueError):
+        Codec("float8")
+
+
+def test_encoded_decodes_slices():
+    vectors = get_vectors()
+    codec = Codec("int8")
+    encoded = Encoded(codec.encode(vectors), codec)
+
+    assert len(encoded) == 200
+    assert encoded.nbytes == 200 * 32
+    assert np.allclose(encoded[10:20], vectors[10:20], atol=0.02)
+
+
+def test_measure_drift_reports_recall_and_precision():
+    vectors = get_vectors()
+
+    exact, compressed = measure_drift(
+        vectors, [Codec(), Codec("int8")], [0.5, 0.9], n_queries=50
+    )
+
+    assert exact["mean_error"] == pytest.approx(0, abs=1e-6)
+    assert exact["thresholds"][0.9]["recall"] == 1.0
+    assert compressed["bytes"] == exact["bytes"] // 4
+    assert 0 < compressed["mean_error"] < 0.01
+    assert compressed["thresholds"][0.5]["recall"] > 0.95
+    assert compressed["thresholds"][0.5]["precision"] > 0.95
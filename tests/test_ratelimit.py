@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from conlang_gpt.ratelimit import (
+    MAX_BACKOFF,
+    RateLimiter,
+    backoff,
+    estimate_tokens,
+    get_retry_after,
+)
+
+
+def test_estimate_tokens_counts_prompt_and_completion():
+    request = {"messages": [{"role": "user", "content": "a" * 400}], "max_tokens": 50}
+
+    assert estimate_tokens(request) == 100 + 4 + 50
+
+
+def test_backoff_is_bounded_and_jittered():
+    delays = [backoff(attempt) for attempt in range(20)]
+
+    assert all(0.5 <= delay <= MAX_BACKOFF for delay in delays)
+    assert delays[-1] >= MAX_BACKOFF / 2
+
+
+def test_get_retry_after_reads_header():
+    error = openai.error.RateLimitError("slow down", headers={"Retry-After": "3"})
+
+    assert get_retry_after(error) == 3
+    assert get_retry_after(openai.error.RateLimitError("slow down")) is None
+
+
+def test_rate_limiter_waits_when_a_bucket_is_empty():
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=1000)
+
+    assert limiter.try_acquire(400) == 0
+    assert limiter.try_acquire(400) == 0
+    # Both buckets are short now; the request bucket needs the longest wait
+    assert limiter.try_acquire(400) == pytest.approx(30, abs=0.1)
+
+
+def test_rate_limiter_shares_state_through_file(tmp_path):
+    path = str(tmp_path / "rate-limit.json")
+    first = RateLimiter(tokens_per_minute=1000, path=path)
+    second = RateLimiter(tokens_per_minute=1000, path=path)
+
+    assert first.try_acquire(800) == 0
+    assert second.try_acquire(800) == pytest.approx(36, abs=0.1)
+
+    second.block(10)
+    assert first.try_acquire(1) == pytest.approx(10, abs=0.1)
+
+
+def test_aacquire_waits_for_the_shared_state_without_blocking_the_loop(tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    path = tmp_path / "rate-limit.json"
+    limiter = RateLimiter(requests_per_minute=60, path=str(path))
+    ticks = []
+
+    async def tick():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+
+    async def main():
+        with open(path, "a+") as file:
+            # Another process holds the lock while this one wants to acquire
+            fcntl.flock(file, fcntl.LOCK_EX)
+            acquiring = asyncio.ensure_future(limiter.aacquire(1))
+            await tick()
+            assert not acquiring.done()
+            fcntl.flock(file, fcntl.LOCK_UN)
+        await acquiring
+
+    asyncio.run(main())
+
+    assert len(ticks) == 5
@@ -0,0 +1,130 @@
+import csv
+import threading
+
+import pytest
+
+from conlang_gpt.server import ServerError, Workspace, create_server, send_request
+
+TOKEN = "secret"
+
+
+@pytest.fixture()
+def server_url(fake_embeddings_model, tmp_path):
+    workspace = Workspace(fake_embeddings_model, root=tmp_path)
+    server = create_server("127.0.0.1", 0, TOKEN, workspace)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_keeps_dictionary_in_memory_until_flushed(
+    server_url, guide_path, dictionary_path, monkeypatch
+):
+    monkeypatch.setattr(
+        "conlang_gpt.server.create_dictionary_for_text",
+        lambda guide, text, dictionary, *args: {"E": text},
+    )
+    payload = {"guide_path": str(guide_path), "dictionary_path": str(dictionary_path)}
+
+    result = send_request(
+        server_url, "create-words", dict(payload, text="Hello"), TOKEN
+    )
+
+    assert result == {"words": {"E": "Hello"}}
+    assert dictionary_path.read_text().strip() == "Word,Translation"
+
+    send_request(server_url, "flush", {}, TOKEN)
+
+    csv_reader = csv.reader(dictionary_path.open("r"))
+    next(csv_reader)
+    assert list(csv_reader) == [["E", "Hello"]]
+
+
+def test_server_rejects_unknown_operations_and_arguments(server_url):
+    with pytest.raises(ServerError, match="Unknown operation"):
+        send_request(server_url, "dance", {}, TOKEN)
+
+    with pytest.raises(ServerError, match="unexpected keyword"):
+        send_request(server_url, "flush", {"now": True}, TOKEN)
+
+
+def test_server_requires_the_token(server_url):
+    with pytest.raises(ServerError, match="token"):
+        send_request(server_url, "flush", {})
+
+    with pytest.raises(ServerError, match="token"):
+        send_request(server_url, "flush", {}, "wrong")
+
+
+def test_server_rejects_files_outside_the_root(server_url, tmp_path):
+    outside = tmp_path.parent / "outside.md"
+    payload = {"guide_path": str(outside), "dictionary_path": None, "text": "Hi"}
+
+    with pytest.raises(ServerError, match="outside"):
+        send_request(server_url, "create-words", payload, TOKEN)
+
+    # Symbolic links are followed
+    (tmp_path / "link.md").symlink_to(outside)
+    payload["guide_path"] = str(tmp_path / "link.md")
+    with pytest.raises(ServerError, match="outside"):
+        send_request(server_url, "create-words", payload, TOKEN)
+    assert not outside.exists()
+
+
+def test_workspace_loads_a_language_again_for_another_index(
+    guide_path, dictionary_path, fake_embeddings_model
+):
+    workspace = Workspace(fake_embeddings_model, root=guide_path.parent)
+
+    exact = workspace.language(guide_path, dictionary_path, index="exact")
+    approximate = workspace.language(guide_path, dictionary_path, index="ivf")
+
+    assert exact is not approximate
+    assert exact is workspace.language(guide_path, dictionary_path, index="exact")
+    assert exact.dictionary.search_index is None
+    assert approximate.dictionary.search_index is not None
+
+
+def test_workspace_loads_languages_without_blocking_each_other(
+    guide_path, dictionary_path, fake_embeddings_model, monkeypatch
+):
+    workspace = Workspace(fake_embeddings_model, root=guide_path.parent)
+    loaded = workspace.language(guide_path, None)
+    started = threading.Event()
+    release = threading.Event()
+
+    def load_slowly(path, **options):
+        started.set()
+        release.wait(5)
+        return {}
+
+    monkeypatch.setattr("conlang_gpt.server.load_dictionary", load_slowly)
+    languages = []
+    threads = [
+        threading.Thread(
+            target=lambda: languages.append(
+                workspace.language(guide_path, dictionary_path)
+            )
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+
+    # Another language is available while the dictionary is loading
+    other = []
+    thread = threading.Thread(
+        target=lambda: other.append(workspace.language(guide_path, None))
+    )
+    thread.start()
+    thread.join(1)
+    assert other == [loaded]
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # The slow language was only loaded once
+    assert len(languages) == 2 and languages[0] is languages[1]
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from conlang_gpt.command.dictionary import convert
+from conlang_gpt.language import load_dictionary, save_dictionary
+from conlang_gpt.quantize import Codec
+from conlang_gpt.storage import CsvBackend, SqliteBackend, get_backend
+
+
+def test_get_backend_chooses_by_extension():
+    assert isinstance(get_backend("words.db"), SqliteBackend)
+    assert isinstance(get_backend("words.SQLITE3"), SqliteBackend)
+    assert isinstance(get_backend("words.csv"), CsvBackend)
+
+
+def test_sqlite_dictionary_round_trips_with_embeddings(tmp_path, fake_embeddings_model):
+    path = str(tmp_path / "dictionary.db")
+    save_dictionary({"I": "world", "E": "Hello"}, path, fake_embeddings_model)
+
+    dictionary = load_dictionary(path)
+
+    assert list(dictionary.items()) == [("E", "Hello"), ("I", "world")]
+    assert len(dictionary.embeddings) == 6
+    expected = np.asarray(fake_embeddings_model.embed_query("Hello"))
+    vector = dictionary.embeddings.get(["Hello"], fake_embeddings_model, query=True)[0]
+    assert np.allclose(vector, expected / np.linalg.norm(expected), atol=1e-6)
+
+
+def test_sqlite_dictionary_only_writes_changed_entries(
+    tmp_path, monkeypatch, fake_embeddings_model
+):
+    path = str(tmp_path / "dictionary.db")
+    save_dictionary({"E": "Hello", "I": "world"}, path, fake_embeddings_model)
+
+    dictionary = load_dictionary(path)
+    dictionary["I"] = "planet"
+    dictionary["O"] = "fruit"
+    del dictionary["E"]
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        connection = connect(*args, **kwargs)
+        connection.set_trace_callback(statements.append)
+        return connection
+
+    monkeypatch.setattr("sqlite3.connect", traced_connect)
+    save_dictionary(dictionary, path)
+    monkeypatch.undo()
+
+    assert dict(load_dictionary(path)) == {"I": "planet", "O": "fruit"}
+    written = [
+        statement for statement in statements if "INSERT INTO words" in statement
+    ]
+    assert len(written) == 2
+    # Only the changed words are read back, not every saved entry
+    assert not any(
+        statement.endswith("FROM words") for statement in statements
+    ), statements
+
+    # The changed entries are embedded once a model is given
+    fake_embeddings_model.embedded = 0
+    save_dictionary(load_dictionary(path), path, fake_embeddings_model)
+    assert fake_embeddings_model.embedded == 6
+    assert len(load_dictionary(path).embeddings) == 6
+
+
+def test_convert_keeps_entries_and_embeddings(tmp_path, fake_embeddings_model):
+    csv_path = str(tmp_path / "dictionary.csv")
+    db_path = str(tmp_path / "dictionary.db")
+    csv_copy_path = str(tmp_path / "copy.csv")
+    save_dictionary({"E": "Hello", "I": "world"}, csv_path, fake_embeddings_model)
+
+    convert(csv_path, db_path)
+    convert(db_path, csv_copy_path)
+
+    dictionary = load_dictionary(csv_copy_path)
+    assert dictionary == {"E": "Hello", "I": "world"}
+    fake_embeddings_model.embedded = 0
+    save_dictionary(dictionary, csv_copy_path, fake_embeddings_model)
+    assert fake_embeddings_model.embedded == 0
+
+
+def test_sqlite_dictionary_keeps_compressed_embeddings(tmp_path, fake_embeddings_model):
+    path = str(tmp_path / "dictionary.db")
+    save_dictionary({"I": "world", "E": "Hello"}, path, fake_embeddings_model)
+    dictionary = load_dictionary(path)
+    dictionary.embeddings = dictionary.embeddings.compressed(Codec("float16"))
+    save_dictionary(dictionary, path)
+
+    dictionary = load_dictionary(path)
+
+    assert dictionary.embeddings.codec == Codec("float16")
+    assert len(dictionary.embeddings) == 6
+    connection = sqlite3.connect(path)
+    (blob,) = connection.execute(
+        "SELECT word_embedding FROM words WHERE word = 'E'"
+    ).fetchone()
+    connection.close()
+    assert len(blob) == fake_embeddings_model.size * 2
+
+
+def test_sqlite_dictionary_compares_untracked_changes_with_every_entry(
+    tmp_path, fake_embeddings_model
+):
+    path = str(tmp_path / "dictionary.db")
+    other_path = str(tmp_path / "other.db")
+    save_dictionary({"E": "Hello", "I": "world"}, path, fake_embeddings_model)
+    save_dictionary({"E": "Hi", "O": "fruit"}, other_path)
+
+    # A dictionary loaded from another database knows nothing of this one
+    dictionary = load_dictionary(other_path)
+    dictionary["U"] = "water"
+    save_dictionary(dictionary, path)
+    assert dict(load_dictionary(path)) == {"E": "Hi", "O": "fruit", "U": "water"}
+
+    # Neither does one saved over a database that was deleted since
+    dictionary = load_dictionary(path)
+    os.remove(path)
+    dictionary["A"] = "sun"
+    save_dictionary(dictionary, path)
+    assert len(load_dictionary(path)) == 4
@@ -0,0 +1,14 @@
+from conlang_gpt.tokens import lemmas, tokenize
+
+
+def test_tokenize_strips_punctuation_and_case():
+    assert tokenize('"Hello, World!" (E^I O`)...') == ["hello", "world", "e^i", "o`"]
+
+
+def test_lemmas_include_common_base_forms():
+    assert lemmas("cities")[0] == "city"
+    assert lemmas("boxes")[0] == "box"
+    assert "run" in lemmas("running")
+    assert "love" in lemmas("loved")
+    assert "world" in lemmas("world's")
+    assert lemmas("bus") == []
@@ -0,0 +1,104 @@
+import json
+import tracemalloc
+
+from click.testing import CliRunner
+import openai
+import pytest
+
+from conlang_gpt.cli import cli
+from conlang_gpt.openai import complete_chat
+from conlang_gpt.trace import Tracer, set_tracer, span
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    # The OpenAI API is mocked, but a key is still required to call it
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+
+
+@pytest.fixture()
+def tracer():
+    tracer = Tracer()
+    set_tracer(tracer)
+    yield tracer
+    set_tracer(None)
+
+
+def test_tracer_saves_chrome_trace_events(tmp_path, tracer):
+    with span("outer"):
+        with span("inner", texts=3) as details:
+            details["extra"] = True
+
+    path = tmp_path / "trace.json"
+    tracer.save(path)
+    events = json.loads(path.read_text())["traceEvents"]
+
+    assert [event["name"] for event in events] == ["inner", "outer"]
+    assert all(event["ph"] == "X" for event in events)
+    inner, outer = events
+    assert inner["args"] == {"texts": 3, "extra": True}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_tracer_records_peak_memory():
+    tracer = Tracer(memory=True)
+    try:
+        with tracer.span("outer"):
+            with tracer.span("allocate"):
+                data = bytearray(5_000_000)
+            del data
+    finally:
+        tracemalloc.stop()
+
+    peaks = {event["name"]: event["args"]["peak_memory_mb"] for event in tracer.events}
+    assert peaks["allocate"] >= 5
+    assert peaks["outer"] >= peaks["allocate"]
+    assert "Peak (MB)" in tracer.summary()
+
+
+def test_complete_chat_records_span(monkeypatch, tracer):
+    monkeypatch.setattr("conlang_gpt.openai.response_cache", None)
+    monkeypatch.setattr(
+        openai.ChatCompletion,
+        "create",
+        lambda **kwargs: {"usage": {"prompt_tokens": 10, "completion_tokens": 5}},
+    )
+
+    complete_chat(model="gpt-4", messages=[])
+
+    (event,) = tracer.events
+    assert event["name"] == "complete chat"
+    assert event["args"] == {
+        "model": "gpt-4",
+        "retries": 0,
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+    }
+
+
+def test_trace_option_saves_trace_and_prints_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "conlang_gpt.command.create.generate_language", lambda *args: "Guide"
+    )
+    trace_path = tmp_path / "out.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--no-cache",
+            "--trace",
+            str(trace_path),
+            "create",
+            "--design-goals",
+            "Simple",
+            "--guide",
+            str(tmp_path / "guide.md"),
+        ],
+    )
+    set_tracer(None)
+
+    assert result.exit_code == 0, result.output
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["create"]
+    assert "Total (s)" in result.stderr